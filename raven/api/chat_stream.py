@@ -1,123 +1,116 @@
-import datetime
-from pypika import Case
 import frappe
 from frappe import _
 from frappe.query_builder import Order
+from frappe.utils import add_to_date, cint, get_datetime, now_datetime
+
+from raven.message_cache import get_buffer_version, get_recent_messages
+from raven.raven_messaging.doctype.raven_message_tombstone.raven_message_tombstone import (
+	get_tombstone_cutoff,
+)
 from raven.utils import track_channel_visit
 
+# A transaction which started before a call to `get_channel_changes` but is committed after it
+# writes a `modified` older than the cursor of that call. The cursor of the last page lags behind
+# by this window (in seconds), so such changes are returned by the next call
+CURSOR_SAFETY_WINDOW = 60
+
 
 @frappe.whitelist()
-def get_messages(channel_id: str, limit: int = 10, base_message: str | None = None):
+def get_messages(
+	channel_id: str, limit: int = 10, base_message: str | None = None, format: str = "dict"
+):
 	"""
 	API to get list of messages for a channel, ordered by creation date (newest first)
 
+	With `format="columnar"`, the messages are sent in the compact form of `to_columnar`
 	"""
 
+	# Read before the first query, so that the buffer is not filled from an older snapshot
+	version = None if base_message else get_buffer_version(channel_id)
+
 	# Check permission for channel access
 	if not frappe.has_permission(doctype="Raven Channel", doc=channel_id, ptype="read"):
 		frappe.throw(_("You do not have permission to access this channel"), frappe.PermissionError)
 
 	# Fetch messages for the channel
 	if base_message:
-		return get_messages_around_base(channel_id, base_message)
+		return format_messages(get_messages_around_base(channel_id, base_message), format)
 
-	# Cannot use `get_all` as it does not apply the `order_by` clause to multiple fields
-	message = frappe.qb.DocType("Raven Message")
+	# The newest page is served from the recent messages buffer of the channel when it fits
+	messages, has_old_messages = get_recent_messages(channel_id, limit, version)
 
-	messages = (
-		frappe.qb.from_(message)
-		.select(
-			message.name,
-			message.owner,
-			message.creation,
-			message.modified,
-		    Case()
-			.when(message.is_retracted == 1, None)
-			.else_(message.text)
-			.as_('text'),
-			message.file,
-			message.message_type,
-			message.message_reactions,
-			message.is_reply,
-			message.linked_message,
-			message._liked_by,
-			message.channel_id,
-			message.thumbnail_width,
-			message.thumbnail_height,
-			message.file_thumbnail,
-			message.link_doctype,
-			message.link_document,
-			message.replied_message_details,
-			Case()
-			.when(message.is_retracted == 1, None)
-			.else_(message.content)
-			.as_('content'),
-			message.is_edited,
-			message.is_forwarded,
-			message.poll_id,
-			message.is_bot_message,
-			message.bot,
-			message.hide_link_preview,
-			message.is_thread,
-			message.blurhash,
-			message.is_retracted,
-		)
-		.where(message.channel_id == channel_id)
-		.orderby(message.creation, order=Order.desc)
-		.orderby(message.name, order=Order.desc)
-		.limit(limit)
-		.run(as_dict=True)
+	track_channel_visit(channel_id=channel_id, commit=True)
+	return format_messages(
+		{
+			"messages": messages,
+			"has_old_messages": has_old_messages,
+			"has_new_messages": False,
+		},
+		format,
 	)
 
-	has_old_messages = False
-
-	# Check if older messages are available
-	if len(messages) == limit:
-		# Check if there are more messages available
-		older_message = frappe.db.get_all(
-			"Raven Message",
-			pluck="name",
-			filters={"channel_id": channel_id, "creation": ("<", messages[-1].creation)},
-			order_by="creation desc, name desc",
-			limit=1,
+
+def get_messages_around_base(channel_id: str, base_message: str, limit: int = 10):
+	"""
+	Get 10 messages before base message and 10 messages after (including the base message)
+
+	Both sides are fetched in a single UNION query. The base message is joined in the query itself,
+	so its timestamp does not need to be looked up separately. Each side fetches one extra message
+	to know if older/newer messages are available.
+	"""
+	message = frappe.qb.DocType("Raven Message")
+	base = frappe.qb.DocType("Raven Message").as_("base")
+
+	def get_window_query(condition, order):
+		return (
+			frappe.qb.from_(message)
+			.join(base)
+			.on(base.name == base_message)
+			.select(*get_message_fields(message))
+			.where(message.channel_id == channel_id)
+			.where(condition)
+			.orderby(message.seq, order=order)
+			.limit(limit + 1)
 		)
 
-		if len(older_message) > 0:
-			has_old_messages = True
+	older_query = get_window_query(message.seq < base.seq, Order.desc)
+	newer_query = get_window_query(message.seq >= base.seq, Order.asc)
 
-	track_channel_visit(channel_id=channel_id, commit=True)
-	return {
-		"messages": messages,
-		"has_old_messages": has_old_messages,
-		"has_new_messages": False,
-	}
+	rows = older_query.union_all(newer_query).run(as_dict=True)
 
+	# The base message is the oldest message of the newer side - it is only there if it is in the channel
+	base_row = next((row for row in rows if row.name == base_message), None)
+	if not base_row:
+		frappe.throw(
+			_("Message {0} not found in channel {1}").format(base_message, channel_id),
+			frappe.DoesNotExistError,
+		)
 
-def get_messages_around_base(channel_id: str, base_message: str):
-	"""
-	Get 10 messages before base message and 10 messages after
-	"""
-	# Fetch older messages for the channel
-	from_timestamp = frappe.get_cached_value("Raven Message", base_message, "creation")
+	older_messages = []
+	newer_messages = []
+	for row in rows:
+		if row.seq < base_row.seq:
+			older_messages.append(row)
+		else:
+			newer_messages.append(row)
 
-	# TODO: Optimize this to use a complex SQL query to fetch around the main message
-	older_messages = fetch_older_messages(channel_id, base_message, from_timestamp, 10)
-	newer_messages = fetch_newer_messages(
-		channel_id, base_message, from_timestamp, 10, include_from_message=True
-	)
+	older_messages.sort(key=lambda row: row.seq, reverse=True)
+	newer_messages.sort(key=lambda row: row.seq, reverse=True)
 
-	combined_messages = newer_messages.get("messages", []) + older_messages.get("messages", [])
+	has_old_messages = len(older_messages) > limit
+	has_new_messages = len(newer_messages) > limit
 
 	return {
-		**older_messages,
-		**newer_messages,
-		"messages": combined_messages,
-		"from_timestamp": from_timestamp,
+		# Newest first
+		"messages": newer_messages[-limit:] + older_messages[:limit],
+		"has_old_messages": has_old_messages,
+		"has_new_messages": has_new_messages,
+		"from_timestamp": base_row.creation,
 	}
 
 
 @frappe.whitelist()
-def get_older_messages(channel_id: str, from_message: str, limit: int = 10):
+def get_older_messages(channel_id: str, from_message: str, limit: int = 10, format: str = "dict"):
 	"""
 	API to get older messages for a channel, ordered by creation date (newest first)
 
@@ -128,85 +121,33 @@ def get_older_messages(channel_id: str, from_message: str, limit: int = 10):
 	if not frappe.has_permission(doctype="Raven Channel", doc=channel_id, ptype="read"):
 		frappe.throw(_("You do not have permission to access this channel"), frappe.PermissionError)
 	# Fetch older messages for the channel
-	from_timestamp = frappe.get_cached_value("Raven Message", from_message, "creation")
+	from_seq = frappe.get_cached_value("Raven Message", from_message, "seq")
 
-	return fetch_older_messages(channel_id, from_message, from_timestamp, limit)
+	return format_messages(fetch_older_messages(channel_id, from_seq, limit), format)
 
 
-def fetch_older_messages(
-	channel_id: str, from_message: str, from_timestamp: datetime.datetime, limit: int = 10
-):
-	# Cannot use `get_all` as it does not apply the `order_by` clause to multiple fields
+def fetch_older_messages(channel_id: str, from_seq: int, limit: int = 10):
 	message = frappe.qb.DocType("Raven Message")
 
 	messages = (
 		frappe.qb.from_(message)
-		.select(
-			message.name,
-			message.owner,
-			message.creation,
-			message.modified,
-			message.text,
-			message.file,
-			message.message_type,
-			message.message_reactions,
-			message.is_reply,
-			message.linked_message,
-			message._liked_by,
-			message.channel_id,
-			message.thumbnail_width,
-			message.thumbnail_height,
-			message.file_thumbnail,
-			message.link_doctype,
-			message.link_document,
-			message.replied_message_details,
-			message.content,
-			message.is_edited,
-			message.is_forwarded,
-			message.poll_id,
-			message.is_bot_message,
-			message.bot,
-			message.hide_link_preview,
-			message.is_thread,
-			message.blurhash,
-			message.is_retracted,
-		)
+		.select(*get_message_fields(message))
 		.where(message.channel_id == channel_id)
-		.where(
-			(message.creation < from_timestamp)
-			| ((message.creation == from_timestamp) & (message.name < from_message))
-		)
-		.orderby(message.creation, order=Order.desc)
-		.orderby(message.name, order=Order.desc)
-		.limit(limit)
+		.where(message.seq < from_seq)
+		.orderby(message.seq, order=Order.desc)
+		# Fetch one extra message to know if older messages are available
+		.limit(limit + 1)
 		.run(as_dict=True)
 	)
 
-	has_old_messages = False
-
-	# Check if older messages are available
-	if len(messages) == limit:
-		# Check if there are more messages available
-		older_message = frappe.db.get_all(
-			"Raven Message",
-			pluck="name",
-			filters={
-				"channel_id": channel_id,
-				"creation": ("<=", messages[-1].creation),
-				"name": ["!=", messages[-1].name],
-			},
-			order_by="creation desc, name desc",
-			limit=1,
-		)
-
-		if len(older_message) > 0:
-			has_old_messages = True
+	has_old_messages = len(messages) > limit
+	del messages[limit:]
 
 	return {"messages": messages, "has_old_messages": has_old_messages}
 
 
 @frappe.whitelist()
-def get_newer_messages(channel_id: str, from_message: str, limit: int = 10):
+def get_newer_messages(channel_id: str, from_message: str, limit: int = 10, format: str = "dict"):
 	"""
 	API to get older messages for a channel, ordered by creation date (newest first)
 	"""
@@ -216,11 +157,9 @@ def get_newer_messages(channel_id: str, from_message: str, limit: int = 10):
 		frappe.throw(_("You do not have permission to access this channel"), frappe.PermissionError)
 
 	# Fetch older messages for the channel
-	from_timestamp = frappe.get_cached_value("Raven Message", from_message, "creation")
+	from_seq = frappe.get_cached_value("Raven Message", from_message, "seq")
 
-	response = fetch_newer_messages(
-		channel_id, from_message, from_timestamp, limit, include_from_message=False
-	)
+	response = fetch_newer_messages(channel_id, from_seq, limit, include_from_message=False)
 
 	if response.get("has_new_messages") == False:
 		# If no newer messages are available, we can track it as a visit to the channel
@@ -229,89 +168,205 @@ def get_newer_messages(channel_id: str, from_message: str, limit: int = 10):
 		# Now if the user scrolls to the bottom, we need to update the unread count
 		track_channel_visit(channel_id=channel_id, commit=True, publish_event_for_user=True)
 
-	return response
+	return format_messages(response, format)
 
 
 def fetch_newer_messages(
-	channel_id: str,
-	from_message: str,
-	from_timestamp: datetime.datetime,
-	limit: int = 10,
-	include_from_message: bool = False,
+	channel_id: str, from_seq: int, limit: int = 10, include_from_message: bool = False
 ):
 
 	message = frappe.qb.DocType("Raven Message")
 
 	if include_from_message:
-		condition = (message.creation > from_timestamp) | (
-			(message.creation == from_timestamp) & (message.name >= from_message)
-		)
-
+		condition = message.seq >= from_seq
 	else:
-		condition = (message.creation > from_timestamp) | (
-			(message.creation == from_timestamp) & (message.name > from_message)
-		)
+		condition = message.seq > from_seq
 
 	messages = (
 		frappe.qb.from_(message)
-		.select(
-			message.name,
-			message.owner,
-			message.creation,
-			message.modified,
-			message.text,
-			message.file,
-			message.message_type,
-			message.message_reactions,
-			message.is_reply,
-			message.linked_message,
-			message._liked_by,
-			message.channel_id,
-			message.thumbnail_width,
-			message.thumbnail_height,
-			message.file_thumbnail,
-			message.link_doctype,
-			message.link_document,
-			message.replied_message_details,
-			message.content,
-			message.is_edited,
-			message.is_forwarded,
-			message.poll_id,
-			message.is_bot_message,
-			message.bot,
-			message.hide_link_preview,
-			message.is_thread,
-			message.blurhash,
-			message.is_retracted,
-		)
+		.select(*get_message_fields(message))
 		.where(message.channel_id == channel_id)
 		.where(condition)
-		.orderby(message.creation, order=Order.asc)
-		.orderby(message.name, order=Order.asc)
-		.limit(limit)
+		.orderby(message.seq, order=Order.asc)
+		# Fetch one extra message to know if newer messages are available
+		.limit(limit + 1)
 		.run(as_dict=True)
 	)
 
-	has_new_messages = False
-
-	# Check if newer messages are available
-	if len(messages) == limit:
-		# Check if there are more messages available
-		newer_message = frappe.db.get_all(
-			"Raven Message",
-			pluck="name",
-			filters={
-				"channel_id": channel_id,
-				"creation": (">=", messages[-1].creation),
-				"name": ["!=", messages[-1].name],
-			},
-			order_by="creation asc, name asc",
-			limit=1,
-		)
-
-		if len(newer_message) > 0:
-			has_new_messages = True
+	has_new_messages = len(messages) > limit
+	del messages[limit:]
 
 	# The messages are in ascending order, so reverse them
 	messages.reverse()
 	return {"messages": messages, "has_new_messages": has_new_messages}
+
+
+@frappe.whitelist()
+def get_channel_changes(channel_id: str, modified: str, name: str | None = None, limit: int = 100):
+	"""
+	API to get the changes to the messages of a channel since a (modified, name) cursor, oldest first
+
+	Used by clients to catch up after a reconnect instead of reloading whole pages.
+	Messages created after the cursor are returned in `created`, messages edited, retracted or reacted to
+	in `updated` and the IDs of deleted messages in `deleted`. The returned `cursor` is passed back on the
+	next call. If the cursor is older than the deletion tombstones are kept, `full_reload` is set and the
+	client should load the channel with `get_messages` again.
+
+	The cursor of the last page is at most `now - CURSOR_SAFETY_WINDOW`, so the latest changes can
+	be returned again by the next call - clients skip the changes they already applied.
+	"""
+
+	# Check permission for channel access
+	if not frappe.has_permission(doctype="Raven Channel", doc=channel_id, ptype="read"):
+		frappe.throw(_("You do not have permission to access this channel"), frappe.PermissionError)
+
+	from_timestamp = get_datetime(modified)
+	from_name = name or ""
+	limit = cint(limit)
+
+	if from_timestamp < get_tombstone_cutoff():
+		return {"full_reload": True}
+
+	message = frappe.qb.DocType("Raven Message")
+	tombstone = frappe.qb.DocType("Raven Message Tombstone")
+
+	messages = (
+		frappe.qb.from_(message)
+		.select(*get_message_fields(message))
+		.where(message.channel_id == channel_id)
+		.where(
+			(message.modified > from_timestamp)
+			| ((message.modified == from_timestamp) & (message.name > from_name))
+		)
+		.orderby(message.modified, order=Order.asc)
+		.orderby(message.name, order=Order.asc)
+		# Fetch one extra change to know if more changes are available
+		.limit(limit + 1)
+		.run(as_dict=True)
+	)
+
+	# The creation of a tombstone is the time of the deletion
+	deleted_messages = (
+		frappe.qb.from_(tombstone)
+		.select(tombstone.message.as_("name"), tombstone.creation.as_("modified"))
+		.where(tombstone.channel_id == channel_id)
+		.where(
+			(tombstone.creation > from_timestamp)
+			| ((tombstone.creation == from_timestamp) & (tombstone.message > from_name))
+		)
+		.orderby(tombstone.creation, order=Order.asc)
+		.orderby(tombstone.message, order=Order.asc)
+		.limit(limit + 1)
+		.run(as_dict=True)
+	)
+
+	for row in deleted_messages:
+		row.is_deleted = True
+
+	changes = sorted(messages + deleted_messages, key=lambda row: (row.modified, row.name))
+	has_more = len(changes) > limit
+	del changes[limit:]
+
+	created = []
+	updated = []
+	deleted = []
+	for row in changes:
+		if row.is_deleted:
+			deleted.append(row.name)
+			continue
+
+		if row.is_retracted:
+			row.text = None
+			row.content = None
+
+		if row.creation > from_timestamp:
+			created.append(row)
+		else:
+			updated.append(row)
+
+	# The cursor of the next page is exact, so that paging does not return the same page again
+	last_change = changes[-1] if changes else frappe._dict(modified=from_timestamp, name=name)
+	safe_until = add_to_date(now_datetime(), seconds=-CURSOR_SAFETY_WINDOW)
+	if has_more or last_change.modified <= safe_until:
+		cursor = {"modified": last_change.modified, "name": last_change.name}
+	else:
+		cursor = {"modified": safe_until, "name": None}
+
+	return {
+		"created": created,
+		"updated": updated,
+		"deleted": deleted,
+		"cursor": cursor,
+		"has_more": has_more,
+	}
+
+
+def format_messages(response: dict, response_format: str = "dict"):
+	"""
+	Convert the messages of a chat stream response to the requested format - "dict" (default) or "columnar"
+	"""
+	if response_format == "dict":
+		return response
+
+	if response_format != "columnar":
+		frappe.throw(_("Invalid format {0}").format(response_format))
+
+	response["messages"] = to_columnar(response["messages"])
+	response["format"] = "columnar"
+	return response
+
+
+def to_columnar(messages: list) -> dict:
+	"""
+	Compact form of a list of messages - the column names are sent once, followed by a list of values
+	per message (in the same order as the columns).
+	Columns which are null for every message are left out, the client should treat them as null.
+	"""
+	if not messages:
+		return {"columns": [], "rows": []}
+
+	columns = [
+		column for column in messages[0] if any(message[column] is not None for message in messages)
+	]
+
+	return {
+		"columns": columns,
+		"rows": [[message[column] for column in columns] for message in messages],
+	}
+
+
+def get_message_fields(message):
+	"""
+	Fields of a message which are sent to the chat stream
+	"""
+	return [
+		message.name,
+		message.seq,
+		message.owner,
+		message.creation,
+		message.modified,
+		message.text,
+		message.file,
+		message.message_type,
+		message.message_reactions,
+		message.is_reply,
+		message.linked_message,
+		message._liked_by,
+		message.channel_id,
+		message.thumbnail_width,
+		message.thumbnail_height,
+		message.file_thumbnail,
+		message.link_doctype,
+		message.link_document,
+		message.replied_message_details,
+		message.content,
+		message.is_edited,
+		message.is_forwarded,
+		message.poll_id,
+		message.is_bot_message,
+		message.bot,
+		message.hide_link_preview,
+		message.is_thread,
+		message.blurhash,
+		message.is_retracted,
+	]
@@ -3,6 +3,71 @@ from frappe import _
 from frappe.query_builder import Order
 from frappe.query_builder.functions import Count
 
+from raven.utils import is_channel_member
+
+
+def get_mention_condition(mention, own_mention):
+	"""
+	Mentions of the current user - either a mention of the user or an @all mention on a channel
+	the user is a member of (the channel membership is checked by the caller).
+
+	Once the user reads or hides an @all mention, a mention row is created for them on the message
+	(see get_mention_for_user) - that row takes precedence over the @all mention
+	"""
+	return (mention.user == frappe.session.user) | (
+		(mention.user == "all") & own_mention.name.isnull()
+	)
+
+
+def get_mention_for_user(mention_id: str):
+	"""
+	Get the mention row of the current user.
+
+	If the mention is an @all mention, the state of the current user is stored in a separate row on the message
+	which is created the first time the user reads or hides the mention
+	"""
+	mention = frappe.db.get_value(
+		"Raven Mention",
+		mention_id,
+		["name", "parent", "parenttype", "parentfield", "user", "is_hidden", "is_read"],
+		as_dict=True,
+	)
+
+	if not mention:
+		frappe.throw(f"Mention {mention_id} not found")
+
+	if mention.user != "all":
+		return mention
+
+	# An @all mention only applies to the members of the channel
+	channel_id = frappe.db.get_value("Raven Message", mention.parent, "channel_id")
+	if not is_channel_member(channel_id):
+		frappe.throw(_("You are not a member of this channel"), frappe.PermissionError)
+
+	own_mention = frappe.db.get_value(
+		"Raven Mention",
+		{"parent": mention.parent, "user": frappe.session.user},
+		["name", "parent", "parenttype", "parentfield", "user", "is_hidden", "is_read"],
+		as_dict=True,
+	)
+
+	if own_mention:
+		return own_mention
+
+	own_mention = frappe.get_doc(
+		{
+			"doctype": "Raven Mention",
+			"parent": mention.parent,
+			"parenttype": mention.parenttype,
+			"parentfield": mention.parentfield,
+			"user": frappe.session.user,
+			"idx": frappe.db.count("Raven Mention", {"parent": mention.parent}) + 1,
+		}
+	)
+	own_mention.db_insert()
+
+	return own_mention
+
 
 @frappe.whitelist(methods=["POST"])
 def get_mentions(limit: int = 10, start: int = 0):
@@ -16,6 +81,7 @@ def get_mentions(limit: int = 10, start: int = 0):
 		return []
 
 	mention = frappe.qb.DocType("Raven Mention")
+	own_mention = frappe.qb.DocType("Raven Mention").as_("own_mention")
 	message = frappe.qb.DocType("Raven Message")
 	channel = frappe.qb.DocType("Raven Channel")
 	channel_member = frappe.qb.DocType("Raven Channel Member")
@@ -46,7 +112,9 @@ def get_mentions(limit: int = 10, start: int = 0):
 		.on(
 			(channel.name == channel_member.channel_id) & (channel_member.user_id == frappe.session.user)
 		)
-		.where(mention.user == frappe.session.user)
+		.left_join(own_mention)
+		.on((own_mention.parent == mention.parent) & (own_mention.user == frappe.session.user))
+		.where(get_mention_condition(mention, own_mention))
 		.where(message.owner != frappe.session.user)
 		.where(channel_member.user_id == frappe.session.user)
 		.where(mention.is_hidden != 1)
@@ -76,6 +144,7 @@ def get_unread_mention_count():
 	"""
 
 	mention = frappe.qb.DocType("Raven Mention")
+	own_mention = frappe.qb.DocType("Raven Mention").as_("own_mention")
 	message = frappe.qb.DocType("Raven Message")
 	channel = frappe.qb.DocType("Raven Channel")
 	channel_member = frappe.qb.DocType("Raven Channel Member")
@@ -89,7 +158,10 @@ def get_unread_mention_count():
 			(channel.name == channel_member.channel_id)
 			& (channel_member.user_id == frappe.session.user)
 		)
-		.where(mention.user == frappe.session.user)
+		.left_join(own_mention).on(
+			(own_mention.parent == mention.parent) & (own_mention.user == frappe.session.user)
+		)
+		.where(get_mention_condition(mention, own_mention))
 		.where(mention.is_read != 1)
         .where(mention.is_hidden != 1)
 		.where(channel_member.user_id == frappe.session.user)
@@ -108,17 +180,15 @@ def toggle_mention_hidden():
     if not mention_id:
         frappe.throw("Missing mention_id")
 
-    current_status = frappe.db.get_value("Raven Mention", mention_id, "is_hidden")
-    if current_status is None:
-        frappe.throw(f"Mention {mention_id} not found")
+    mention = get_mention_for_user(mention_id)
 
-    new_status = 0 if current_status else 1
+    new_status = 0 if mention.is_hidden else 1
 
-    frappe.db.set_value("Raven Mention", mention_id, "is_hidden", new_status)
+    frappe.db.set_value("Raven Mention", mention.name, "is_hidden", new_status)
 
     return {
         "status": "success",
-        "mention_id": mention_id,
+        "mention_id": mention.name,
         "is_hidden": new_status
     }
 
@@ -130,10 +200,12 @@ def mark_mention_as_read():
     if not mention_id:
         frappe.throw("Missing mention_id")
 
-    frappe.db.set_value("Raven Mention", mention_id, "is_read", 1)
+    mention = get_mention_for_user(mention_id)
+
+    frappe.db.set_value("Raven Mention", mention.name, "is_read", 1)
 
     return {
         "status": "success",
-        "mention_id": mention_id,
+        "mention_id": mention.name,
         "is_read": 1
     }
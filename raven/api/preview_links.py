@@ -4,74 +4,102 @@ import re
 import frappe
 from linkpreview import Link, LinkGrabber, LinkPreview, link_preview
 
+EMPTY_PREVIEW = {
+	"title": "",
+	"description": "",
+	"image": "",
+	"force_title": "",
+	"absolute_image": "",
+	"site_name": "",
+}
+
 
 @frappe.whitelist(methods=["GET"])
 def get_preview_link(urls):
 
-	data = {}
-	empty_data = {
-		"title": "",
-		"description": "",
-		"image": "",
-		"force_title": "",
-		"absolute_image": "",
-		"site_name": "",
-	}
 	message_links = []
 
 	if urls and urls != "[]":
 		urls = json.loads(urls)
 
 		for url in urls:
-			data = frappe.cache().get_value(url)
-			if data == None:
-				# Don't try to preview insecure links like IP addresses
-				# If URL is an IP address, or starts with mailto or tel, don't preview. Just return empty data
-				if (
-					url.startswith("mailto")
-					or url.startswith("tel")
-					or re.match(r"http://\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}/.*", url)
-					or re.match(r"https://\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}/.*", url)
-					or re.match(r"http://\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}", url)
-					or re.match(r"https://\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}", url)
-				):
-					data = empty_data
-				else:
-					preview = None
-					try:
-						# If this is a Twitter/X URL, then we need to fetch the preview from the Twitter API
-						# This is because the linkpreview library doesn't support Twitter previews with the default bot
-						if "twitter.com" in url or "x.com" in url:
-							grabber = LinkGrabber()
-							content, url_fetched = grabber.get_content(url, headers="imessagebot")
-							link = Link(url_fetched, content)
-							preview = LinkPreview(link)
-						else:
-							preview = link_preview(url)
-					except Exception:
-						preview = None
-						pass
-					if preview == None:
-						data = empty_data
-					else:
-
-						# Description might have emojis in them, which comes in with special characters like copyright etc
-						# TODO: We need to replace these special characters with the actual emojis
-
-						data = {
-							"title": preview.title,
-							"description": preview.description,
-							"image": preview.image,
-							"force_title": preview.force_title,
-							"absolute_image": preview.absolute_image,
-							"site_name": preview.site_name,
-						}
-					frappe.cache().set_value(url, data)
-			message_links.append(data)
+			message_links.append(get_link_preview(url))
 
 	return message_links
 
 
+def get_link_preview(url: str) -> dict:
+	"""
+	Get the preview of a URL - fetched once and cached
+	"""
+	data = frappe.cache().get_value(url)
+	if data is not None:
+		return data
+
+	# Don't try to preview insecure links like IP addresses
+	# If URL is an IP address, or starts with mailto or tel, don't preview. Just return empty data
+	if (
+		url.startswith("mailto")
+		or url.startswith("tel")
+		or re.match(r"http://\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}/.*", url)
+		or re.match(r"https://\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}/.*", url)
+		or re.match(r"http://\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}", url)
+		or re.match(r"https://\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}", url)
+	):
+		data = EMPTY_PREVIEW
+	else:
+		preview = None
+		try:
+			# If this is a Twitter/X URL, then we need to fetch the preview from the Twitter API
+			# This is because the linkpreview library doesn't support Twitter previews with the default bot
+			if "twitter.com" in url or "x.com" in url:
+				grabber = LinkGrabber()
+				content, url_fetched = grabber.get_content(url, headers="imessagebot")
+				link = Link(url_fetched, content)
+				preview = LinkPreview(link)
+			else:
+				preview = link_preview(url)
+		except Exception:
+			preview = None
+			pass
+		if preview == None:
+			data = EMPTY_PREVIEW
+		else:
+
+			# Description might have emojis in them, which comes in with special characters like copyright etc
+			# TODO: We need to replace these special characters with the actual emojis
+
+			data = {
+				"title": preview.title,
+				"description": preview.description,
+				"image": preview.image,
+				"force_title": preview.force_title,
+				"absolute_image": preview.absolute_image,
+				"site_name": preview.site_name,
+			}
+	frappe.cache().set_value(url, data)
+	return data
+
+
+def prefetch_link_previews(message_ids: list):
+	"""
+	Fetch the previews of the links of new messages (from the link index) before the clients ask for them.
+	Only the first link of a message is previewed.
+	"""
+	message_link = frappe.qb.DocType("Raven Message Link")
+	urls = (
+		frappe.qb.from_(message_link)
+		.select(message_link.url)
+		.distinct()
+		.where(message_link.parenttype == "Raven Message")
+		.where(message_link.parent.isin(message_ids))
+		.where(message_link.idx == 1)
+	).run(pluck=True)
+
+	for url in urls:
+		get_link_preview(url)
+
+
 @frappe.whitelist(methods=["POST"])
 def hide_link_preview(message_id: str):
 	"""
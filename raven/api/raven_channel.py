@@ -3,41 +3,54 @@ from frappe import _
 from frappe.query_builder import Order
 
 from raven.api.raven_users import get_current_raven_user
-from raven.utils import get_channel_members, is_channel_member, track_channel_visit
+from raven.raven_channel_management.doctype.raven_channel.raven_channel import get_dm_channel_id
+from raven.read_markers import get_last_visit_term
+from raven.sidebar import (
+	get_response_version,
+	get_sidebar_channels,
+	get_sidebar_version,
+	invalidate_sidebar,
+)
+from raven.unread_counts import get_unread_count_term
+from raven.utils import (
+	get_channel_members,
+	get_channel_members_many,
+	is_channel_member,
+	track_channel_visit,
+)
 
 from frappe.query_builder import DocType
 
 
 
 @frappe.whitelist()
-def get_all_channels(hide_archived=True):
+def get_all_channels(hide_archived=True, version=None):
     """
     Trả về danh sách channel (gồm group và DMs) mà user hiện tại là thành viên.
     Bao gồm trạng thái is_done và user_labels (các nhãn do user gán vào channel).
+
+    The list is built from the sidebar snapshot of the user (see raven.sidebar). The response has a
+    `version` - pass it back as `version` to get `{"version": ..., "not_modified": True}` when nothing changed.
     """
 
+    # Read before the first query, so that the snapshot is not built from an older database snapshot
+    sidebar_version = get_sidebar_version(frappe.session.user)
+
     if hide_archived == "false":
         hide_archived = False
 
-    # Lấy danh sách channel đã enrich theo user
-    channels = get_channel_list(hide_archived)
-
-    # Bổ sung peer_user_id nếu là DM
-    parsed_channels = []
-    for channel in channels:
-        parsed_channels.append({
-            **channel,
-            "peer_user_id": get_peer_user_id(
-                channel.get("name"),
-                channel.get("is_direct_message"),
-                channel.get("is_self_message")
-            )
-        })
+    channels = get_sidebar_channels(frappe.session.user, hide_archived, sidebar_version)
 
-    return {
-        "channels": [c for c in parsed_channels if not c["is_direct_message"]],
-        "dm_channels": [c for c in parsed_channels if c["is_direct_message"]]
+    response = {
+        "channels": [c for c in channels if not c["is_direct_message"]],
+        "dm_channels": [c for c in channels if c["is_direct_message"]]
     }
+    response["version"] = get_response_version(response)
+
+    if version and version == response["version"]:
+        return {"version": version, "not_modified": True}
+
+    return response
 
 
 def get_channel_list(hide_archived=False):
@@ -217,10 +230,9 @@ def set_done_not_ok(channelID: str):
 @frappe.whitelist()
 def get_channels(hide_archived=False):
 	channels = get_channel_list(hide_archived)
+	peer_user_ids = get_peer_user_ids(channels)
 	for channel in channels:
-		peer_user_id = get_peer_user_id(
-			channel.get("name"), channel.get("is_direct_message"), channel.get("is_self_message")
-		)
+		peer_user_id = peer_user_ids[channel.get("name")]
 		channel["peer_user_id"] = peer_user_id
 		if peer_user_id:
 			user_full_name = frappe.get_cached_value("User", peer_user_id, "full_name")
@@ -260,6 +272,35 @@ def get_peer_user_id(
 	return None
 
 
+def get_peer_user_ids(channels: list) -> dict:
+	"""
+	For a list of channels, fetches the user id of the peer of every DM as a map of channel ID to user id.
+	The members of all the DMs are fetched at once.
+	"""
+	members = get_channel_members_many(
+		[
+			channel.get("name")
+			for channel in channels
+			if channel.get("is_direct_message") and not channel.get("is_self_message")
+		]
+	)
+
+	peer_user_ids = {}
+	for channel in channels:
+		if not channel.get("is_direct_message"):
+			peer_user_id = None
+		elif channel.get("is_self_message"):
+			peer_user_id = frappe.session.user
+		else:
+			peer_user_id = next(
+				(user_id for user_id in members.get(channel.get("name"), {}) if user_id != frappe.session.user),
+				None,
+			)
+		peer_user_ids[channel.get("name")] = peer_user_id
+
+	return peer_user_ids
+
+
 @frappe.whitelist(methods=["POST"])
 def create_direct_message_channel(user_id):
 	"""
@@ -269,18 +310,7 @@ def create_direct_message_channel(user_id):
 	2. If not, create a new channel
 	3. Check if the user_id is the current user and set is_self_message accordingly
 	"""
-	# TODO: this logic might break if the user_id changes
-	channel_name = frappe.db.get_value(
-		"Raven Channel",
-		filters={
-			"is_direct_message": 1,
-			"channel_name": [
-				"in",
-				[frappe.session.user + " _ " + user_id, user_id + " _ " + frappe.session.user],
-			],
-		},
-		fieldname="name",
-	)
+	channel_name = get_dm_channel_id(frappe.session.user, user_id)
 	if channel_name:
 		return channel_name
 	# create direct message channel with user and current user
@@ -293,7 +323,12 @@ def create_direct_message_channel(user_id):
 				"is_self_message": frappe.session.user == user_id,
 			}
 		)
-		channel.insert()
+		try:
+			channel.insert()
+		except frappe.UniqueValidationError:
+			# The channel was created by a concurrent request - the pair key is unique
+			frappe.clear_last_message()
+			return get_dm_channel_id(frappe.session.user, user_id, for_update=True)
 		return channel.name
 
 
@@ -394,6 +429,7 @@ def get_unread_channels():
     user = frappe.session.user
     channel = frappe.qb.DocType("Raven Channel")
     channel_member = frappe.qb.DocType("Raven Channel Member")
+    last_visit = get_last_visit_term(channel_member, user)
 
     query = (
         frappe.qb.from_(channel)
@@ -408,25 +444,19 @@ def get_unread_channels():
             channel.is_direct_message,
             channel.is_self_message,
             channel.last_message_timestamp,
-            channel_member.last_visit
-        )
-        .where(
-            (channel.last_message_timestamp.isnotnull())
-            & (
-                (channel_member.last_visit.isnull())
-                | (channel.last_message_timestamp > channel_member.last_visit)
-            )
+            last_visit.as_("last_visit")
         )
+        .where(channel.last_message_timestamp.isnotnull())
+        .where(get_unread_count_term(channel, channel_member, user) > 0)
         .orderby(channel.last_message_timestamp, order=Order.desc)
     )
 
     unread_channels = query.run(as_dict=True)
 
     # thêm peer_user_id nếu là direct message
+    peer_user_ids = get_peer_user_ids(unread_channels)
     for ch in unread_channels:
-        ch["peer_user_id"] = get_peer_user_id(
-            ch["name"], ch["is_direct_message"], ch["is_self_message"]
-        )
+        ch["peer_user_id"] = peer_user_ids[ch["name"]]
 
     return unread_channels
 
@@ -474,13 +504,9 @@ def get_done_channels():
     results = query.run(as_dict=True)
 
     # Bổ sung peer_user_id nếu là DM
+    peer_user_ids = get_peer_user_ids(results)
     for row in results:
-        if row.get("is_direct_message"):
-            row["peer_user_id"] = get_peer_user_id(
-                row["name"], row["is_direct_message"], row["is_self_message"]
-            )
-        else:
-            row["peer_user_id"] = None
+        row["peer_user_id"] = peer_user_ids[row["name"]]
 
         # Parse JSON string (nếu cần)
         if isinstance(row.get("last_message_details"), str):
@@ -503,6 +529,7 @@ def mark_channel_as_done(channel_id):
         "is_done",
         1
     )
+    invalidate_sidebar([user])
     frappe.publish_realtime(
         event="raven:channel_done_updated",
         message={"channel_id": channel_id, "is_done": 1},
@@ -522,6 +549,7 @@ def mark_channel_as_not_done(channel_id):
         "is_done",
         0
     )
+    invalidate_sidebar([user])
 
     frappe.publish_realtime(
         event="raven:channel_done_updated",
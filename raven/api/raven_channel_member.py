@@ -1,6 +1,7 @@
 import frappe
 from frappe import _
 
+from raven.read_markers import buffer_read_markers, get_buffered_channel_read_markers
 from raven.utils import delete_channel_members_cache, get_channel_member, track_channel_visit ,track_channel_seen
 
 
@@ -59,6 +60,11 @@ def get_seen_info(channel_id: str):
     if not channel_members:
         return []
 
+    # Seen markers which are not written to the database yet
+    buffered_seen_at = get_buffered_channel_read_markers(
+        channel_id, [m["user_id"] for m in channel_members], "seen_at"
+    )
+
 
     # Lấy danh sách user_id
     user_ids = [m["user_id"] for m in channel_members]
@@ -73,7 +79,7 @@ def get_seen_info(channel_id: str):
     return [
         {
             "user": m["user_id"],
-            "seen_at": m["seen_at"],
+            "seen_at": buffered_seen_at.get(m["user_id"], m["seen_at"]),
             "full_name": user_map[m["user_id"]]["full_name"],
             "user_image": user_map[m["user_id"]]["user_image"],
         }
@@ -106,23 +112,36 @@ def mark_channel_as_unread(channel_id):
     last_message = frappe.get_all(
         "Raven Message",
         filters={"channel_id": channel_id, "message_type": ["!=", "System"]},
-        order_by="creation desc",
+        order_by="seq desc",
         limit=1,
-        fields=["creation"],
+        fields=["creation", "seq", "countable_seq"],
     )
 
     if last_message:
         last_visit_time = last_message[0].creation
+        last_read_seq = last_message[0].seq
+        last_read_countable_seq = last_message[0].countable_seq
     else:
         last_visit_time = "2000-01-01 00:00:00"
-
-    channel_member = frappe.get_doc(
-        "Raven Channel Member",
-        {"channel_id": channel_id, "user_id": user},
+        last_read_seq = 0
+        last_read_countable_seq = 0
+
+    channel_member = get_channel_member(channel_id, user)
+    if not channel_member:
+        frappe.throw(_("You are not a member of this channel"), frappe.DoesNotExistError)
+
+    # Buffered like a visit - writing the markers to the database directly would race a flush
+    # which is writing an older visit
+    buffer_read_markers(
+        channel_member["name"],
+        channel_id,
+        user,
+        {
+            "last_visit": last_visit_time,
+            "last_read_seq": last_read_seq,
+            "last_read_countable_seq": last_read_countable_seq,
+        },
     )
-    channel_member.last_visit = last_visit_time
-    channel_member.save()
-    frappe.db.commit()
 
     # Gửi realtime event đến chính user để đồng bộ trên các thiết bị khác
     frappe.publish_realtime(
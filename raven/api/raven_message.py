@@ -1,14 +1,30 @@
-import json
 from datetime import timedelta
 import frappe
 from frappe import _
 from frappe.query_builder import JoinType, Order
 from frappe.query_builder.functions import Coalesce, Count, Max, Coalesce
-from raven.api.raven_channel import create_direct_message_channel, get_peer_user_id
-from raven.utils import get_channel_member, is_channel_member, track_channel_visit
+from raven.api.raven_channel import create_direct_message_channel, get_peer_user_ids
+from raven.message_cache import update_message_in_cache
+from raven.raven_messaging.doctype.raven_saved_message.raven_saved_message import (
+	add_saved_message,
+	remove_saved_message,
+)
+from raven.read_markers import get_read_marker_term
+from raven.search import remove_from_search_index
+from raven.unread_counts import get_unread_counts
+from raven.utils import (
+	get_channel_member,
+	get_channel_members,
+	get_linked_doctypes,
+	is_channel_member,
+	publish_realtime_to_users,
+	reset_channel_done_state,
+	track_channel_visit,
+)
 import datetime
-from frappe.utils import now_datetime, get_datetime
+from frappe.utils import cint, now_datetime, get_datetime
 from pypika import Case
+from pypika.terms import LiteralValue
 
 @frappe.whitelist(methods=["POST"])
 def send_message(
@@ -42,26 +58,8 @@ def send_message(
 
     doc.insert()
 
-    # ✅ RESET lại is_done = 0 cho các user đã từng đánh dấu là xong
-    done_members = frappe.get_all(
-        "Raven Channel Member",
-        filters={"channel_id": channel_id, "is_done": 1},
-        fields=["name", "user_id"]
-    )
-
-    if done_members:
-        for member in done_members:
-            frappe.db.set_value("Raven Channel Member", member.name, "is_done", 0)
-
-            frappe.publish_realtime(
-                event="raven:channel_done_updated",
-                message={
-                    "channel_id": channel_id,
-                    "is_done": 0
-                },
-                user=member.user_id,
-                after_commit=True
-            )
+    # ✅ RESET lại is_done = 0 cho các user đã từng đánh dấu là xong (1 UPDATE cho cả channel)
+    done_users = reset_channel_done_state(channel_id)
 
     # ✅ Cập nhật nội dung cuối cùng của channel
     message_type = doc.message_type or "Text"
@@ -86,19 +84,8 @@ def send_message(
     })
 
     # ✅ Gửi sự kiện realtime tới các user khác trong channel (không gửi cho người gửi)
-    members = frappe.get_all("Raven Channel Member", filters={"channel_id": channel_id}, pluck="user_id")
-
-    for member in members:
-        if member != frappe.session.user:
-            frappe.publish_realtime(
-                event="new_message",
-                message={
-                    "channel_id": channel_id,
-                    "user": frappe.session.user,
-                    "seen_at": frappe.utils.now_datetime(),
-                },
-                user=member
-            )
+    # Thành viên được đọc từ cache, tất cả sự kiện được gửi qua một pipeline Redis duy nhất
+    publish_message_sent_events(channel_id, done_users, frappe.utils.now_datetime())
 
     # ✅ Trả về message + client_id
     return {
@@ -106,6 +93,27 @@ def send_message(
         "client_id": client_id
     }
 
+
+def publish_message_sent_events(channel_id, done_users, seen_at):
+	"""
+	Notify channel members that a new message was sent:
+	1. `raven:channel_done_updated` to the members whose "done" state was reset
+	2. `new_message` to every member except the sender
+
+	Members are read from the channel members cache and all events go out in one Redis pipeline
+	"""
+	sender = frappe.session.user
+	other_members = [user_id for user_id in get_channel_members(channel_id) if user_id != sender]
+
+	publish_realtime_to_users(
+		[
+			("raven:channel_done_updated", {"channel_id": channel_id, "is_done": 0}, done_users),
+			("new_message", {"channel_id": channel_id, "user": sender, "seen_at": seen_at}, other_members),
+		],
+		after_commit=True,
+	)
+
+
 @frappe.whitelist()
 def fetch_recent_files(channel_id):
 	"""
@@ -125,39 +133,52 @@ def fetch_recent_files(channel_id):
 	return files
 
 
-def get_messages(channel_id):
+MESSAGE_BLOCK_FIELDS = [
+	"name",
+	"seq",
+	"owner",
+	"creation",
+	"modified",
+	"text",
+	"file",
+	"message_type",
+	"message_reactions",
+	"is_reply",
+	"linked_message",
+	"_liked_by",
+	"channel_id",
+	"thumbnail_width",
+	"thumbnail_height",
+	"file_thumbnail",
+	"link_doctype",
+	"link_document",
+	"replied_message_details",
+	"content",
+	"is_edited",
+	"is_thread",
+	"is_forwarded",
+]
+
+
+def get_message_page(channel_id: str, from_seq: int | None = None, limit: int = 50):
+	"""
+	Get `limit` messages before the sequence number `from_seq` (the newest messages if there is no cursor),
+	newest first. One extra message is fetched - it is the message before the page.
+	"""
+	message = frappe.qb.DocType("Raven Message")
 
-	messages = frappe.db.get_all(
-		"Raven Message",
-		filters={"channel_id": channel_id},
-		fields=[
-			"name",
-			"owner",
-			"creation",
-			"modified",
-			"text",
-			"file",
-			"message_type",
-			"message_reactions",
-			"is_reply",
-			"linked_message",
-			"_liked_by",
-			"channel_id",
-			"thumbnail_width",
-			"thumbnail_height",
-			"file_thumbnail",
-			"link_doctype",
-			"link_document",
-			"replied_message_details",
-			"content",
-			"is_edited",
-			"is_thread",
-			"is_forwarded",
-		],
-		order_by="creation asc",
+	query = (
+		frappe.qb.from_(message)
+		.select(*(message[field] for field in MESSAGE_BLOCK_FIELDS))
+		.where(message.channel_id == channel_id)
+		.orderby(message.seq, order=Order.desc)
+		.limit(limit + 1)
 	)
 
-	return messages
+	if from_seq:
+		query = query.where(message.seq < from_seq)
+
+	return query.run(as_dict=True)
 
 
 @frappe.whitelist()
@@ -180,23 +201,11 @@ def save_message(message_id, add=False, thread_id=None):
 		user=frappe.session.user,
 	)
 
-	# ✅ Nếu là hành động Save và có thread_id -> ghi vào json.saved_from_thread
-	if thread_id and not add == "No":
-		doc = frappe.get_doc("Raven Message", message_id)
-		json_data = doc.json or {}
-
-		if isinstance(json_data, str):
-			try:
-				json_data = json.loads(json_data)
-			except Exception:
-				json_data = {}
-
-		# Chỉ lưu nếu chưa có
-		if "saved_from_thread" not in json_data:
-			json_data["saved_from_thread"] = thread_id
-			doc.json = json_data
-			doc.flags.ignore_version = True
-			doc.save(ignore_permissions=True)
+	# ✅ Ghi vào bảng Raven Saved Message (index theo user) - thread_id được lưu thành saved_from_thread
+	if add == "Yes":
+		add_saved_message(message_id, frappe.session.user, thread_id)
+	else:
+		remove_saved_message(message_id, frappe.session.user)
 
 	# ✅ Lấy message sau khi cập nhật
 	message = frappe.db.get_value(
@@ -210,6 +219,16 @@ def save_message(message_id, add=False, thread_id=None):
 		as_dict=True,
 	)
 
+	if message:
+		# _liked_by is one of the columns in the recent messages buffer
+		update_message_in_cache(message.channel_id, message_id)
+
+		message["saved_from_thread"] = frappe.db.get_value(
+			"Raven Saved Message",
+			{"user": frappe.session.user, "message": message_id},
+			"saved_from_thread",
+		)
+
 	# ✅ Nếu có thread_id, thay thế channel_id trả về thành channel của message thread cha
 	if thread_id and message:
 		parent_channel_id = frappe.db.get_value("Raven Message", thread_id, "channel_id")
@@ -271,16 +290,27 @@ def get_saved_messages():
 	Không sắp xếp để giữ đúng thứ tự lưu trong hệ thống (nếu cần thứ tự khác, xử lý tại frontend).
 	"""
 
+	user = frappe.session.user
+	saved_message = frappe.qb.DocType("Raven Saved Message")
 	raven_message = frappe.qb.DocType("Raven Message")
+	thread_message = frappe.qb.DocType("Raven Message").as_("thread_message")
 	raven_channel = frappe.qb.DocType("Raven Channel")
 	raven_channel_member = frappe.qb.DocType("Raven Channel Member")
 
 	query = (
-		frappe.qb.from_(raven_message)
+		frappe.qb.from_(saved_message)
+		.join(raven_message)
+		.on(raven_message.name == saved_message.message)
 		.join(raven_channel, JoinType.left)
 		.on(raven_message.channel_id == raven_channel.name)
 		.join(raven_channel_member, JoinType.left)
-		.on(raven_channel.name == raven_channel_member.channel_id)
+		.on(
+			(raven_channel.name == raven_channel_member.channel_id)
+			& (raven_channel_member.user_id == user)
+		)
+		# Messages saved from a thread are shown in the channel of the thread
+		.join(thread_message, JoinType.left)
+		.on(thread_message.name == saved_message.saved_from_thread)
 		.select(
 			raven_message.name,
 			raven_message.owner,
@@ -289,7 +319,7 @@ def get_saved_messages():
 			.when(raven_message.is_retracted == 1, None)
 			.else_(raven_message.text)
 			.as_('text'),
-			raven_message.channel_id,
+			Coalesce(thread_message.channel_id, raven_message.channel_id).as_("channel_id"),
 			raven_message.file,
 			raven_message.message_type,
 			raven_message.message_reactions,
@@ -304,48 +334,31 @@ def get_saved_messages():
 			.else_(raven_message.content)
 			.as_('content'),
 			raven_message.is_retracted,
-			raven_message.json
+			saved_message.saved_from_thread,
 		)
-		.where(raven_message._liked_by.like(f"%{frappe.session.user}%"))
+		.where(saved_message.user == user)
 		.where(
 			(raven_channel.type.isin(["Open", "Public"]))
-			| (raven_channel_member.user_id == frappe.session.user)
+			| (raven_channel_member.name.isnotnull())
 		)
-		.distinct()
+		# In the order they were saved
+		.orderby(saved_message.name)
 	)
 
-	messages = query.run(as_dict=True)
-
-	# Parse thêm saved_from_thread
-	for msg in messages:
-		json_data = msg.get("json")
-		if isinstance(json_data, str):
-			try:
-				json_data = json.loads(json_data)
-			except Exception:
-				json_data = {}
-		elif not isinstance(json_data, dict):
-			json_data = {}
-
-		saved_from_thread = json_data.get("saved_from_thread")
-		msg["saved_from_thread"] = saved_from_thread
-		msg.pop("json", None)
+	return query.run(as_dict=True)
 
-		if saved_from_thread:
-			parent_channel_id = frappe.get_cached_value("Raven Message", saved_from_thread, "channel_id")
-			if parent_channel_id:
-				msg["channel_id"] = parent_channel_id
-
-	return messages
 
+def parse_messages(messages, previous_message=None):
+	"""
+	Add date headers and continuation flags to messages (oldest first).
 
-def parse_messages(messages):
+	`previous_message` is the message right before the first one - it is needed to parse a page of
+	messages the same way as if all the messages of the channel were parsed.
+	"""
 
 	messages_with_date_header = []
-	previous_message = None
 
-	for i in range(len(messages)):
-		message = messages[i]
+	for message in messages:
 		is_continuation = (
 			previous_message
 			and message["owner"] == previous_message["owner"]
@@ -353,7 +366,7 @@ def parse_messages(messages):
 		)
 		message["is_continuation"] = int(bool(is_continuation))
 
-		if i == 0 or message["creation"].date() != previous_message["creation"].date():
+		if not previous_message or message["creation"].date() != previous_message["creation"].date():
 			messages_with_date_header.append({"block_type": "date", "data": message["creation"].date()})
 
 		messages_with_date_header.append({"block_type": "message", "data": message})
@@ -375,77 +388,94 @@ def check_permission(channel_id):
 
 @frappe.whitelist()
 def get_messages_with_dates(channel_id):
+	"""
+	Date headers and message blocks of all the messages of a channel, for the Desk chat.
+
+	Loads the whole channel - use `get_message_blocks` to page through it instead.
+	"""
 	check_permission(channel_id)
-	messages = get_messages(channel_id)
+	messages = frappe.get_all(
+		"Raven Message",
+		filters={"channel_id": channel_id},
+		fields=MESSAGE_BLOCK_FIELDS,
+		order_by="seq asc",
+	)
 	track_channel_visit(channel_id=channel_id, publish_event_for_user=True, commit=True)
 	return parse_messages(messages)
 
 
+@frappe.whitelist()
+def get_message_blocks(channel_id: str, from_seq: int | None = None, limit: int = 50):
+	"""
+	Get the date headers and messages (oldest first) of `limit` messages older than the cursor.
+	Without a cursor, the newest messages of the channel are returned.
+
+	The extra message fetched before the page carries the continuation state over the page boundary,
+	so the blocks are the same as if the whole channel was parsed. Pass the returned `cursor` to load
+	the page before.
+	"""
+	check_permission(channel_id)
+	limit = cint(limit)
+	from_seq = cint(from_seq)
+
+	messages = get_message_page(channel_id, from_seq, limit)
+
+	previous_message = messages[limit] if len(messages) > limit else None
+	del messages[limit:]
+	messages.reverse()
+
+	if not from_seq:
+		track_channel_visit(channel_id=channel_id, publish_event_for_user=True, commit=True)
+
+	return {
+		"blocks": parse_messages(messages, previous_message),
+		"cursor": {"from_seq": messages[0].seq} if previous_message else None,
+		"has_more": bool(previous_message),
+	}
+
+
 @frappe.whitelist()
 def get_unread_count_for_channels():
     """
     Trả về danh sách các channel mà user đang tham gia,
     kèm theo số lượng tin nhắn chưa đọc và nội dung message mới nhất.
+
+    The counts come from the message sequence numbers (see raven.unread_counts) and the content is
+    read from the last message details of the channel, so no messages are scanned.
     """
     user = frappe.session.user
 
-    # Define DocTypes
     channel = frappe.qb.DocType("Raven Channel")
     channel_member = frappe.qb.DocType("Raven Channel Member")
-    message = frappe.qb.DocType("Raven Message")
 
-    # --- Query 1: Lấy số lượng tin nhắn chưa đọc ---
-    unread_query = (
+    channels = (
         frappe.qb.from_(channel)
-        .left_join(channel_member).on(
+        .join(channel_member).on(
             (channel.name == channel_member.channel_id) & (channel_member.user_id == user)
         )
-        .left_join(message).on(
-            (channel.name == message.channel_id)
-            & (message.message_type != "System")
-            & (message.creation > Coalesce(channel_member.last_visit, "2000-11-11"))
-        )
-        .where(channel_member.user_id == user)
         .where(channel.is_archived == 0)
         .where(channel.is_thread == 0)
-        .select(
-            channel.name.as_("channel"),
-            channel.is_direct_message,
-            Count(message.name).as_("unread_count")
-        )
-        .groupby(channel.name, channel.is_direct_message)
+        .select(channel.name, channel.is_direct_message, channel.last_message_details)
     ).run(as_dict=True)
 
-    # --- Query 2: Lấy message mới nhất (chỉ content) cho mỗi channel ---
-    latest_messages = (
-        frappe.qb.from_(message)
-        .select(
-            message.channel_id,
-            message.content,
-            Max(message.creation).as_("latest_time")
-        )
-        .where(message.message_type != "System")
-        .groupby(message.channel_id, message.content)
-    ).run(as_dict=True)
+    unread_counts = get_unread_counts([row.name for row in channels], user)
+
+    result = []
+    for row in channels:
+        unread_count = unread_counts.get(row.name, 0)
+        # Lọc chỉ lấy những channel có unread_count > 0
+        if unread_count <= 0:
+            continue
+
+        last_message_details = frappe.parse_json(row.last_message_details) or {}
+        result.append({
+            "name": row.name,
+            "is_direct_message": row.is_direct_message,
+            "unread_count": unread_count,
+            "last_message_content": last_message_details.get("content") or "",
+        })
 
-    # Convert to dict: {channel_id: content}
-    latest_content_map = {}
-    for msg in latest_messages:
-        cid = msg["channel_id"]
-        if cid not in latest_content_map or msg["latest_time"] > latest_content_map[cid]["latest_time"]:
-            latest_content_map[cid] = {
-                "content": msg["content"],
-                "latest_time": msg["latest_time"]
-            }
-
-    # Gộp kết quả
-    for row in unread_query:
-        row["name"] = row.pop("channel")
-        row["last_message_content"] = latest_content_map.get(row["name"], {}).get("content", "")
-    # Lọc chỉ lấy những channel có unread_count > 0
-    filtered_result = [row for row in unread_query if row["unread_count"] > 0]
-
-    return filtered_result
+    return result
 
 # @frappe.whitelist()
 # def get_unread_count_for_channels():
@@ -572,97 +602,148 @@ def get_unread_count_for_channels():
 
 @frappe.whitelist()
 def get_unread_count_for_channel(channel_id):
-    user = frappe.session.user
+    """
+    Số tin chưa đọc và tin nhắn mới nhất của một channel - see `get_unread_summary`
+    """
+    summary = get_unread_summary([channel_id])
+    if not summary:
+        raise frappe.DoesNotExistError(_("Channel {0} not found").format(channel_id))
 
-    # Lấy thông tin channel
-    channel_doc = frappe.get_cached_doc("Raven Channel", channel_id)
-
-    # Lấy thời gian last_visit
-    last_visit = frappe.db.get_value(
-        "Raven Channel Member",
-        {"channel_id": channel_id, "user_id": user},
-        "last_visit"
-    ) or "2000-11-11"
-
-    # Tính số tin chưa đọc
-    if channel_doc.is_direct_message or frappe.db.exists("Raven Channel Member", {"channel_id": channel_id, "user_id": user}):
-        unread_count = frappe.db.count(
-            "Raven Message",
-            filters={
-                "channel_id": channel_id,
-                "creation": (">", last_visit),
-                "message_type": ["!=", "System"],
-            },
-        )
-    elif channel_doc.type == "Open":
-        unread_count = frappe.db.count(
-            "Raven Message",
-            filters={
-                "channel_id": channel_id,
-                "message_type": ["!=", "System"],
-            },
-        )
-    else:
-        unread_count = 0
-
-    # Lấy message mới nhất
-    latest_msg = frappe.db.sql(
-        """
-        SELECT content, creation, owner
-        FROM `tabRaven Message`
-        WHERE channel_id = %s AND message_type != 'System'
-        ORDER BY creation DESC
-        LIMIT 1
-        """,
-        (channel_id,),
-        as_dict=True,
-    )
-    latest = latest_msg[0] if latest_msg else {}
-    content = latest.get("content", "")
-    timestamp = latest.get("creation")
-    sender_id = latest.get("owner")
-
-    sender_name = None
-    sender_image = None
-    if sender_id:
-        user_doc = frappe.get_cached_doc("Raven User", sender_id)
-        sender_name = user_doc.full_name
-        sender_image = user_doc.user_image
-
-    # Xây dựng kết quả
-    result = {
-        "name": channel_id,
-        "channel_name": channel_doc.channel_name,
-        "unread_count": unread_count,
-        "last_message_content": content,
-        "last_message_timestamp": timestamp,
-        "last_message_sender_id": sender_id,
-        "last_message_sender_name": sender_name,
-        "last_message_sender_image": sender_image,
-        "is_direct_message": 1 if channel_doc.is_direct_message else 0,
-    }
+    return summary[0]
 
-    # Nếu là DM thì lấy peer_user_id, nếu là group thì lấy danh sách peer_user_ids
-    if channel_doc.is_direct_message:
-        peer_user_id = frappe.db.get_value(
-            "Raven Channel Member",
-            filters={"channel_id": channel_id, "user_id": ["!=", user]},
-            fieldname="user_id"
-        )
-        result["peer_user_id"] = peer_user_id
-    else:
-        peer_user_ids = frappe.get_all(
-            "Raven Channel Member",
-            filters={"channel_id": channel_id, "user_id": ["!=", user]},
-            pluck="user_id"
-        )
-        result["peer_user_ids"] = peer_user_ids
 
-    return result
+@frappe.whitelist()
+def get_unread_summary(channel_ids: list):
+	"""
+	Unread count and latest message of many channels, in the shape of `get_unread_count_for_channel`.
+
+	Only channels the user is a member of and Open/Public channels are returned - the rest are skipped.
+	Runs the same four queries (channels, latest messages, senders and members) for any number of channels.
+	"""
+	if isinstance(channel_ids, str):
+		channel_ids = frappe.parse_json(channel_ids)
+
+	channel_ids = list(dict.fromkeys(channel_ids or []))
+	if not channel_ids:
+		return []
+
+	user = frappe.session.user
+
+	channel = frappe.qb.DocType("Raven Channel")
+	channel_member = frappe.qb.DocType("Raven Channel Member")
+	message = frappe.qb.DocType("Raven Message")
+
+	channels = (
+		frappe.qb.from_(channel)
+		.left_join(channel_member)
+		.on((channel_member.channel_id == channel.name) & (channel_member.user_id == user))
+		.select(
+			channel.name,
+			channel.channel_name,
+			channel.type,
+			channel.is_direct_message,
+			channel.last_countable_seq,
+			channel_member.name.as_("member"),
+			get_read_marker_term(channel_member, "last_read_countable_seq", user).as_(
+				"last_read_countable_seq"
+			),
+		)
+		.where(channel.name.isin(channel_ids))
+		.where(channel_member.name.isnotnull() | channel.type.isin(["Open", "Public"]))
+	).run(as_dict=True)
+
+	if not channels:
+		return []
+
+	channels = {row.name: row for row in channels}
+	channel_ids = [channel_id for channel_id in channel_ids if channel_id in channels]
+
+	# Newest message (other than system messages) of every channel
+	latest_seq = (
+		frappe.qb.from_(message)
+		.select(message.channel_id, Max(message.seq).as_("seq"))
+		.where(message.channel_id.isin(channel_ids))
+		.where(message.message_type != "System")
+		.groupby(message.channel_id)
+	)
+	latest_messages = {
+		row.channel_id: row
+		for row in (
+			frappe.qb.from_(message)
+			.join(latest_seq)
+			.on((message.channel_id == latest_seq.channel_id) & (message.seq == latest_seq.seq))
+			.select(message.channel_id, message.content, message.creation, message.owner)
+		).run(as_dict=True)
+	}
+
+	senders = {}
+	sender_ids = list({row.owner for row in latest_messages.values()})
+	if sender_ids:
+		for row in frappe.get_all(
+			"Raven User",
+			filters={"name": ("in", sender_ids)},
+			fields=["name", "full_name", "user_image"],
+		):
+			senders[row.name] = row
+
+	peers = {}
+	for row in frappe.get_all(
+		"Raven Channel Member",
+		filters={"channel_id": ("in", channel_ids), "user_id": ("!=", user)},
+		fields=["channel_id", "user_id"],
+		order_by="creation asc",
+	):
+		peers.setdefault(row.channel_id, []).append(row.user_id)
+
+	summary = []
+
+	for channel_id in channel_ids:
+		row = channels[channel_id]
+
+		if row.member or row.type == "Open":
+			unread_count = max(
+				cint(row.last_countable_seq) - cint(row.last_read_countable_seq), 0
+			)
+		else:
+			unread_count = 0
+
+		latest = latest_messages.get(channel_id) or {}
+		sender = senders.get(latest.get("owner")) or {}
+
+		result = {
+			"name": channel_id,
+			"channel_name": row.channel_name,
+			"unread_count": unread_count,
+			"last_message_content": latest.get("content", ""),
+			"last_message_timestamp": latest.get("creation"),
+			"last_message_sender_id": latest.get("owner"),
+			"last_message_sender_name": sender.get("full_name"),
+			"last_message_sender_image": sender.get("user_image"),
+			"is_direct_message": 1 if row.is_direct_message else 0,
+		}
+
+		if row.is_direct_message:
+			result["peer_user_id"] = next(iter(peers.get(channel_id, [])), None)
+		else:
+			result["peer_user_ids"] = peers.get(channel_id, [])
+
+		summary.append(result)
+
+	return summary
 
 
 @frappe.whitelist()
 def get_timeline_message_content(doctype, docname):
+	"""
+	Messages linked to a document, shown in the timeline of its Desk form (runs for every form).
+
+	Doctypes without any linked message are skipped without a query (see get_linked_doctypes),
+	the messages are looked up on the (link_doctype, link_document) index and the names of the
+	peers of direct messages are fetched in one query.
+	"""
+	if doctype not in get_linked_doctypes():
+		return []
+
 	channel = frappe.qb.DocType("Raven Channel")
 	channel_member = frappe.qb.DocType("Raven Channel Member")
 	message = frappe.qb.DocType("Raven Message")
@@ -696,13 +777,35 @@ def get_timeline_message_content(doctype, docname):
 	)
 	data = query.run(as_dict=True)
 
+	channel_peer_user_ids = get_peer_user_ids(
+		[
+			{
+				"name": log.channel_id,
+				"is_direct_message": log.is_direct_message,
+				"is_self_message": log.is_self_message,
+			}
+			for log in data
+		]
+	)
+	peer_user_ids = {
+		log.name: channel_peer_user_ids[log.channel_id] for log in data if log.is_direct_message
+	}
+	peer_names = {}
+	if any(peer_user_ids.values()):
+		peer_names = dict(
+			frappe.get_all(
+				"User",
+				filters={"name": ("in", list(set(filter(None, peer_user_ids.values()))))},
+				fields=["name", "full_name"],
+				as_list=True,
+			)
+		)
+
 	timeline_contents = []
 	for log in data:
 
-		if log.is_direct_message:
-			peer_user_id = get_peer_user_id(log.channel_id, log.is_direct_message, log.is_self_message)
-			if peer_user_id:
-				log["peer_user"] = frappe.db.get_value("User", peer_user_id, "full_name")
+		if peer_user_ids.get(log.name):
+			log["peer_user"] = peer_names.get(peer_user_ids[log.name])
 		timeline_contents.append(
 			{
 				"icon": "share",
@@ -716,119 +819,69 @@ def get_timeline_message_content(doctype, docname):
 	return timeline_contents
 
 
-file_extensions = {
-	"doc": [
-		"doc",
-		"docx",
-		"odt",
-		"ott",
-		"rtf",
-		"txt",
-		"dot",
-		"dotx",
-		"docm",
-		"dotm",
-		"pages",
-	],
-	"ppt": [
-		"ppt",
-		"pptx",
-		"odp",
-		"otp",
-		"pps",
-		"ppsx",
-		"pot",
-		"potx",
-		"pptm",
-		"ppsm",
-		"potm",
-		"ppam",
-		"ppa",
-		"key",
-	],
-	"xls": [
-		"xls",
-		"xlsx",
-		"csv",
-		"ods",
-		"ots",
-		"xlsb",
-		"xlsm",
-		"xlt",
-		"xltx",
-		"xltm",
-		"xlam",
-		"xla",
-		"numbers",
-	],
-}
-
-
 @frappe.whitelist()
-def get_all_files_shared_in_channel(
-	channel_id, file_name=None, file_type=None, start_after=0, page_length=None
-):
+def get_channel_files(channel_id, file_name=None, file_type=None, start_after=0, page_length=None):
+	"""
+	Get a page of the files shared in a channel (newest first) and the total number of files for the filters.
 
+	Both come from one query on the attachment index of the channel (see Raven Channel Attachment) -
+	the total is a window count over the filtered rows.
+	"""
 	# check if the user has permission to view the channel
 	check_permission(channel_id)
 
+	attachment = frappe.qb.DocType("Raven Channel Attachment")
 	message = frappe.qb.DocType("Raven Message")
 	user = frappe.qb.DocType("Raven User")
-	file = frappe.qb.DocType("File")
 
 	query = (
-		frappe.qb.from_(message)
-		.join(file)
-		.on(message.name == file.attached_to_name)
-		.join(user)
-		.on(message.owner == user.name)
+		get_channel_files_query(channel_id, file_name, file_type)
+		.join(message)
+		.on(message.name == attachment.message)
+		.join(user, JoinType.left)
+		.on(attachment.owner == user.name)
 		.select(
-			file.name,
-			file.file_name,
-			file.file_type,
-			file.file_size,
-			file.file_url,
-			message.owner,
-			message.creation,
+			attachment.file.as_("name"),
+			attachment.file_name,
+			attachment.file_type,
+			attachment.file_size,
+			attachment.file_url,
+			attachment.owner,
+			attachment.creation,
 			message.message_type,
 			message.thumbnail_width,
 			message.thumbnail_height,
 			message.file_thumbnail,
 			user.full_name,
 			user.user_image,
-			message.name.as_("message_id"),
+			attachment.message.as_("message_id"),
+			LiteralValue("COUNT(*) OVER ()").as_("total_count"),
 		)
-		.where(message.channel_id == channel_id)
+		.orderby(attachment.creation, order=Order.desc)
+		.offset(cint(start_after))
 	)
+	if page_length:
+		query = query.limit(cint(page_length))
 
-	# search for file name
-	if file_name:
-		query = query.where(file.file_name.like("%" + file_name + "%"))
+	files = query.run(as_dict=True)
 
-	# search for file type
-	if file_type:
-		if file_type == "image":
-			query = query.where(message.message_type == "Image")
-		elif file_type == "file":
-			query = query.where(message.message_type == "File")
-		elif file_type == "pdf":
-			query = query.where(file.file_type == "pdf")
-		else:
-			# Get the list of extensions for the given file type
-			extensions = file_extensions.get(file_type)
-			if extensions:
-				query = query.where((file.file_type).isin(extensions))
+	if files:
+		total = files[0].total_count
 	else:
-		query = query.where(message.message_type.isin(["Image", "File"]))
+		# Past the last page - there are no rows to carry the total
+		total = get_count_for_pagination_of_files(channel_id, file_name, file_type)
 
-	files = (
-		query.orderby(message.creation, order=Order["desc"])
-		.limit(page_length)
-		.offset(start_after)
-		.run(as_dict=True)
-	)
+	for file in files:
+		del file["total_count"]
 
-	return files
+	return {"files": files, "total": total}
+
+
+@frappe.whitelist()
+def get_all_files_shared_in_channel(
+	channel_id, file_name=None, file_type=None, start_after=0, page_length=None
+):
+	return get_channel_files(channel_id, file_name, file_type, start_after, page_length)["files"]
 
 
 @frappe.whitelist()
@@ -837,38 +890,68 @@ def get_count_for_pagination_of_files(channel_id, file_name=None, file_type=None
 	# check if the user has permission to view the channel
 	check_permission(channel_id)
 
-	message = frappe.qb.DocType("Raven Message")
-	# user = frappe.qb.DocType("Raven User")
-	file = frappe.qb.DocType("File")
-
-	query = (
-		frappe.qb.from_(message)
-		.join(file, JoinType.left)
-		.on(message.name == file.attached_to_name)
-		.select(Count(message.name).as_("count"))
-		.where(message.channel_id == channel_id)
+	count = (
+		get_channel_files_query(channel_id, file_name, file_type)
+		.select(Count("*").as_("count"))
+		.run(as_dict=True)
 	)
 
+	return count[0]["count"]
+
+
+def get_channel_files_query(channel_id, file_name=None, file_type=None):
+	"""
+	Query on the attachment index of a channel, filtered by file name and type.
+	File types are the categories of the attachments - "file" is any file that is not an image.
+	"""
+	attachment = frappe.qb.DocType("Raven Channel Attachment")
+	query = frappe.qb.from_(attachment).where(attachment.channel_id == channel_id)
+
 	# search for file name
 	if file_name:
-		query = query.where(file.file_name.like("%" + file_name + "%"))
+		query = query.where(attachment.file_name.like("%" + file_name + "%"))
 
 	# search for file type
-	if file_type:
-		if file_type == "image":
-			query = query.where(message.message_type == "Image")
-		elif file_type == "pdf":
-			query = query.where(file.file_type == "pdf")
-		else:
-			# Get the list of extensions for the given file type
-			extensions = file_extensions.get(file_type)
-			if extensions:
-				query = query.where((file.file_type).isin(extensions))
-	else:
-		query = query.where(message.message_type.isin(["Image", "File"]))
-	count = query.run(as_dict=True)
+	if file_type == "file":
+		query = query.where(attachment.category != "image")
+	elif file_type:
+		query = query.where(attachment.category == file_type)
+
+	return query
 
-	return count[0]["count"]
+
+@frappe.whitelist()
+def get_channel_links(channel_id, domain=None, start_after=0, page_length=20):
+	"""
+	Get the links shared in a channel (newest first) from the link index, optionally for one domain
+	"""
+	check_permission(channel_id)
+
+	message_link = frappe.qb.DocType("Raven Message Link")
+	message = frappe.qb.DocType("Raven Message")
+
+	query = (
+		frappe.qb.from_(message_link)
+		.join(message)
+		.on(message.name == message_link.parent)
+		.select(
+			message_link.url,
+			message_link.domain,
+			message_link.parent.as_("message_id"),
+			message.owner,
+			message_link.creation,
+		)
+		.where(message_link.channel_id == channel_id)
+		.where(message_link.parenttype == "Raven Message")
+		.where(message.is_retracted == 0)
+		.orderby(message_link.creation, order=Order.desc)
+		.limit(cint(page_length))
+		.offset(cint(start_after))
+	)
+	if domain:
+		query = query.where(message_link.domain == domain.lower().removeprefix("www."))
+
+	return query.run(as_dict=True)
 
 
 @frappe.whitelist(methods=["POST"])
@@ -923,26 +1006,7 @@ def add_forwarded_message_to_channel(channel_id, forwarded_message):
     doc.insert()
 
     # ✅ Batch RESET is_done = 0 (1 query)
-    done_members = frappe.get_all(
-        "Raven Channel Member",
-        filters={"channel_id": channel_id, "is_done": 1},
-        fields=["user_id"]
-    )
-
-    if done_members:
-        frappe.db.sql("""
-            UPDATE `tabRaven Channel Member`
-            SET is_done = 0
-            WHERE channel_id = %s AND is_done = 1
-        """, (channel_id,))
-
-        for member in done_members:
-            frappe.publish_realtime(
-                event="raven:channel_done_updated",
-                message={"channel_id": channel_id, "is_done": 0},
-                user=member.user_id,
-                after_commit=True
-            )
+    done_users = reset_channel_done_state(channel_id)
 
     # ✅ Chuẩn bị nội dung hiển thị
     message_type = doc.message_type or "Text"
@@ -969,19 +1033,7 @@ def add_forwarded_message_to_channel(channel_id, forwarded_message):
     })
 
     # ✅ Bắn realtime new_message cho các user khác (trừ sender)
-    members = frappe.get_all("Raven Channel Member", filters={"channel_id": channel_id}, pluck="user_id")
-    other_members = [user for user in members if user != frappe.session.user]
-
-    for member in other_members:
-        frappe.publish_realtime(
-            event="new_message",
-            message={
-                "channel_id": channel_id,
-                "user": frappe.session.user,
-                "seen_at": now_ts,
-            },
-            user=member
-        )
+    publish_message_sent_events(channel_id, done_users, now_ts)
 
     return "message forwarded"
 
@@ -1012,7 +1064,9 @@ def retract_message(message_id: str):
     )
     is_last_message = last_message_id == message.name
 
-    message.db_set("is_retracted", 1)
+    message.db_set({"is_retracted": 1, "search_content": None})
+    update_message_in_cache(message.channel_id, message.name)
+    remove_from_search_index([message.name])
     if is_last_message:
         fallback_message = {
             "message_id": message.name,
@@ -3,6 +3,7 @@ import json
 import frappe
 from frappe import _
 
+from raven.message_cache import update_message_in_cache
 from raven.utils import is_channel_member
 
 
@@ -96,7 +97,12 @@ def calculate_message_reaction(message_id, channel_id: str = None, do_not_publis
 		message_id,
 		"message_reactions",
 		json.dumps(total_reactions, indent=4),
-		update_modified=False,
+		# Reaction changes are picked up by clients syncing the channel since a cursor on modified
+		update_modified=not do_not_publish,
+	)
+
+	update_message_in_cache(
+		channel_id or frappe.db.get_value("Raven Message", message_id, "channel_id"), message_id
 	)
 
 	if do_not_publish:
@@ -1,5 +1,25 @@
+import base64
+import json
+
 import frappe
-from pypika import JoinType
+from frappe import _
+from frappe.query_builder.functions import Sum
+from frappe.utils import cint
+from pypika import Case, JoinType
+from pypika.terms import Criterion
+
+from raven.search import get_search_backend
+
+FILE_EXTENSIONS = {
+    "pdf": ["pdf"],
+    "doc": ["doc", "docx", "odt", "ott", "rtf", "txt", "dot", "dotx", "docm", "dotm", "pages"],
+    "ppt": ["ppt", "pptx", "odp", "otp", "pps", "ppsx", "pot", "potx", "pptm", "ppsm", "potm", "ppam", "ppa", "key"],
+    "xls": ["xls", "xlsx", "csv", "ods", "ots", "xlsb", "xlsm", "xlt", "xltx", "xltm", "xlam", "xla", "numbers"],
+}
+
+# Message filter types - the text of messages and links is matched (and ranked) by the search index
+MESSAGE_FILTER_TYPES = ["Message", "File", "Media", "Link"]
+CONTENT_FILTER_TYPES = ["Message", "Link"]
 
 
 @frappe.whitelist()
@@ -14,45 +34,25 @@ def get_search_result(
     message_type=None,
     channel_type=None,
     my_channel_only=False,
+    cursor=None,
 ):
+    """
+    Search messages, files, links or channels.
+
+    Pass `cursor` (empty for the first page) to page through messages with the returned cursor -
+    the result is then `{"results": [...], "cursor": ...}`, with no cursor after the last page.
+    Without it, the page is selected with `offset` and only the list of results is returned.
+    """
     user = frappe.session.user
 
     limit = int(frappe.form_dict.get("limit", 10))
     offset = int(frappe.form_dict.get("offset", 0))
-
-    def get_file_extensions():
-        return {
-            "pdf": ["pdf"],
-            "doc": ["doc", "docx", "odt", "ott", "rtf", "txt", "dot", "dotx", "docm", "dotm", "pages"],
-            "ppt": ["ppt", "pptx", "odp", "otp", "pps", "ppsx", "pot", "potx", "pptm", "ppsm", "potm", "ppam", "ppa", "key"],
-            "xls": ["xls", "xlsx", "csv", "ods", "ots", "xlsb", "xlsm", "xlt", "xltx", "xltm", "xlam", "xla", "numbers"],
-        }
-
-    def apply_common_filters(query):
-        if from_user:
-            query = query.where(message.owner == from_user)
-        if in_channel:
-            query = query.where(message.channel_id == in_channel)
-        if date:
-            query = query.where(message.creation > date)
-        if message_type:
-            query = query.where(message.message_type == message_type)
-        if channel_type:
-            query = query.where(channel.type == channel_type)
-        if saved == "true":
-            query = query.where(message._liked_by.like(f"%{user}%"))
-        if my_channel_only == "true":
-            query = query.where((channel.type == "Open") | (channel_member.user_id == user))
-        return query
-
-    # DocTypes
-    message = frappe.qb.DocType("Raven Message")
-    channel = frappe.qb.DocType("Raven Channel")
-    channel_member = frappe.qb.DocType("Raven Channel Member")
-    file_doc = frappe.qb.DocType("File")
+    paginate = cursor is not None
 
     # Handle channel search
     if filter_type == "Channel":
+        channel = frappe.qb.DocType("Raven Channel")
+        channel_member = frappe.qb.DocType("Raven Channel Member")
         query = (
             frappe.qb.from_(channel)
             .select(
@@ -74,9 +74,31 @@ def get_search_result(
             query = query.where(channel.channel_name.like(f"%{search_text}%"))
         return query.limit(20).offset(0).run(as_dict=True)
 
-    # Base query for messages
+    if filter_type not in MESSAGE_FILTER_TYPES:
+        return []
+
+    message = frappe.qb.DocType("Raven Message")
+    channel = frappe.qb.DocType("Raven Channel")
+    file_doc = frappe.qb.DocType("File")
+
+    # The file size is a subquery, so that a message with many files is returned once
+    file_size = (
+        frappe.qb.from_(file_doc)
+        .select(file_doc.file_size)
+        .where(file_doc.attached_to_doctype == "Raven Message")
+        .where(file_doc.attached_to_name == message.name)
+        .limit(1)
+    )
     query = (
-        frappe.qb.from_(message)
+        get_message_query(
+            user,
+            from_user=from_user,
+            in_channel=in_channel,
+            saved=saved,
+            date=date,
+            message_type=message_type,
+            channel_type=channel_type,
+        )
         .select(
             message.name,
             message.file,
@@ -87,52 +109,229 @@ def get_search_result(
             message.text,
             message.content,
             channel.workspace,
-            file_doc.file_size
+            file_size.as_("file_size"),
         )
-        .join(channel, JoinType.left)
-        .on(message.channel_id == channel.name)
-        .join(channel_member, JoinType.left)
-        .on(channel_member.channel_id == message.channel_id)
-        .join(file_doc, JoinType.left)
-        .on(message.name == file_doc.attached_to_name)
-        .where(channel_member.user_id == user)
+        .where(get_filter_type_condition(filter_type, search_text, file_type))
     )
 
-    # Filter by search type
-    if filter_type == "Message":
-        query = query.where(message.message_type == "Text")
-        if search_text:
-            query = query.where(message.content.like(f"%{search_text}%"))
+    search_content = filter_type in CONTENT_FILTER_TYPES and bool(search_text)
 
-    elif filter_type == "File":
-        query = query.where(message.message_type == "File")
-        if search_text:
-            query = query.where(message.file.like(f"/private/files/%{search_text}%"))
-        if file_type:
-            if file_type == "pdf":
-                query = query.where(file_doc.file_type == "pdf")
+    if not paginate:
+        if search_content:
+            return get_search_backend().search(query, message, search_text, limit, offset)
+
+        return (
+            query.orderby(message.creation, order=frappe.qb.desc)
+            .orderby(message.name, order=frappe.qb.desc)
+            .limit(limit)
+            .offset(offset)
+            .run(as_dict=True)
+        )
+
+    # One extra row tells if there is a next page
+    if search_content:
+        # Ranked by relevance, which is not stable enough for a keyset - the cursor keeps the offset
+        offset = cint(decode_cursor(cursor, ("offset",))["offset"]) if cursor else 0
+        results = get_search_backend().search(query, message, search_text, limit + 1, offset)
+        next_cursor = {"offset": offset + limit}
+    else:
+        if cursor:
+            cursor = decode_cursor(cursor, ("creation", "name"))
+            query = query.where(
+                (message.creation < cursor["creation"])
+                | ((message.creation == cursor["creation"]) & (message.name < cursor["name"]))
+            )
+        # The (message_type, creation) index is in (creation, name) order for a message type
+        results = (
+            query.orderby(message.creation, order=frappe.qb.desc)
+            .orderby(message.name, order=frappe.qb.desc)
+            .limit(limit + 1)
+            .run(as_dict=True)
+        )
+        last = results[limit - 1] if len(results) > limit else None
+        next_cursor = {"creation": str(last.creation), "name": last.name} if last else None
+
+    has_more = len(results) > limit
+    return {
+        "results": results[:limit],
+        "cursor": encode_cursor(next_cursor) if has_more else None,
+    }
+
+
+def encode_cursor(cursor: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(cursor).encode()).decode()
+
+
+def decode_cursor(cursor: str, keys: tuple) -> dict:
+    """
+    Decode a cursor from `encode_cursor` - it has to be a dict with all the given keys
+    """
+    try:
+        decoded = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        decoded = None
+
+    if not isinstance(decoded, dict) or any(decoded.get(key) is None for key in keys):
+        frappe.throw(_("Invalid cursor"))
+
+    return decoded
+
+
+@frappe.whitelist()
+def get_search_facets(
+    search_text=None,
+    from_user=None,
+    in_channel=None,
+    saved=False,
+    date=None,
+    file_type=None,
+    message_type=None,
+    channel_type=None,
+):
+    """
+    Number of results of every message filter type (Message, File, Media, Link), in total and per
+    channel, for the same filters as `get_search_result`.
+
+    All the counts come from one aggregated query over the messages of the channels of the user.
+    """
+    user = frappe.session.user
+    message = frappe.qb.DocType("Raven Message")
+
+    conditions = {
+        filter_type: get_filter_type_condition(filter_type, search_text, file_type)
+        for filter_type in MESSAGE_FILTER_TYPES
+    }
+    if search_text:
+        match = get_search_backend().get_match_condition(message, search_text)
+        for filter_type in CONTENT_FILTER_TYPES:
+            if match is None:
+                del conditions[filter_type]
             else:
-                extensions = get_file_extensions().get(file_type)
-                if extensions:
-                    query = query.where(file_doc.file_type.isin(extensions))
+                conditions[filter_type] &= match
 
-    elif filter_type == "Media":
-        query = query.where(message.message_type.isin(["Image", "Video"]))
-        if search_text:
-            query = query.where(message.file.like(f"/private/files/%{search_text}%"))
+    types = dict.fromkeys(MESSAGE_FILTER_TYPES, 0)
+    if not conditions:
+        return {"types": types, "channels": {}}
 
-    elif filter_type == "Link":
-        query = query.where(message.message_type == "Text")
-        # Detect presence of URL
-        query = query.where((message.content.like("%http://%")) | (message.content.like("%https://%")))
-        if search_text:
-            query = query.where(message.content.like(f"%{search_text}%"))
+    rows = (
+        get_message_query(
+            user,
+            from_user=from_user,
+            in_channel=in_channel,
+            saved=saved,
+            date=date,
+            message_type=message_type,
+            channel_type=channel_type,
+        )
+        .select(
+            message.channel_id,
+            *(
+                Sum(Case().when(condition, 1).else_(0)).as_(filter_type)
+                for filter_type, condition in conditions.items()
+            ),
+        )
+        .where(Criterion.any(conditions.values()))
+        .groupby(message.channel_id)
+    ).run(as_dict=True)
 
-    else:
-        return []
+    channels = {}
+    for row in rows:
+        channels[row.channel_id] = {
+            filter_type: cint(row.get(filter_type)) for filter_type in MESSAGE_FILTER_TYPES
+        }
+        for filter_type, count in channels[row.channel_id].items():
+            types[filter_type] += count
+
+    return {"types": types, "channels": channels}
 
-    query = apply_common_filters(query)
 
-    query = query.orderby(message.creation, order=frappe.qb.desc)
+def get_message_query(
+    user: str,
+    from_user=None,
+    in_channel=None,
+    saved=False,
+    date=None,
+    message_type=None,
+    channel_type=None,
+):
+    """
+    Query on the messages of the channels of the user, with the filters common to every filter type.
+    Membership is a semi-join, so that every message is returned once.
+
+    my_channel_only needs no filter - messages are only searched in the channels of the user.
+    """
+    message = frappe.qb.DocType("Raven Message")
+    channel = frappe.qb.DocType("Raven Channel")
+    channel_member = frappe.qb.DocType("Raven Channel Member")
+    saved_message = frappe.qb.DocType("Raven Saved Message")
+
+    query = (
+        frappe.qb.from_(message)
+        .join(channel, JoinType.left)
+        .on(message.channel_id == channel.name)
+        .where(
+            message.channel_id.isin(
+                frappe.qb.from_(channel_member)
+                .select(channel_member.channel_id)
+                .where(channel_member.user_id == user)
+            )
+        )
+    )
+
+    if from_user:
+        query = query.where(message.owner == from_user)
+    if in_channel:
+        query = query.where(message.channel_id == in_channel)
+    if date:
+        query = query.where(message.creation > date)
+    if message_type:
+        query = query.where(message.message_type == message_type)
+    if channel_type:
+        query = query.where(channel.type == channel_type)
+    if saved == "true":
+        query = query.where(
+            message.name.isin(
+                frappe.qb.from_(saved_message)
+                .select(saved_message.message)
+                .where(saved_message.user == user)
+            )
+        )
+    return query
+
+
+def get_filter_type_condition(filter_type: str, search_text=None, file_type=None):
+    """
+    Condition for the messages of a filter type. The text of messages and links is not part of it -
+    it is matched by the search index.
+    """
+    message = frappe.qb.DocType("Raven Message")
+    file_doc = frappe.qb.DocType("File")
+
+    if filter_type == "Message":
+        return message.message_type == "Text"
+
+    if filter_type == "Link":
+        # Messages with links in the link index
+        message_link = frappe.qb.DocType("Raven Message Link")
+        return (message.message_type == "Text") & message.name.isin(
+            frappe.qb.from_(message_link)
+            .select(message_link.parent)
+            .where(message_link.parenttype == "Raven Message")
+        )
+
+    if filter_type == "File":
+        condition = message.message_type == "File"
+        extensions = FILE_EXTENSIONS.get(file_type) if file_type else None
+        if extensions:
+            condition &= message.name.isin(
+                frappe.qb.from_(file_doc)
+                .select(file_doc.attached_to_name)
+                .where(file_doc.attached_to_doctype == "Raven Message")
+                .where(file_doc.file_type.isin(extensions))
+            )
+    else:
+        condition = message.message_type.isin(["Image", "Video"])
 
-    return query.limit(limit).offset(offset).run(as_dict=True)
+    if search_text:
+        condition &= message.file.like(f"/private/files/%{search_text}%")
+    return condition
@@ -3,7 +3,13 @@ import datetime
 import frappe
 from frappe.tests import IntegrationTestCase
 
-from raven.api.chat_stream import get_messages, get_newer_messages, get_older_messages
+from raven.api.chat_stream import (
+	CURSOR_SAFETY_WINDOW,
+	get_channel_changes,
+	get_messages,
+	get_newer_messages,
+	get_older_messages,
+)
 
 CHANNEL_ID = "Public Workspace-test-channel"
 
@@ -27,6 +33,7 @@ def create_messages():
 			{
 				"doctype": "Raven Message",
 				"name": f"{CHANNEL_ID}-{i}",
+				"seq": i + 1,
 				"text": f"Test Message {i}",
 				"content": f"Test Message {i}",
 				"channel_id": CHANNEL_ID,
@@ -37,6 +44,8 @@ def create_messages():
 		)
 		message.db_insert()
 
+	frappe.db.set_value("Raven Channel", CHANNEL_ID, "last_seq", 100)
+
 
 def create_channel():
 	channel_doc = frappe.get_doc(
@@ -119,6 +128,26 @@ class TestChatStream(IntegrationTestCase):
 		self.assertEqual(response["has_old_messages"], False)
 		self.assertEqual(response["has_new_messages"], False)
 
+	def test_get_messages_columnar(self):
+		"""
+		Chat Stream `get_messages` API with `format="columnar"`
+		The messages should be the same as the default format, without the columns which are null for all messages
+		"""
+		expected = get_messages(CHANNEL_ID)["messages"]
+		response = get_messages(CHANNEL_ID, format="columnar")
+
+		self.assertEqual(response["format"], "columnar")
+		columns = response["messages"]["columns"]
+		self.assertNotIn("poll_id", columns)
+
+		messages = [dict(zip(columns, row)) for row in response["messages"]["rows"]]
+		self.assertEqual(
+			messages, [{column: message[column] for column in columns} for message in expected]
+		)
+		for message in expected:
+			for column in set(message) - set(columns):
+				self.assertIsNone(message[column])
+
 	def test_get_messages_around_base_mid(self):
 		"""
 		Chat Stream `get_messages` API with a base message in the middle of the list
@@ -187,6 +216,39 @@ class TestChatStream(IntegrationTestCase):
 		for i, message in enumerate(response["messages"]):
 			self.assertEqual(message.text, f"Test Message {14-i}")
 
+	def test_get_messages_around_base_in_another_channel(self):
+		"""
+		The base message has to be in the channel
+		"""
+		channel = frappe.get_doc(
+			{
+				"doctype": "Raven Channel",
+				"channel_name": "Test Other Channel",
+				"type": "Public",
+				"workspace": "Public Workspace",
+			}
+		)
+		channel.flags.do_not_add_member = True
+		channel.insert()
+
+		frappe.get_doc(
+			{
+				"doctype": "Raven Message",
+				"name": f"{channel.name}-0",
+				"seq": 1,
+				"text": "Test Message in another channel",
+				"channel_id": channel.name,
+				"message_type": "Text",
+			}
+		).db_insert()
+
+		self.assertRaises(
+			frappe.DoesNotExistError, get_messages, CHANNEL_ID, base_message=f"{channel.name}-0"
+		)
+		self.assertRaises(
+			frappe.DoesNotExistError, get_messages, CHANNEL_ID, base_message="missing-message"
+		)
+
 	def test_get_older_messages(self):
 		"""
 		Chat Stream `get_older_messages` API
@@ -271,3 +333,80 @@ class TestChatStream(IntegrationTestCase):
 		# Loop over and check indexes of all messages
 		for i, message in enumerate(response["messages"]):
 			self.assertEqual(message.text, f"Test Message {99-i}")
+
+	def test_get_channel_changes(self):
+		"""
+		Chat Stream `get_channel_changes` API
+		The API should return the messages created, updated and deleted since the cursor, oldest change first
+		"""
+		cursor = {"modified": frappe.utils.now_datetime() - datetime.timedelta(minutes=1), "name": None}
+
+		response = get_channel_changes(CHANNEL_ID, **cursor)
+		self.assertEqual(response["created"], [])
+		self.assertEqual(response["updated"], [])
+		self.assertEqual(response["deleted"], [])
+		self.assertEqual(response["has_more"], False)
+
+		frappe.db.set_value("Raven Message", f"{CHANNEL_ID}-10", "text", "Edited Message 10")
+		frappe.delete_doc("Raven Message", f"{CHANNEL_ID}-20")
+		new_message = frappe.get_doc(
+			{
+				"doctype": "Raven Message",
+				"text": "New Message",
+				"channel_id": CHANNEL_ID,
+				"message_type": "Text",
+			}
+		).insert()
+
+		response = get_channel_changes(CHANNEL_ID, **cursor)
+		self.assertEqual([message.name for message in response["created"]], [new_message.name])
+		self.assertEqual([message.text for message in response["updated"]], ["Edited Message 10"])
+		self.assertEqual(response["deleted"], [f"{CHANNEL_ID}-20"])
+		self.assertEqual(response["has_more"], False)
+
+		# Page through the changes one at a time
+		changes = []
+		for _ in range(5):
+			response = get_channel_changes(CHANNEL_ID, **cursor, limit=1)
+			changes += [m.name for m in response["created"] + response["updated"]] + response["deleted"]
+			cursor = response["cursor"]
+			if not response["has_more"]:
+				break
+
+		self.assertEqual(
+			changes, [f"{CHANNEL_ID}-10", f"{CHANNEL_ID}-20", new_message.name]
+		)
+
+		# The cursor of the last page lags behind, so the latest changes are returned again
+		self.assertLessEqual(
+			cursor["modified"],
+			frappe.utils.now_datetime() - datetime.timedelta(seconds=CURSOR_SAFETY_WINDOW),
+		)
+		response = get_channel_changes(CHANNEL_ID, **cursor)
+		self.assertEqual(
+			[m.name for m in response["created"] + response["updated"]] + response["deleted"],
+			[new_message.name, f"{CHANNEL_ID}-10", f"{CHANNEL_ID}-20"],
+		)
+
+		# A change committed late, with a `modified` older than the latest change, is not skipped
+		late_modified = frappe.utils.now_datetime() - datetime.timedelta(seconds=5)
+		frappe.db.set_value(
+			"Raven Message",
+			f"{CHANNEL_ID}-30",
+			{"text": "Edited Message 30", "modified": late_modified},
+			update_modified=False,
+		)
+		response = get_channel_changes(CHANNEL_ID, **cursor)
+		self.assertIn("Edited Message 30", [message.text for message in response["updated"]])
+
+		# No changes after the latest change
+		response = get_channel_changes(
+			CHANNEL_ID, frappe.utils.now_datetime() + datetime.timedelta(seconds=1)
+		)
+		self.assertEqual(response["created"] + response["updated"] + response["deleted"], [])
+
+		# Cursors older than the tombstones need a full reload
+		response = get_channel_changes(
+			CHANNEL_ID, frappe.utils.now_datetime() - datetime.timedelta(days=60)
+		)
+		self.assertEqual(response["full_reload"], True)
@@ -0,0 +1,214 @@
+import datetime
+from unittest.mock import patch
+
+import frappe
+from frappe.tests import IntegrationTestCase
+
+from raven.api.raven_message import (
+	MESSAGE_BLOCK_FIELDS,
+	get_channel_files,
+	get_message_blocks,
+	get_messages_with_dates,
+	get_saved_messages,
+	get_timeline_message_content,
+	get_unread_summary,
+	parse_messages,
+	save_message,
+)
+from raven.raven_messaging.doctype.raven_saved_message.raven_saved_message import add_saved_message
+from raven.utils import LINKED_DOCTYPES_CACHE_KEY, get_linked_doctypes
+
+CHANNEL_ID = "Public Workspace-test-blocks-channel"
+
+EXTRA_TEST_RECORD_DEPENDENCIES = ["Raven Workspace"]
+
+
+class TestRavenMessage(IntegrationTestCase):
+	def setUp(self):
+		channel = frappe.get_doc(
+			{
+				"doctype": "Raven Channel",
+				"channel_name": "Test Blocks Channel",
+				"type": "Public",
+				"workspace": "Public Workspace",
+			}
+		)
+		channel.flags.do_not_add_member = True
+		channel.insert()
+
+		# Messages over a few days by two users, some of them less than 2 minutes apart
+		creation = datetime.datetime(2025, 1, 1, 22, 0)
+		for i in range(30):
+			creation += datetime.timedelta(minutes=1 if i % 3 else 200)
+			frappe.get_doc(
+				{
+					"doctype": "Raven Message",
+					"name": f"{CHANNEL_ID}-{i}",
+					"seq": i + 1,
+					"text": f"Test Message {i}",
+					"channel_id": CHANNEL_ID,
+					"message_type": "Text",
+					"owner": "Administrator" if i % 4 else "Guest",
+					"creation": creation,
+					"modified": creation,
+				}
+			).db_insert()
+
+	def tearDown(self):
+		frappe.db.rollback()
+
+	def test_get_message_blocks(self):
+		"""
+		Loading the channel page by page should give the same blocks as parsing all the messages at once
+		"""
+		all_messages = frappe.get_all(
+			"Raven Message",
+			filters={"channel_id": CHANNEL_ID},
+			fields=MESSAGE_BLOCK_FIELDS,
+			order_by="creation asc",
+		)
+		expected = parse_messages(all_messages)
+
+		blocks = []
+		cursor = {}
+		while True:
+			response = get_message_blocks(CHANNEL_ID, limit=7, **cursor)
+			blocks = response["blocks"] + blocks
+			if not response["has_more"]:
+				break
+			cursor = response["cursor"]
+
+		self.assertEqual(frappe.as_json(blocks), frappe.as_json(expected))
+
+	def test_get_messages_with_dates(self):
+		"""
+		All the messages of the channel are returned, not only the newest page
+		"""
+		creation = datetime.datetime(2025, 2, 1, 10, 0)
+		for i in range(30, 150):
+			creation += datetime.timedelta(minutes=1)
+			frappe.get_doc(
+				{
+					"doctype": "Raven Message",
+					"name": f"{CHANNEL_ID}-{i}",
+					"seq": i + 1,
+					"text": f"Test Message {i}",
+					"channel_id": CHANNEL_ID,
+					"message_type": "Text",
+					"creation": creation,
+					"modified": creation,
+				}
+			).db_insert()
+
+		all_messages = frappe.get_all(
+			"Raven Message",
+			filters={"channel_id": CHANNEL_ID},
+			fields=MESSAGE_BLOCK_FIELDS,
+			order_by="creation asc",
+		)
+		self.assertEqual(len(all_messages), 150)
+
+		self.assertEqual(
+			frappe.as_json(get_messages_with_dates(CHANNEL_ID)),
+			frappe.as_json(parse_messages(all_messages)),
+		)
+
+	def test_get_unread_summary(self):
+		frappe.db.set_value("Raven Channel", CHANNEL_ID, "last_countable_seq", 30)
+
+		summary = get_unread_summary([CHANNEL_ID, "Public Workspace-does-not-exist"])
+
+		self.assertEqual(len(summary), 1)
+		self.assertEqual(summary[0]["name"], CHANNEL_ID)
+		# Not a member of the public channel
+		self.assertEqual(summary[0]["unread_count"], 0)
+		self.assertEqual(summary[0]["last_message_sender_id"], "Administrator")
+		self.assertEqual(summary[0]["peer_user_ids"], [])
+
+	def test_get_unread_summary_of_private_channel(self):
+		channel = frappe.get_doc(
+			{
+				"doctype": "Raven Channel",
+				"channel_name": "Test Private Summary Channel",
+				"type": "Private",
+				"workspace": "Public Workspace",
+			}
+		)
+		channel.flags.do_not_add_member = True
+		channel.insert()
+
+		# Not a member of the private channel - it is skipped
+		summary = get_unread_summary([channel.name, CHANNEL_ID])
+		self.assertEqual([row["name"] for row in summary], [CHANNEL_ID])
+
+	def test_saved_messages(self):
+		message_id = f"{CHANNEL_ID}-3"
+		thread_id = f"{CHANNEL_ID}-2"
+
+		save_message(message_id, add="Yes", thread_id=thread_id)
+		saved = [message for message in get_saved_messages() if message.name == message_id]
+		self.assertEqual(len(saved), 1)
+		self.assertEqual(saved[0].saved_from_thread, thread_id)
+
+		# A concurrent save which does not see the row yet runs into the unique key
+		with patch.object(frappe.db, "exists", return_value=None):
+			add_saved_message(message_id, frappe.session.user)
+		self.assertEqual(
+			frappe.db.count(
+				"Raven Saved Message", {"user": frappe.session.user, "message": message_id}
+			),
+			1,
+		)
+
+		save_message(message_id, add="No")
+		self.assertFalse([message for message in get_saved_messages() if message.name == message_id])
+
+	def test_get_channel_files(self):
+		for i, file_name in enumerate(["report.pdf", "photo.png", "budget.xlsx"]):
+			message = frappe.get_doc(
+				{
+					"doctype": "Raven Message",
+					"channel_id": CHANNEL_ID,
+					"message_type": "Image" if file_name.endswith(".png") else "File",
+				}
+			).insert()
+			frappe.get_doc(
+				{
+					"doctype": "File",
+					"name": f"test-channel-file-{i}",
+					"file_name": file_name,
+					"file_url": f"/private/files/{file_name}",
+					"attached_to_doctype": "Raven Message",
+					"attached_to_name": message.name,
+				}
+			).db_insert()
+			message.file = f"/private/files/{file_name}"
+			message.save()
+
+		response = get_channel_files(CHANNEL_ID, page_length=2)
+		self.assertEqual(response["total"], 3)
+		self.assertEqual([file.file_name for file in response["files"]], ["budget.xlsx", "photo.png"])
+
+		response = get_channel_files(CHANNEL_ID, file_type="file")
+		self.assertEqual(response["total"], 2)
+
+		response = get_channel_files(CHANNEL_ID, file_type="pdf", start_after=1)
+		self.assertEqual(response, {"files": [], "total": 1})
+
+	def test_get_timeline_message_content(self):
+		frappe.get_doc(
+			{"doctype": "Raven Channel Member", "channel_id": CHANNEL_ID, "user_id": "Administrator"}
+		).db_insert()
+		frappe.db.set_value(
+			"Raven Message",
+			f"{CHANNEL_ID}-1",
+			{"link_doctype": "ToDo", "link_document": "test-timeline-todo"},
+		)
+		frappe.cache().delete_value(LINKED_DOCTYPES_CACHE_KEY)
+
+		timeline = get_timeline_message_content("ToDo", "test-timeline-todo")
+		self.assertEqual([row["template_data"].name for row in timeline], [f"{CHANNEL_ID}-1"])
+
+		# Doctypes without linked messages are answered from the cache
+		self.assertNotIn("Note", get_linked_doctypes())
+		self.assertEqual(get_timeline_message_content("Note", "test-timeline-note"), [])
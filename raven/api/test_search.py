@@ -0,0 +1,105 @@
+import datetime
+
+import frappe
+from frappe.tests import IntegrationTestCase
+
+from raven.api.search import encode_cursor, get_search_facets, get_search_result
+
+CHANNEL_ID = "Public Workspace-test-search-channel"
+
+EXTRA_TEST_RECORD_DEPENDENCIES = ["Raven Workspace"]
+
+
+class TestSearch(IntegrationTestCase):
+	def setUp(self):
+		channel = frappe.get_doc(
+			{
+				"doctype": "Raven Channel",
+				"channel_name": "Test Search Channel",
+				"type": "Public",
+				"workspace": "Public Workspace",
+			}
+		)
+		channel.flags.do_not_add_member = True
+		channel.insert()
+
+		frappe.get_doc(
+			{"doctype": "Raven Channel Member", "channel_id": CHANNEL_ID, "user_id": frappe.session.user}
+		).db_insert()
+		# Other members of the channel should not multiply the results
+		frappe.get_doc(
+			{"doctype": "Raven Channel Member", "channel_id": CHANNEL_ID, "user_id": "Guest"}
+		).db_insert()
+
+		# Messages in pairs with the same timestamp, to page through ties
+		creation = datetime.datetime(2025, 1, 1, 22, 0)
+		for i in range(15):
+			if i % 2:
+				creation += datetime.timedelta(minutes=1)
+			frappe.get_doc(
+				{
+					"doctype": "Raven Message",
+					"name": f"{CHANNEL_ID}-{i:02}",
+					"seq": i + 1,
+					"text": f"Test Message {i}",
+					"channel_id": CHANNEL_ID,
+					"message_type": "Text",
+					"creation": creation,
+					"modified": creation,
+				}
+			).db_insert()
+
+		# Two files attached to the same message
+		for i in range(2):
+			frappe.get_doc(
+				{
+					"doctype": "File",
+					"name": f"test-search-file-{i}",
+					"file_name": f"test-search-file-{i}.txt",
+					"attached_to_doctype": "Raven Message",
+					"attached_to_name": f"{CHANNEL_ID}-00",
+					"file_size": 10,
+				}
+			).db_insert()
+
+	def tearDown(self):
+		frappe.db.rollback()
+
+	def test_cursor_pagination(self):
+		expected = frappe.get_all(
+			"Raven Message",
+			filters={"channel_id": CHANNEL_ID},
+			order_by="creation desc, name desc",
+			pluck="name",
+		)
+
+		frappe.form_dict.limit = 4
+		names = []
+		cursor = ""
+		while True:
+			response = get_search_result("Message", in_channel=CHANNEL_ID, cursor=cursor)
+			names += [row.name for row in response["results"]]
+			cursor = response["cursor"]
+			if not cursor:
+				break
+
+		self.assertEqual(names, expected)
+
+	def test_invalid_cursor(self):
+		invalid_cursors = [
+			"not a cursor",
+			encode_cursor([1, 2]),
+			encode_cursor({"creation": "2025-01-01"}),
+		]
+		for cursor in invalid_cursors:
+			with self.assertRaises(frappe.ValidationError):
+				get_search_result("Message", in_channel=CHANNEL_ID, cursor=cursor)
+
+		with self.assertRaises(frappe.ValidationError):
+			get_search_result("Message", search_text="test", cursor=encode_cursor({}))
+
+	def test_search_facets(self):
+		facets = get_search_facets(in_channel=CHANNEL_ID)
+
+		self.assertEqual(facets["types"], {"Message": 15, "File": 0, "Media": 0, "Link": 0})
+		self.assertEqual(facets["channels"], {CHANNEL_ID: facets["types"]})
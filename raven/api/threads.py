@@ -1,10 +1,11 @@
 import frappe
 from frappe import _
 from frappe.query_builder import Order
-from frappe.query_builder.functions import Coalesce, Count
+from frappe.query_builder.functions import Count
 
 from raven.api.raven_channel import get_peer_user_id
-from raven.utils import get_channel_members, get_thread_reply_count
+from raven.unread_counts import get_unread_count_term
+from raven.utils import get_channel_members_many, get_thread_reply_count
 
 
 @frappe.whitelist(methods=["GET"])
@@ -92,20 +93,20 @@ def get_all_threads(
 		query = query.where(message.channel_id == channel_id)
 
 	if only_show_unread == True or only_show_unread == "true":
-		query = query.where(
-			channel.last_message_timestamp > Coalesce(channel_member.last_visit, "2000-11-11")
-		)
+		query = query.where(get_unread_count_term(channel, channel_member) > 0)
 
 	query = query.orderby(channel.last_message_timestamp, order=Order.desc)
 
 	# return
 	threads = query.run(as_dict=True)
 
+	# Fetch the participants of the threads which are not AI threads or DM threads
+	thread_members = get_channel_members_many(
+		[thread["name"] for thread in threads if not thread["is_ai_thread"] and not thread["is_dm_thread"]]
+	)
 	for thread in threads:
-		# Fetch the participants of the thread if it's not an AI thread or a DM thread
-		if not thread["is_ai_thread"] and not thread["is_dm_thread"]:
-			thread_members = get_channel_members(thread["name"])
-			thread["participants"] = [{"user_id": member} for member in thread_members]
+		if thread["name"] in thread_members:
+			thread["participants"] = [{"user_id": member} for member in thread_members[thread["name"]]]
 
 	return threads
 
@@ -188,11 +189,13 @@ def get_other_threads(
 
 	threads = query.run(as_dict=True)
 
+	# Fetch the participants of the threads which are not AI threads or DM threads
+	thread_members = get_channel_members_many(
+		[thread["name"] for thread in threads if not thread["is_ai_thread"] and not thread["is_dm_thread"]]
+	)
 	for thread in threads:
-		# Fetch the participants of the thread if it's not an AI thread or a DM thread
-		if not thread["is_ai_thread"] and not thread["is_dm_thread"]:
-			thread_members = get_channel_members(thread["name"])
-			thread["participants"] = [{"user_id": member} for member in thread_members]
+		if thread["name"] in thread_members:
+			thread["participants"] = [{"user_id": member} for member in thread_members[thread["name"]]]
 
 	return threads
 
@@ -206,21 +209,16 @@ def get_unread_threads(workspace: str = None, thread_id: str = None):
 
 	channel = frappe.qb.DocType("Raven Channel")
 	channel_member = frappe.qb.DocType("Raven Channel Member")
-	message = frappe.qb.DocType("Raven Message")
+	unread_count = get_unread_count_term(channel, channel_member)
 
 	query = (
 		frappe.qb.from_(channel)
-		.select(channel.name, Count(message.name).as_("unread_count"))
-		.left_join(channel_member)
+		.select(channel.name, unread_count.as_("unread_count"))
+		.join(channel_member)
 		.on((channel.name == channel_member.channel_id) & (channel_member.user_id == frappe.session.user))
-		.left_join(message)
-		.on(channel.name == message.channel_id)
 		.where(channel.is_thread == 1)
 		.where(channel.is_ai_thread == 0)
-		.where(message.message_type != "System")
-		.where(message.creation > Coalesce(channel_member.last_visit, "2000-11-11"))
-		.where(channel_member.user_id == frappe.session.user)
-		.groupby(channel.name)
+		.where(unread_count > 0)
 	)
 
 	if workspace:
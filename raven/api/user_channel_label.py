@@ -1,6 +1,9 @@
 import frappe
 from frappe import _
 
+from raven.sidebar import invalidate_sidebar
+
+
 def _fail(title: str, message: str, code: int = 417):
     frappe.local.response.http_status_code = code
     frappe.local.response.type = "json"
@@ -160,5 +163,7 @@ def remove_channel_from_label(label_id: str, channel_id: str):
         'label': label_id,
         'channel_id': channel_id
     })
+    # frappe.db.delete does not run the doc events which invalidate the sidebar
+    invalidate_sidebar([user])
 
     return {'message': 'Đã xoá channel khỏi nhãn'}
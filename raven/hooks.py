@@ -151,6 +151,14 @@ doc_events = {
 		"on_update": "raven.raven_integrations.controllers.employee.on_update",
 		"on_trash": "raven.raven_integrations.controllers.employee.on_trash",
 	},
+	"User Channel Label": {
+		"on_update": "raven.sidebar.on_user_channel_label_change",
+		"on_trash": "raven.sidebar.on_user_channel_label_change",
+	},
+	"User Label": {
+		"on_update": "raven.sidebar.on_user_label_change",
+		"on_trash": "raven.sidebar.on_user_label_change",
+	},
 }
 
 # Scheduled Tasks
@@ -176,10 +184,17 @@ doc_events = {
 
 scheduler_events = {
     "cron": {
+        "* * * * *": [
+            "raven.raven_messaging.doctype.raven_message_outbox.raven_message_outbox.process_outbox",
+            "raven.read_markers.flush_read_markers"
+        ],
         "*/5 * * * *": [
             "raven.api.realtime_typing.cleanup_expired_typing_events"
         ]
-    }
+    },
+    "daily": [
+        "raven.raven_messaging.doctype.raven_message_tombstone.raven_message_tombstone.purge_tombstones"
+    ]
 }
 
 # Testing
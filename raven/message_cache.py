@@ -0,0 +1,337 @@
+"""
+Ring buffer of the most recent messages of a channel, kept in Redis.
+
+Opening a channel always loads the newest page of messages. For busy channels the same page is read
+over and over again, so the newest BUFFER_SIZE rows (exactly as returned by the chat stream query) are
+kept in Redis and the first page is served from there.
+
+Keys per channel:
+1. raven:recent_messages:<channel_id> - sorted set of message IDs scored by their sequence number in the channel.
+2. raven:recent_messages:<channel_id>:rows - hash of message ID to the serialized row.
+	The "__has_more" field is "1" if the channel has messages older than the ones in the buffer.
+3. raven:recent_messages:<channel_id>:version - incremented on every change to the messages of the channel.
+	A buffer is only filled if the version did not change while the rows were being read from the database.
+
+The buffer is updated after the transaction is committed, so it never holds uncommitted rows.
+"""
+
+import json
+
+import frappe
+from frappe.query_builder import Order
+from pypika import Case
+
+BUFFER_SIZE = 50
+
+CACHE_TTL = 60 * 60
+
+STATS_KEY = "raven:recent_messages_stats"
+
+# KEYS: order, rows, version
+# ARGV: expected version, ttl, has_more, followed by (name, score, row) for every message
+FILL_SCRIPT = """
+if (redis.call('GET', KEYS[3]) or '0') ~= ARGV[1] then
+	return 0
+end
+redis.call('DEL', KEYS[1], KEYS[2])
+redis.call('HSET', KEYS[2], '__has_more', ARGV[3])
+for i = 4, #ARGV, 3 do
+	redis.call('ZADD', KEYS[1], ARGV[i + 1], ARGV[i])
+	redis.call('HSET', KEYS[2], ARGV[i], ARGV[i + 2])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+return 1
+"""
+
+# KEYS: order, rows
+# ARGV: number of messages to read
+# Returns false if there is no buffer, else has_more followed by the rows (newest first)
+READ_SCRIPT = """
+local has_more = redis.call('HGET', KEYS[2], '__has_more')
+if not has_more then
+	return false
+end
+local names = redis.call('ZREVRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #names == 0 then
+	return {has_more}
+end
+local rows = redis.call('HMGET', KEYS[2], unpack(names))
+table.insert(rows, 1, has_more)
+return rows
+"""
+
+# KEYS: order, rows, version
+# ARGV: ttl, size, name, score, row
+UPSERT_SCRIPT = """
+redis.call('INCR', KEYS[3])
+redis.call('EXPIRE', KEYS[3], ARGV[1])
+local has_more = redis.call('HGET', KEYS[2], '__has_more')
+if not has_more then
+	return 0
+end
+if not redis.call('ZSCORE', KEYS[1], ARGV[3]) and has_more == '1' then
+	-- Messages older than the buffer are not added, the buffer would have a gap
+	local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+	if #oldest == 0 then
+		return 0
+	end
+	if tonumber(ARGV[4]) < tonumber(oldest[2]) then
+		return 0
+	end
+end
+redis.call('ZADD', KEYS[1], ARGV[4], ARGV[3])
+redis.call('HSET', KEYS[2], ARGV[3], ARGV[5])
+local count = redis.call('ZCARD', KEYS[1])
+local size = tonumber(ARGV[2])
+if count > size then
+	local removed = redis.call('ZRANGE', KEYS[1], 0, count - size - 1)
+	redis.call('ZREMRANGEBYRANK', KEYS[1], 0, count - size - 1)
+	redis.call('HDEL', KEYS[2], unpack(removed))
+	redis.call('HSET', KEYS[2], '__has_more', '1')
+end
+return 1
+"""
+
+# KEYS: order, rows, version
+# ARGV: ttl, name
+REMOVE_SCRIPT = """
+redis.call('INCR', KEYS[3])
+redis.call('EXPIRE', KEYS[3], ARGV[1])
+redis.call('ZREM', KEYS[1], ARGV[2])
+redis.call('HDEL', KEYS[2], ARGV[2])
+return 1
+"""
+
+
+def get_recent_messages_query(channel_id: str):
+	"""
+	Query for the messages of a channel, newest first. Text and content of retracted messages are hidden.
+	"""
+	message = frappe.qb.DocType("Raven Message")
+
+	return (
+		frappe.qb.from_(message)
+		.select(
+			message.name,
+			message.seq,
+			message.owner,
+			message.creation,
+			message.modified,
+			Case().when(message.is_retracted == 1, None).else_(message.text).as_("text"),
+			message.file,
+			message.message_type,
+			message.message_reactions,
+			message.is_reply,
+			message.linked_message,
+			message._liked_by,
+			message.channel_id,
+			message.thumbnail_width,
+			message.thumbnail_height,
+			message.file_thumbnail,
+			message.link_doctype,
+			message.link_document,
+			message.replied_message_details,
+			Case().when(message.is_retracted == 1, None).else_(message.content).as_("content"),
+			message.is_edited,
+			message.is_forwarded,
+			message.poll_id,
+			message.is_bot_message,
+			message.bot,
+			message.hide_link_preview,
+			message.is_thread,
+			message.blurhash,
+			message.is_retracted,
+		)
+		.where(message.channel_id == channel_id)
+		.orderby(message.seq, order=Order.desc)
+	)
+
+
+def get_recent_messages(channel_id: str, limit: int = 10, version: bytes | None = None):
+	"""
+	Get the newest `limit` messages of a channel and whether older messages are available.
+
+	Served from the ring buffer if the page fits in it, else read from the database.
+
+	The rows read from the database are only put in the buffer if the version did not change since
+	the snapshot of the transaction was taken. Callers which already ran a query in the transaction
+	pass the `version` they read (see get_buffer_version) before their first query - a version read
+	afterwards could include commits which the snapshot does not see.
+	"""
+	if limit >= BUFFER_SIZE:
+		return fetch_recent_messages(channel_id, limit)
+
+	cached = read_buffer(channel_id, limit)
+	if cached is not None:
+		record_cache_access("hits")
+		return cached
+
+	record_cache_access("misses")
+
+	if version is None:
+		version = get_buffer_version(channel_id)
+	messages, has_more = fetch_recent_messages(channel_id, BUFFER_SIZE)
+	fill_buffer(channel_id, messages, has_more, version)
+
+	return messages[:limit], has_more or len(messages) > limit
+
+
+def get_buffer_version(channel_id: str) -> bytes:
+	return get_cache().get(get_key(channel_id, "version")) or b"0"
+
+
+def fetch_recent_messages(channel_id: str, limit: int):
+	# Fetch one extra message to know if older messages are available
+	messages = get_recent_messages_query(channel_id).limit(limit + 1).run(as_dict=True)
+
+	has_old_messages = len(messages) > limit
+	del messages[limit:]
+
+	return messages, has_old_messages
+
+
+def read_buffer(channel_id: str, limit: int):
+	"""
+	Returns (messages, has_old_messages) from the buffer, or None if the page cannot be served from it
+	"""
+	# One extra message to know if older messages are available
+	result = get_cache().eval(
+		READ_SCRIPT, 2, get_key(channel_id), get_key(channel_id, "rows"), limit + 1
+	)
+	if not result:
+		return None
+
+	has_more, rows = result[0], result[1:]
+
+	if len(rows) > limit:
+		has_old_messages = True
+		del rows[limit:]
+	elif has_more == b"1":
+		# Messages were deleted from the buffer - the rest of the page is only in the database
+		return None
+	else:
+		has_old_messages = False
+
+	return [frappe._dict(json.loads(row)) for row in rows], has_old_messages
+
+
+def fill_buffer(channel_id: str, messages: list, has_more: bool, version: bytes):
+	args = []
+	for message in messages:
+		args.extend((message.name, message.seq, serialize_row(message)))
+
+	get_cache().eval(
+		FILL_SCRIPT,
+		3,
+		get_key(channel_id),
+		get_key(channel_id, "rows"),
+		get_key(channel_id, "version"),
+		version.decode(),
+		CACHE_TTL,
+		"1" if has_more else "0",
+		*args,
+	)
+
+
+def update_message_in_cache(channel_id: str, message_id: str):
+	"""
+	Add or update a message in the buffer of its channel once the transaction is committed
+	"""
+	frappe.db.after_commit.add(lambda: _update_message_in_cache(channel_id, message_id))
+
+
+def _update_message_in_cache(channel_id: str, message_id: str):
+	# Bumping the version rejects fills which read the database before this commit
+	pipeline = get_cache().pipeline()
+	pipeline.incr(get_key(channel_id, "version"))
+	pipeline.expire(get_key(channel_id, "version"), CACHE_TTL)
+	pipeline.hexists(get_key(channel_id, "rows"), "__has_more")
+	if not pipeline.execute()[-1]:
+		# The channel is not cached, nothing to update
+		return
+
+	message = frappe.qb.DocType("Raven Message")
+	row = get_recent_messages_query(channel_id).where(message.name == message_id).run(as_dict=True)
+
+	if not row:
+		_remove_message_from_cache(channel_id, message_id)
+		return
+
+	get_cache().eval(
+		UPSERT_SCRIPT,
+		3,
+		get_key(channel_id),
+		get_key(channel_id, "rows"),
+		get_key(channel_id, "version"),
+		CACHE_TTL,
+		BUFFER_SIZE,
+		message_id,
+		row[0].seq,
+		serialize_row(row[0]),
+	)
+
+
+def remove_message_from_cache(channel_id: str, message_id: str):
+	"""
+	Remove a message from the buffer of its channel once the transaction is committed
+	"""
+	frappe.db.after_commit.add(lambda: _remove_message_from_cache(channel_id, message_id))
+
+
+def _remove_message_from_cache(channel_id: str, message_id: str):
+	get_cache().eval(
+		REMOVE_SCRIPT,
+		3,
+		get_key(channel_id),
+		get_key(channel_id, "rows"),
+		get_key(channel_id, "version"),
+		CACHE_TTL,
+		message_id,
+	)
+
+
+def clear_recent_messages_cache(channel_id: str):
+	pipeline = get_cache().pipeline()
+	pipeline.incr(get_key(channel_id, "version"))
+	pipeline.expire(get_key(channel_id, "version"), CACHE_TTL)
+	pipeline.delete(get_key(channel_id), get_key(channel_id, "rows"))
+	pipeline.execute()
+
+
+def record_cache_access(field: str):
+	get_cache().hincrby(get_cache().make_key(STATS_KEY), field, 1)
+
+
+@frappe.whitelist()
+def get_recent_messages_cache_stats():
+	"""
+	Hits and misses of the recent messages buffer since the counters were last reset
+	"""
+	frappe.only_for("System Manager")
+
+	# Not `hgetall` of the cache - it expects pickled values
+	stats = get_cache().execute_command("HGETALL", get_cache().make_key(STATS_KEY))
+	hits = int(stats.get(b"hits", 0))
+	misses = int(stats.get(b"misses", 0))
+
+	return {
+		"hits": hits,
+		"misses": misses,
+		"hit_rate": hits / (hits + misses) if hits + misses else 0,
+	}
+
+
+def get_cache():
+	return frappe.cache()
+
+
+def get_key(channel_id: str, suffix: str | None = None):
+	key = f"raven:recent_messages:{channel_id}"
+	if suffix:
+		key += f":{suffix}"
+	return get_cache().make_key(key)
+
+
+def serialize_row(message) -> str:
+	return frappe.as_json(message, indent=None, separators=(",", ":"))
@@ -0,0 +1,406 @@
+"""
+Single pass parser for the HTML of a Raven Message.
+
+Messages used to be parsed with BeautifulSoup ("html.parser") and then walked three times - to remove
+empty trailing paragraphs, to extract mentions and to get the text content. This module tokenizes the
+HTML once with the standard library HTMLParser (the same tokenizer BeautifulSoup uses), builds a
+minimal tree and returns the cleaned HTML, the text content, the mentions, the images and the links.
+
+The output is kept byte for byte identical to what BeautifulSoup produced - the golden tests in
+raven/tests/test_message_parser.py compare both.
+"""
+
+import re
+from html.entities import html5
+from html.parser import HTMLParser
+from typing import NamedTuple
+
+# Kinds of strings in the tree
+TEXT = 0
+# Text inside <script>, <style>, <template>, <rt> and <rp> - not part of the text content
+NON_CONTENT_TEXT = 1
+COMMENT = 2
+CDATA = 3
+DOCTYPE = 4
+DECLARATION = 5
+PROCESSING_INSTRUCTION = 6
+
+STRING_PREFIX_SUFFIX = {
+	COMMENT: ("<!--", "-->"),
+	CDATA: ("<![CDATA[", "]]>"),
+	DOCTYPE: ("<!DOCTYPE ", ">\n"),
+	DECLARATION: ("<?", "?>"),
+	PROCESSING_INSTRUCTION: ("<?", ">"),
+}
+
+VOID_ELEMENTS = frozenset(
+	(
+		"area",
+		"base",
+		"br",
+		"col",
+		"embed",
+		"hr",
+		"img",
+		"input",
+		"keygen",
+		"link",
+		"menuitem",
+		"meta",
+		"param",
+		"source",
+		"track",
+		"wbr",
+		"basefont",
+		"bgsound",
+		"command",
+		"frame",
+		"image",
+		"isindex",
+		"nextid",
+		"spacer",
+	)
+)
+
+NON_CONTENT_ELEMENTS = frozenset(("rt", "rp", "style", "script", "template"))
+
+# The text of these elements is written out without escaping
+RAW_TEXT_ELEMENTS = frozenset(("script", "style"))
+
+PRESERVE_WHITESPACE_ELEMENTS = frozenset(("pre", "textarea"))
+
+# Attributes which hold a whitespace separated list of values. These are normalized to single spaces
+MULTI_VALUED_ATTRIBUTES = {
+	"*": frozenset(("class", "accesskey", "dropzone")),
+	"a": frozenset(("rel", "rev")),
+	"link": frozenset(("rel", "rev")),
+	"td": frozenset(("headers",)),
+	"th": frozenset(("headers",)),
+	"form": frozenset(("accept-charset",)),
+	"object": frozenset(("archive",)),
+	"area": frozenset(("rel",)),
+	"icon": frozenset(("sizes",)),
+	"iframe": frozenset(("sandbox",)),
+	"output": frozenset(("for",)),
+}
+
+ENTITIES = {}
+for _name, _character in sorted(html5.items()):
+	ENTITIES.setdefault(_name[:-1] if _name.endswith(";") else _name, _character)
+
+ASCII_SPACES = frozenset("\x20\x0a\x09\x0c\x0d")
+
+NON_WHITESPACE = re.compile(r"\S+")
+
+# Links in the text content - trailing punctuation is not part of the link
+URL_PATTERN = re.compile(r"https?://[^\s<>\"']+")
+URL_TRAILING_PUNCTUATION = ".,;:!?)]}'\""
+
+
+class ParsedMessage(NamedTuple):
+	text: str
+	content: str
+	mentions: list[str]
+	images: list[str]
+	links: list[str]
+
+
+class Element:
+	__slots__ = ("name", "attrs", "children", "parent")
+
+	def __init__(self, name, attrs, parent):
+		self.name = name
+		self.attrs = attrs
+		self.children = []
+		self.parent = parent
+
+
+class MessageHTMLParser(HTMLParser):
+	"""
+	Builds the tree the same way BeautifulSoup's "html.parser" tree builder does:
+	1. Unclosed tags are closed at the end of the document, stray end tags are ignored
+	2. Whitespace only strings are collapsed to a single space or newline (except in <pre> and <textarea>)
+	3. Character and entity references are resolved like BeautifulSoup does
+	"""
+
+	def __init__(self):
+		super().__init__(convert_charrefs=False)
+		self.root = Element("[document]", {}, None)
+		self.current = self.root
+		self.open_tags = {}
+		self.preserve_whitespace = 0
+		self.non_content = 0
+		self.data = []
+		self.already_closed_void_elements = []
+		self.elements = []
+		self.mentions = []
+		self.images = []
+		self.anchors = []
+
+	def end_data(self, kind=TEXT):
+		if not self.data:
+			return
+
+		data = "".join(self.data)
+		self.data = []
+
+		if not self.preserve_whitespace and all(c in ASCII_SPACES for c in data):
+			data = "\n" if "\n" in data else " "
+
+		if kind == TEXT and self.non_content:
+			kind = NON_CONTENT_TEXT
+
+		self.current.children.append((kind, data))
+
+	def push(self, element):
+		self.current.children.append(element)
+		self.current = element
+		self.open_tags[element.name] = self.open_tags.get(element.name, 0) + 1
+
+		if element.name in PRESERVE_WHITESPACE_ELEMENTS:
+			self.preserve_whitespace += 1
+		if element.name in NON_CONTENT_ELEMENTS:
+			self.non_content += 1
+
+	def pop(self):
+		element = self.current
+		self.current = element.parent
+		self.open_tags[element.name] -= 1
+
+		if element.name in PRESERVE_WHITESPACE_ELEMENTS:
+			self.preserve_whitespace -= 1
+		if element.name in NON_CONTENT_ELEMENTS:
+			self.non_content -= 1
+
+	def pop_to(self, name):
+		"""
+		Close the most recently opened element with this name (and everything opened after it)
+		"""
+		if not self.open_tags.get(name):
+			return
+
+		while self.current is not self.root:
+			element = self.current
+			self.pop()
+			if element.name == name:
+				break
+
+	def handle_starttag(self, tag, attrs, close_void_element=True):
+		self.end_data()
+
+		attributes = {}
+		for key, value in attrs:
+			attributes[key] = "" if value is None else value
+
+		multi_valued = MULTI_VALUED_ATTRIBUTES["*"] | MULTI_VALUED_ATTRIBUTES.get(tag, frozenset())
+		for key in attributes.keys() & multi_valued:
+			attributes[key] = " ".join(NON_WHITESPACE.findall(attributes[key]))
+
+		element = Element(tag, attributes, self.current)
+		self.push(element)
+		self.elements.append(element)
+
+		if tag == "span" and attributes.get("data-type") == "userMention":
+			self.mentions.append(element)
+		elif tag == "img":
+			self.images.append(element)
+		elif tag == "a":
+			self.anchors.append(element)
+
+		if close_void_element and tag in VOID_ELEMENTS:
+			self.handle_endtag(tag, check_already_closed=False)
+			# An explicit end tag for this element is ignored later on
+			self.already_closed_void_elements.append(tag)
+
+	def handle_startendtag(self, tag, attrs):
+		self.handle_starttag(tag, attrs, close_void_element=False)
+		self.handle_endtag(tag)
+
+	def handle_endtag(self, tag, check_already_closed=True):
+		if check_already_closed and tag in self.already_closed_void_elements:
+			self.already_closed_void_elements.remove(tag)
+		else:
+			self.end_data()
+			self.pop_to(tag)
+
+	def handle_data(self, data):
+		self.data.append(data)
+
+	def handle_charref(self, name):
+		if name[0] in "xX":
+			codepoint = int(name.lstrip(name[0]), 16)
+		else:
+			codepoint = int(name)
+
+		data = None
+		if codepoint < 256:
+			# Numeric references below 256 are sometimes meant as Windows-1252
+			try:
+				data = bytes([codepoint]).decode("windows-1252")
+			except UnicodeDecodeError:
+				pass
+		if not data:
+			try:
+				data = chr(codepoint)
+			except (ValueError, OverflowError):
+				pass
+
+		self.handle_data(data or "\N{REPLACEMENT CHARACTER}")
+
+	def handle_entityref(self, name):
+		character = ENTITIES.get(name)
+		self.handle_data(character if character is not None else "&" + name)
+
+	def handle_comment(self, data):
+		self.end_data()
+		self.handle_data(data)
+		self.end_data(COMMENT)
+
+	def handle_decl(self, data):
+		self.end_data()
+		if data.startswith("DOCTYPE "):
+			data = data[len("DOCTYPE ") :]
+		self.handle_data(data)
+		self.end_data(DOCTYPE)
+
+	def unknown_decl(self, data):
+		kind = DECLARATION
+		if data.upper().startswith("CDATA["):
+			kind = CDATA
+			data = data[len("CDATA[") :]
+		self.end_data()
+		self.handle_data(data)
+		self.end_data(kind)
+
+	def handle_pi(self, data):
+		self.end_data()
+		self.handle_data(data)
+		self.end_data(PROCESSING_INSTRUCTION)
+
+	def close(self):
+		super().close()
+		self.end_data()
+		while self.current is not self.root:
+			self.pop()
+
+
+def parse_message_html(html: str) -> ParsedMessage:
+	"""
+	Parse the HTML of a message:
+	1. Remove empty trailing paragraphs and line breaks
+	2. Extract the IDs of all user mentions (in order, duplicates included)
+	3. Extract the text content
+	4. Extract the sources of all the images
+	5. Extract the http(s) links - of the anchors and in the text content (unique, in order)
+	"""
+	parser = MessageHTMLParser()
+	parser.feed(html)
+	parser.close()
+
+	remove_empty_trailing_paragraphs(parser.elements)
+
+	content = " ".join(get_strings(parser.root))
+
+	return ParsedMessage(
+		text=serialize(parser.root),
+		content=content,
+		mentions=[element.attrs.get("data-id") for element in parser.mentions],
+		images=[element.attrs.get("src") for element in parser.images],
+		links=get_links(parser.anchors, content),
+	)
+
+
+def get_links(anchors: list, content: str) -> list[str]:
+	links = [element.attrs.get("href") or "" for element in anchors] + URL_PATTERN.findall(content)
+
+	return list(
+		dict.fromkeys(
+			strip_trailing_punctuation(link.strip())
+			for link in links
+			if URL_PATTERN.match(link.strip())
+		)
+	)
+
+
+def strip_trailing_punctuation(link: str) -> str:
+	"""
+	Strip the trailing punctuation of a link. A closing parenthesis is only stripped
+	when it is not balanced - e.g. https://en.wikipedia.org/wiki/Foo_(bar) keeps it
+	"""
+	while link and link[-1] in URL_TRAILING_PUNCTUATION:
+		if link[-1] == ")" and link.count(")") <= link.count("("):
+			break
+		link = link[:-1]
+
+	return link
+
+
+def remove_empty_trailing_paragraphs(elements: list):
+	"""
+	Walk the elements backwards (in the order they were opened) and remove empty <p> and <br> tags
+	until an element which is not empty is found
+	"""
+	for element in reversed(elements):
+		if element.name in ("br", "p") and not element.children:
+			element.parent.children.remove(element)
+			element.parent = None
+		else:
+			break
+
+
+def get_strings(element):
+	"""
+	Yield all the stripped, non empty strings of the text content
+	"""
+	for child in element.children:
+		if child.__class__ is Element:
+			yield from get_strings(child)
+		elif child[0] == TEXT or child[0] == CDATA:
+			text = child[1].strip()
+			if text:
+				yield text
+
+
+def serialize(element) -> str:
+	output = []
+	serialize_children(element, output)
+	return "".join(output)
+
+
+def serialize_children(element, output: list):
+	for child in element.children:
+		if child.__class__ is Element:
+			serialize_element(child, output)
+		elif child[0] == TEXT or child[0] == NON_CONTENT_TEXT:
+			output.append(
+				child[1] if element.name in RAW_TEXT_ELEMENTS else escape(child[1])
+			)
+		else:
+			prefix, suffix = STRING_PREFIX_SUFFIX[child[0]]
+			output.append(prefix + child[1] + suffix)
+
+
+def serialize_element(element, output: list):
+	output.append("<" + element.name)
+
+	for key, value in sorted(element.attrs.items()):
+		value = escape(value)
+		quote = '"'
+		if '"' in value:
+			if "'" in value:
+				value = value.replace('"', "&quot;")
+			else:
+				quote = "'"
+		output.append(" " + key + "=" + quote + value + quote)
+
+	if not element.children and element.name in VOID_ELEMENTS:
+		output.append("/>")
+		return
+
+	output.append(">")
+	serialize_children(element, output)
+	output.append("</" + element.name + ">")
+
+
+def escape(text: str) -> str:
+	return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
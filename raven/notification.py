@@ -35,144 +35,183 @@ def send_push_notification_via_raven_cloud(message, raven_settings):
 	"""
 	Send a push notification via the Raven Cloud API
 	"""
-	channel_doc = frappe.get_cached_doc("Raven Channel", message.channel_id)
+	try:
+		messages = get_raven_cloud_notifications(message)
+
+		if messages:
+			make_post_call_for_notification(messages, raven_settings)
+
+	except Exception:
+		frappe.log_error(title="Raven Cloud Push Notification Error")
+
+
+def send_notifications_for_messages(messages):
+	"""
+	Send push notifications for a batch of messages.
+
+	With Raven Cloud, the notifications for all the messages are sent in a single API call
+	"""
+	raven_settings = frappe.get_cached_doc("Raven Settings")
+
+	if raven_settings.push_notification_service != "Raven":
+		for message in messages:
+			send_notification_for_message(message)
 
-	if channel_doc.is_self_message:
 		return
 
 	try:
+		notifications = []
+		for message in messages:
+			notifications.extend(get_raven_cloud_notifications(message))
 
-		channel_members = get_channel_members(message.channel_id)
+		if notifications:
+			make_post_call_for_notification(notifications, raven_settings)
 
-		users = []
+	except Exception:
+		frappe.log_error(title="Raven Cloud Push Notification Error")
 
-		# Loop over the channel members and add the users who have subscribed to push notifications
-		for member in channel_members.values():
-			if member.get("allow_notifications"):
-				users.append(member.get("user_id"))
 
-		if not users:
-			return
+def get_raven_cloud_notifications(message) -> list:
+	"""
+	Get the payloads to be sent to the Raven Cloud API for a message
+	"""
+	channel_doc = frappe.get_cached_doc("Raven Channel", message.channel_id)
 
-		mentions = [user.get("user") for user in message.mentions]
+	if channel_doc.is_self_message:
+		return []
 
-		replied_to = None
+	channel_members = get_channel_members(message.channel_id)
 
-		if message.linked_message:
-			replied_message_details = message.replied_message_details
+	users = []
 
-			if isinstance(replied_message_details, str):
-				replied_message_details = json.loads(message.replied_message_details)
+	# Loop over the channel members and add the users who have subscribed to push notifications
+	for member in channel_members.values():
+		if member.get("allow_notifications"):
+			users.append(member.get("user_id"))
 
-			replied_to = replied_message_details.get("owner")
+	if not users:
+		return []
 
-		mentioned_users = []
-		replied_users = []
-		final_users = []
+	mentions = [user.get("user") for user in message.mentions]
 
-		# If this is a bot message, then we should not filter out the push tokens of the message owner since we need to send the notification to the owner as well (it's coming from the bot)
-		if not message.is_bot_message:
-			# Filter out the push tokens of the message owner
-			users = [user for user in users if user != message.owner]
+	# An @all mention is stored as a single mention for the whole channel
+	if "all" in mentions:
+		mentions = users
 
-		for user in users:
-			if user == replied_to:
-				replied_users.append(user)
-			elif user in mentions:
-				mentioned_users.append(user)
-			else:
-				final_users.append(user)
+	replied_to = None
 
-		# We now need to construct the payload for the push notification
+	if message.linked_message:
+		replied_message_details = message.replied_message_details
 
-		if not mentioned_users and not replied_users and not final_users:
-			return
+		if isinstance(replied_message_details, str):
+			replied_message_details = json.loads(message.replied_message_details)
 
-		messages = []
+		replied_to = replied_message_details.get("owner")
 
-		channel_name = f" in #{channel_doc.channel_name}"
+	mentioned_users = []
+	replied_users = []
+	final_users = []
 
-		if channel_doc.is_thread:
-			channel_name = " in thread"
+	# If this is a bot message, then we should not filter out the push tokens of the message owner since we need to send the notification to the owner as well (it's coming from the bot)
+	if not message.is_bot_message:
+		# Filter out the push tokens of the message owner
+		users = [user for user in users if user != message.owner]
 
-		if channel_doc.is_direct_message:
-			channel_name = ""
+	for user in users:
+		if user == replied_to:
+			replied_users.append(user)
+		elif user in mentions:
+			mentioned_users.append(user)
+		else:
+			final_users.append(user)
 
-		content = message.get_notification_message_content()
+	# We now need to construct the payload for the push notification
 
-		message_owner, message_owner_image = message.get_message_owner_details()
+	if not mentioned_users and not replied_users and not final_users:
+		return []
 
-		workspace = "" if channel_doc.is_dm_thread else channel_doc.workspace
+	messages = []
 
-		url = frappe.utils.get_url() + "/raven/"
-		if workspace:
-			url += f"{workspace}/"
-		else:
-			url += "channels/"
+	channel_name = f" in #{channel_doc.channel_name}"
 
-		if channel_doc.is_thread:
-			url += f"thread/{channel_doc.name}/"
-		else:
-			url += f"{channel_doc.name}/"
-
-		image = get_image_absolute_url(message_owner_image)
-
-		data = {
-			"base_url": frappe.utils.get_url(),
-			"message_url": url,
-			"sitename": frappe.local.site,
-			"message_id": message.name,
-			"channel_id": message.channel_id,
-			"raven_message_type": message.message_type,
-			"channel_type": "DM" if channel_doc.is_direct_message else "Channel",
-			"content": message.content,
-			"from_user": message.owner,
-			"type": "New message",
-			"is_thread": "1" if channel_doc.is_thread else "0",
-			"creation": get_milliseconds_since_epoch(message.creation),
-			"image": image if image else "",
-		}
-
-		if replied_users:
-			messages.append(
-				{
-					"users": replied_users,
-					"notification": {"title": f"{message_owner} replied{channel_name}", "body": content},
-					"data": data,
-					"tag": message.channel_id,
-					"click_action": url,
-					"image": image,
-				}
-			)
+	if channel_doc.is_thread:
+		channel_name = " in thread"
 
-		if mentioned_users:
-			messages.append(
-				{
-					"users": mentioned_users,
-					"notification": {"title": f"{message_owner} mentioned you{channel_name}", "body": content},
-					"data": data,
-					"tag": message.channel_id,
-					"click_action": url,
-					"image": image,
-				}
-			)
+	if channel_doc.is_direct_message:
+		channel_name = ""
 
-		if final_users:
-			messages.append(
-				{
-					"users": final_users,
-					"notification": {"title": f"{message_owner}{channel_name}", "body": content},
-					"data": data,
-					"tag": message.channel_id,
-					"click_action": url,
-					"image": image,
-				}
-			)
+	content = message.get_notification_message_content()
 
-		make_post_call_for_notification(messages, raven_settings)
+	message_owner, message_owner_image = message.get_message_owner_details()
 
-	except Exception as e:
-		frappe.log_error(title="Raven Cloud Push Notification Error")
+	workspace = "" if channel_doc.is_dm_thread else channel_doc.workspace
+
+	url = frappe.utils.get_url() + "/raven/"
+	if workspace:
+		url += f"{workspace}/"
+	else:
+		url += "channels/"
+
+	if channel_doc.is_thread:
+		url += f"thread/{channel_doc.name}/"
+	else:
+		url += f"{channel_doc.name}/"
+
+	image = get_image_absolute_url(message_owner_image)
+
+	data = {
+		"base_url": frappe.utils.get_url(),
+		"message_url": url,
+		"sitename": frappe.local.site,
+		"message_id": message.name,
+		"channel_id": message.channel_id,
+		"raven_message_type": message.message_type,
+		"channel_type": "DM" if channel_doc.is_direct_message else "Channel",
+		"content": message.content,
+		"from_user": message.owner,
+		"type": "New message",
+		"is_thread": "1" if channel_doc.is_thread else "0",
+		"creation": get_milliseconds_since_epoch(message.creation),
+		"image": image if image else "",
+	}
+
+	if replied_users:
+		messages.append(
+			{
+				"users": replied_users,
+				"notification": {"title": f"{message_owner} replied{channel_name}", "body": content},
+				"data": data,
+				"tag": message.channel_id,
+				"click_action": url,
+				"image": image,
+			}
+		)
+
+	if mentioned_users:
+		messages.append(
+			{
+				"users": mentioned_users,
+				"notification": {"title": f"{message_owner} mentioned you{channel_name}", "body": content},
+				"data": data,
+				"tag": message.channel_id,
+				"click_action": url,
+				"image": image,
+			}
+		)
+
+	if final_users:
+		messages.append(
+			{
+				"users": final_users,
+				"notification": {"title": f"{message_owner}{channel_name}", "body": content},
+				"data": data,
+				"tag": message.channel_id,
+				"click_action": url,
+				"image": image,
+			}
+		)
+
+	return messages
 
 
 def make_post_call_for_notification(messages, raven_settings):
@@ -0,0 +1,36 @@
+import frappe
+
+from raven.raven_channel_management.doctype.raven_channel.raven_channel import get_dm_pair_key
+
+
+def execute():
+	"""
+	Set the pair key of the existing direct message channels.
+
+	Older DMs were looked up by their name in either order, so a pair of users may have more than one.
+	The pair key is unique - it is set on the oldest channel of the pair, which is the one found before.
+	"""
+	channel = frappe.qb.DocType("Raven Channel")
+	channels = (
+		frappe.qb.from_(channel)
+		.select(channel.name, channel.channel_name)
+		.where(channel.is_direct_message == 1)
+		.where(channel.dm_pair_key.isnull())
+		.orderby(channel.creation)
+	).run(as_dict=True)
+
+	pair_keys = set(
+		frappe.get_all("Raven Channel", filters={"dm_pair_key": ("is", "set")}, pluck="dm_pair_key")
+	)
+
+	for row in channels:
+		raven_users = row.channel_name.split(" _ ")
+		if len(raven_users) != 2:
+			continue
+
+		pair_key = get_dm_pair_key(*raven_users)
+		if pair_key in pair_keys:
+			continue
+
+		pair_keys.add(pair_key)
+		frappe.db.set_value("Raven Channel", row.name, "dm_pair_key", pair_key, update_modified=False)
@@ -0,0 +1,84 @@
+from bisect import bisect_right
+
+import frappe
+from frappe.query_builder import Order
+from pypika import Case
+
+from raven.read_markers import flush_read_markers, write_read_markers
+
+
+def execute():
+	"""
+	Assign the sequence numbers of the existing messages of every channel (in the order of creation)
+	and set the last read sequences of the members from their last visit
+	"""
+	# The last visits buffered in Redis need to be in the database first
+	flush_read_markers()
+
+	for channel_id in frappe.get_all("Raven Channel", pluck="name"):
+		backfill_channel(channel_id)
+		frappe.db.commit()  # nosemgrep
+
+	# Scored and counted by timestamps before - rebuilt on the next read
+	frappe.cache().delete_keys("raven:recent_messages:")
+	frappe.cache().delete_keys("raven:unread_counts:")
+
+
+def backfill_channel(channel_id: str, chunk_size: int = 1000):
+	message = frappe.qb.DocType("Raven Message")
+	messages = (
+		frappe.qb.from_(message)
+		.select(message.name, message.creation, message.message_type)
+		.where(message.channel_id == channel_id)
+		.orderby(message.creation, order=Order.asc)
+		.orderby(message.name, order=Order.asc)
+	).run(as_dict=True)
+
+	# System messages do not count as unread
+	countable_seqs = []
+	for row in messages:
+		previous = countable_seqs[-1] if countable_seqs else 0
+		countable_seqs.append(previous + (row.message_type != "System"))
+
+	for i in range(0, len(messages), chunk_size):
+		chunk = messages[i : i + chunk_size]
+
+		seq_term = Case()
+		countable_seq_term = Case()
+		for seq, row in enumerate(chunk, start=i + 1):
+			seq_term = seq_term.when(message.name == row.name, seq)
+			countable_seq_term = countable_seq_term.when(
+				message.name == row.name, countable_seqs[seq - 1]
+			)
+
+		(
+			frappe.qb.update(message)
+			.set(message.seq, seq_term.else_(message.seq))
+			.set(message.countable_seq, countable_seq_term.else_(message.countable_seq))
+			.where(message.name.isin([row.name for row in chunk]))
+		).run()
+
+	frappe.db.set_value(
+		"Raven Channel",
+		channel_id,
+		{
+			"last_seq": len(messages),
+			"last_countable_seq": countable_seqs[-1] if countable_seqs else 0,
+		},
+		update_modified=False,
+	)
+
+	# Every message created until the last visit is read
+	creations = [row.creation for row in messages]
+	members = frappe.get_all(
+		"Raven Channel Member", filters={"channel_id": channel_id}, fields=["name", "last_visit"]
+	)
+	last_read_seqs = {
+		member.name: bisect_right(creations, member.last_visit) if member.last_visit else 0
+		for member in members
+	}
+	write_read_markers("last_read_seq", last_read_seqs)
+	write_read_markers(
+		"last_read_countable_seq",
+		{name: countable_seqs[seq - 1] if seq else 0 for name, seq in last_read_seqs.items()},
+	)
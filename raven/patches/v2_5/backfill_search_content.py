@@ -0,0 +1,40 @@
+import frappe
+from pypika import Case
+
+from raven.search import rebuild_search_index
+from raven.search.utils import fold_text
+
+
+def execute():
+	"""
+	Fill the folded search content of the existing messages and build the search index
+	"""
+	message = frappe.qb.DocType("Raven Message")
+	last_name = ""
+	while True:
+		messages = (
+			frappe.qb.from_(message)
+			.select(message.name, message.content)
+			.where(message.name > last_name)
+			.where(message.is_retracted == 0)
+			.where(message.content.isnotnull())
+			.orderby(message.name)
+			.limit(1000)
+		).run(as_dict=True)
+		if not messages:
+			break
+
+		term = Case()
+		for row in messages:
+			term = term.when(message.name == row.name, fold_text(row.content))
+
+		(
+			frappe.qb.update(message)
+			.set(message.search_content, term.else_(message.search_content))
+			.where(message.name.isin([row.name for row in messages]))
+		).run()
+		frappe.db.commit()  # nosemgrep
+
+		last_name = messages[-1].name
+
+	rebuild_search_index()
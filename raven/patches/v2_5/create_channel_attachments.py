@@ -0,0 +1,69 @@
+import frappe
+
+from raven.raven_messaging.doctype.raven_channel_attachment.raven_channel_attachment import (
+	get_file_category,
+)
+
+
+def execute():
+	"""
+	Index the files of the existing file and image messages in Raven Channel Attachment
+	"""
+	message = frappe.qb.DocType("Raven Message")
+	file = frappe.qb.DocType("File")
+
+	rows = (
+		frappe.qb.from_(message)
+		.join(file)
+		.on((file.attached_to_doctype == "Raven Message") & (file.attached_to_name == message.name))
+		.select(
+			message.name.as_("message"),
+			message.channel_id,
+			message.message_type,
+			message.owner,
+			message.creation,
+			file.name.as_("file"),
+			file.file_name,
+			file.file_url,
+			file.file_type,
+			file.file_size,
+		)
+		.where(message.message_type.isin(["File", "Image"]))
+	).run(as_dict=True)
+
+	values = {}
+	for row in rows:
+		# One row per message, even if more than one file is attached to it
+		values[row.message] = (
+			row.channel_id,
+			row.message,
+			get_file_category(row.message_type, row.file_name or row.file_url),
+			row.file,
+			row.file_name,
+			row.file_url,
+			row.file_type,
+			row.file_size,
+			row.owner,
+			row.owner,
+			row.creation,
+			row.creation,
+		)
+
+	frappe.db.bulk_insert(
+		"Raven Channel Attachment",
+		[
+			"channel_id",
+			"message",
+			"category",
+			"file",
+			"file_name",
+			"file_url",
+			"file_type",
+			"file_size",
+			"owner",
+			"modified_by",
+			"creation",
+			"modified",
+		],
+		list(values.values()),
+	)
@@ -0,0 +1,67 @@
+import frappe
+
+from raven.message_parser import parse_message_html
+from raven.raven_messaging.doctype.raven_message_link.raven_message_link import get_domain
+
+
+def execute():
+	"""
+	Extract the links of the existing messages into the link index (Raven Message Link)
+	"""
+	message = frappe.qb.DocType("Raven Message")
+	last_name = ""
+	while True:
+		messages = (
+			frappe.qb.from_(message)
+			.select(message.name, message.channel_id, message.text, message.owner, message.creation)
+			.where(message.name > last_name)
+			.where(message.message_type == "Text")
+			.where(message.text.like("%http%"))
+			.orderby(message.name)
+			.limit(1000)
+		).run(as_dict=True)
+		if not messages:
+			break
+
+		values = []
+		for row in messages:
+			links = parse_message_html(row.text).links
+			for idx, url in enumerate(links, start=1):
+				values.append(
+					(
+						frappe.generate_hash(length=10),
+						row.name,
+						"Raven Message",
+						"links",
+						idx,
+						row.creation,
+						row.creation,
+						row.owner,
+						row.owner,
+						url,
+						get_domain(url),
+						row.channel_id,
+					)
+				)
+
+		frappe.db.bulk_insert(
+			"Raven Message Link",
+			[
+				"name",
+				"parent",
+				"parenttype",
+				"parentfield",
+				"idx",
+				"creation",
+				"modified",
+				"owner",
+				"modified_by",
+				"url",
+				"domain",
+				"channel_id",
+			],
+			values,
+		)
+		frappe.db.commit()  # nosemgrep
+
+		last_name = messages[-1].name
@@ -0,0 +1,39 @@
+import json
+
+import frappe
+from frappe.utils import now
+
+
+def execute():
+	"""
+	Copy the saved messages (the `_liked_by` users of a message) to Raven Saved Message.
+	The thread a message was saved from was kept in the JSON of the message.
+	"""
+	message = frappe.qb.DocType("Raven Message")
+	messages = (
+		frappe.qb.from_(message)
+		.select(message.name, message._liked_by, message.json)
+		.where(message._liked_by.isnotnull())
+		.where(message._liked_by != "[]")
+	).run(as_dict=True)
+
+	timestamp = now()
+	values = []
+
+	for row in messages:
+		try:
+			users = json.loads(row._liked_by)
+			data = json.loads(row.json) if isinstance(row.json, str) else (row.json or {})
+		except ValueError:
+			continue
+
+		saved_from_thread = data.get("saved_from_thread") if isinstance(data, dict) else None
+		for user in users:
+			values.append((user, row.name, saved_from_thread, timestamp, timestamp, user, user))
+
+	frappe.db.bulk_insert(
+		"Raven Saved Message",
+		["user", "message", "saved_from_thread", "creation", "modified", "owner", "modified_by"],
+		values,
+		ignore_duplicates=True,
+	)
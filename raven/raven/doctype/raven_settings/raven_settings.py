@@ -5,6 +5,9 @@ import frappe
 from frappe import _
 from frappe.model.document import Document
 
+from raven.search import enqueue_rebuild_search_index
+from raven.search.sqlite import is_fts5_available
+
 
 class RavenSettings(Document):
 	# begin: auto-generated types
@@ -39,6 +42,7 @@ class RavenSettings(Document):
 		push_notification_api_secret: DF.Password | None
 		push_notification_server_url: DF.Data | None
 		push_notification_service: DF.Literal["Frappe Cloud", "Raven"]
+		search_backend: DF.Literal["MariaDB", "SQLite"]
 		show_if_a_user_is_on_leave: DF.Check
 		show_raven_on_desk: DF.Check
 		tenor_api_key: DF.Data | None
@@ -68,3 +72,12 @@ class RavenSettings(Document):
 
 		if self.openai_project_id:
 			self.openai_project_id = self.openai_project_id.strip()
+
+		if self.search_backend == "SQLite" and not is_fts5_available():
+			frappe.throw(
+				_("The SQLite on this server is built without FTS5. Please use the MariaDB search backend.")
+			)
+
+	def on_update(self):
+		if self.has_value_changed("search_backend"):
+			enqueue_rebuild_search_index()
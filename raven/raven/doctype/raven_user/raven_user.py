@@ -5,6 +5,8 @@ import frappe
 from frappe import _
 from frappe.model.document import Document
 
+from raven.sidebar import invalidate_sidebar
+
 
 class RavenUser(Document):
 	# begin: auto-generated types
@@ -65,6 +67,7 @@ class RavenUser(Document):
 		Remove the Raven User from all channels
 		"""
 		frappe.db.delete("Raven Channel Member", {"user_id": self.user})
+		invalidate_sidebar([self.user])
 
 	def after_delete(self):
 		"""
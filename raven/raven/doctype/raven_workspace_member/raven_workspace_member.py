@@ -5,6 +5,7 @@ import frappe
 from frappe import _
 from frappe.model.document import Document
 
+from raven.sidebar import invalidate_sidebar
 from raven.utils import delete_channel_members_cache, delete_workspace_members_cache
 
 
@@ -51,6 +52,7 @@ class RavenWorkspaceMember(Document):
 
 	def after_insert(self):
 		self.invalidate_workspace_members_cache()
+		invalidate_sidebar([self.user])
 
 	def on_update(self):
 		self.invalidate_workspace_members_cache()
@@ -59,6 +61,7 @@ class RavenWorkspaceMember(Document):
 		self.check_last_admin()
 		self.delete_channel_members_for_user()
 		self.invalidate_workspace_members_cache()
+		invalidate_sidebar([self.user])
 
 	def check_last_admin(self):
 		"""
@@ -1,19 +1,40 @@
 # Copyright (c) 2024, The Commit Company and contributors
 # For license information, please see license.txt
 
+import datetime
 import json
 
 import frappe
 from frappe import _
 from frappe.model.document import Document
+from frappe.model.naming import make_autoname
+from frappe.realtime import get_doc_room, get_user_room
 from openai import APIConnectionError
+from pypika import Case
 
 from raven.ai.openai_client import (
 	code_interpreter_file_types,
 	file_search_file_types,
 	get_open_ai_client,
 )
-from raven.utils import get_raven_user
+from raven.message_cache import update_message_in_cache
+from raven.notification import send_notifications_for_messages
+from raven.raven_channel_management.doctype.raven_channel.raven_channel import (
+	allocate_message_seq,
+	get_dm_channel_id,
+	get_dm_pair_key,
+)
+from raven.raven_messaging.doctype.raven_message_link.raven_message_link import get_domain
+from raven.search import update_search_index
+from raven.search.utils import fold_text
+from raven.sidebar import invalidate_sidebar
+from raven.utils import (
+	add_linked_doctypes,
+	get_raven_room,
+	get_raven_user,
+	publish_realtime_to_rooms,
+	publish_realtime_to_users,
+)
 
 
 class RavenBot(Document):
@@ -399,19 +420,7 @@ class RavenBot(Document):
 		user_raven_user = frappe.db.get_value("Raven User", {"user": user_id}, "name")
 		if not user_raven_user:
 			return None
-		channel_name = frappe.db.get_value(
-			"Raven Channel",
-			filters={
-				"is_direct_message": 1,
-				"channel_name": [
-					"in",
-					[self.raven_user + " _ " + user_raven_user, user_raven_user + " _ " + self.raven_user],
-				],
-			},
-		)
-		if channel_name:
-			return channel_name
-		return None
+		return get_dm_channel_id(self.raven_user, user_raven_user)
 
 	def send_message(
 		self,
@@ -497,7 +506,12 @@ class RavenBot(Document):
 				}
 			)
 			channel.flags.is_created_by_bot = True
-			channel.insert()
+			try:
+				channel.insert()
+			except frappe.UniqueValidationError:
+				# The channel was created by a concurrent request - the pair key is unique
+				frappe.clear_last_message()
+				return get_dm_channel_id(self.raven_user, user_raven_user, for_update=True)
 			return channel.name
 
 	def send_direct_message(
@@ -534,6 +548,457 @@ class RavenBot(Document):
 				channel_id, text, link_doctype, link_document, markdown, notification_name, file
 			)
 
+	def create_direct_message_channels(self, user_ids: list[str]) -> dict:
+		"""
+		Bulk version of create_direct_message_channel
+
+		Looks up the existing direct message channels with all the users in one query and
+		creates the missing ones (along with their members) with multi-row INSERTs
+
+		Throws an error if any of the users is not a Raven User
+
+		Returns a map of user_id -> channel_id
+		"""
+		if not user_ids:
+			return {}
+
+		raven_users = dict(
+			frappe.get_all(
+				"Raven User",
+				filters={"user": ("in", list(set(user_ids)))},
+				fields=["user", "name"],
+				as_list=True,
+			)
+		)
+
+		for user_id in user_ids:
+			if user_id not in raven_users:
+				frappe.throw(f"User {user_id} is not added as a Raven User")
+
+		pair_keys = {
+			get_dm_pair_key(self.raven_user, user_raven_user): user_id
+			for user_id, user_raven_user in raven_users.items()
+		}
+
+		existing_channels = frappe.get_all(
+			"Raven Channel",
+			filters={"dm_pair_key": ("in", list(pair_keys))},
+			fields=["name", "dm_pair_key"],
+		)
+
+		dm_channels = {pair_keys[c.dm_pair_key]: c.name for c in existing_channels}
+
+		missing_users = [user_id for user_id in raven_users if user_id not in dm_channels]
+
+		if not missing_users:
+			return dm_channels
+
+		now = frappe.utils.now_datetime()
+		owner = frappe.session.user
+
+		channel_rows = []
+		new_channels = {}
+
+		for user_id in missing_users:
+			user_raven_user = raven_users[user_id]
+			channel_id = make_autoname("hash", "Raven Channel")
+			new_channels[user_id] = channel_id
+
+			channel_rows.append(
+				[
+					channel_id,
+					now,
+					now,
+					owner,
+					owner,
+					self.raven_user + " _ " + user_raven_user,
+					get_dm_pair_key(self.raven_user, user_raven_user),
+					1,
+					"Private",
+				]
+			)
+
+		# The pair key is unique - a channel created by a concurrent request in the meantime is kept
+		frappe.db.bulk_insert(
+			"Raven Channel",
+			[
+				"name",
+				"creation",
+				"modified",
+				"owner",
+				"modified_by",
+				"channel_name",
+				"dm_pair_key",
+				"is_direct_message",
+				"type",
+			],
+			channel_rows,
+			ignore_duplicates=True,
+		)
+
+		channel = frappe.qb.DocType("Raven Channel")
+		channel_ids = dict(
+			(
+				frappe.qb.from_(channel)
+				.select(channel.dm_pair_key, channel.name)
+				.where(
+					channel.dm_pair_key.isin(
+						[get_dm_pair_key(self.raven_user, raven_users[user_id]) for user_id in missing_users]
+					)
+				)
+				.for_update()
+			).run()
+		)
+
+		member_rows = []
+		events = []
+		created_users = []
+
+		for user_id in missing_users:
+			user_raven_user = raven_users[user_id]
+			channel_id = channel_ids[get_dm_pair_key(self.raven_user, user_raven_user)]
+			dm_channels[user_id] = channel_id
+
+			if channel_id != new_channels[user_id]:
+				continue
+
+			created_users.append(user_raven_user)
+
+			# The bot is the first member of the channel, hence the admin
+			for member, is_admin in ((self.raven_user, 1), (user_raven_user, 0)):
+				member_rows.append(
+					[
+						make_autoname("hash", "Raven Channel Member"),
+						now,
+						now,
+						owner,
+						owner,
+						channel_id,
+						member,
+						is_admin,
+						1,
+						now,
+					]
+				)
+
+			events.append(("channel_list_updated", {"channel_id": channel_id}, [user_raven_user]))
+
+		if not member_rows:
+			return dm_channels
+
+		frappe.db.bulk_insert(
+			"Raven Channel Member",
+			[
+				"name",
+				"creation",
+				"modified",
+				"owner",
+				"modified_by",
+				"channel_id",
+				"user_id",
+				"is_admin",
+				"allow_notifications",
+				"last_visit",
+			],
+			member_rows,
+		)
+
+		invalidate_sidebar([self.raven_user, *created_users])
+		publish_realtime_to_users(events, after_commit=True)
+
+		return dm_channels
+
+	def send_messages_bulk(
+		self,
+		messages: list[dict],
+		markdown: bool = False,
+		notification_name: str = None,
+	) -> list[str]:
+		"""
+		Send many text messages at once
+
+		messages: A list of dicts with the following keys:
+			channel_id: The channel_id of the channel to send the message to, or
+			user_id: The User's 'name' field to send the message to in a Direct Message channel
+			text: The text of the message in HTML format. If markdown is True, the text will be converted to HTML.
+			link_doctype: (Optional) The doctype of the document to link the message to
+			link_document: (Optional) The name of the document to link the message to
+
+		Markdown is converted once per unique text, direct message channels are resolved (or created) in bulk
+		and the messages are inserted with multi-row INSERTs. Realtime events and push notifications
+		are sent once for the whole batch after the transaction is committed.
+
+		Messages which mention users are sent via send_message since mentions need the full document lifecycle.
+
+		Returns the message IDs of the messages sent, in the same order as the messages
+		"""
+		messages = [frappe._dict(message) for message in messages]
+
+		dm_channels = self.create_direct_message_channels(
+			[message.user_id for message in messages if not message.channel_id and message.user_id]
+		)
+
+		html_texts = {}
+		parsed_texts = {}
+		docs = []
+		message_ids = []
+
+		now = frappe.utils.now_datetime()
+
+		for message in messages:
+			channel_id = message.channel_id or dm_channels.get(message.user_id)
+			text = message.text
+
+			if markdown and text:
+				if text not in html_texts:
+					# Remove trailing newline if it exists
+					html_texts[text] = frappe.utils.md_to_html(text).rstrip("\n")
+				text = html_texts[text]
+
+			if text and "userMention" in text:
+				message_ids.append(
+					self.send_message(
+						channel_id,
+						text,
+						message.link_doctype,
+						message.link_document,
+						notification_name=notification_name,
+					)
+				)
+				continue
+
+			key = (text, message.link_doctype, message.link_document)
+			if key not in parsed_texts:
+				template = frappe.get_doc(
+					{
+						"doctype": "Raven Message",
+						"text": text,
+						"message_type": "Text",
+						"link_doctype": message.link_doctype,
+						"link_document": message.link_document,
+					}
+				)
+				template.parse_html_content()
+				parsed_texts[key] = (template.text, template.content, [row.url for row in template.links])
+
+			text, content, urls = parsed_texts[key]
+
+			# Offset the timestamps so that the messages keep their order in the channel
+			creation = now + datetime.timedelta(microseconds=len(docs))
+
+			doc = frappe.get_doc(
+				{
+					"doctype": "Raven Message",
+					"name": make_autoname("hash", "Raven Message"),
+					"creation": creation,
+					"modified": creation,
+					"owner": frappe.session.user,
+					"modified_by": frappe.session.user,
+					"channel_id": channel_id,
+					"text": text,
+					"content": content,
+					"search_content": fold_text(content),
+					"message_type": "Text",
+					"is_bot_message": 1,
+					"bot": self.raven_user,
+					"link_doctype": message.link_doctype,
+					"link_document": message.link_document,
+					"notification": notification_name,
+				}
+			)
+			for url in urls:
+				doc.append("links", {"url": url, "domain": get_domain(url), "channel_id": channel_id})
+			docs.append(doc)
+			message_ids.append(doc.name)
+
+		if not docs:
+			return message_ids
+
+		# One allocation per channel, in a fixed order so that concurrent sends do not deadlock
+		for channel_id in sorted({doc.channel_id for doc in docs}):
+			channel_docs = [doc for doc in docs if doc.channel_id == channel_id]
+			last_seq, last_countable_seq = allocate_message_seq(channel_id, len(channel_docs))
+			for i, doc in enumerate(channel_docs):
+				doc.seq = last_seq - len(channel_docs) + 1 + i
+				doc.countable_seq = last_countable_seq - len(channel_docs) + 1 + i
+
+		fields = [
+			"name",
+			"seq",
+			"countable_seq",
+			"creation",
+			"modified",
+			"owner",
+			"modified_by",
+			"channel_id",
+			"text",
+			"content",
+			"search_content",
+			"message_type",
+			"is_bot_message",
+			"bot",
+			"link_doctype",
+			"link_document",
+			"notification",
+		]
+		frappe.db.bulk_insert("Raven Message", fields, [[doc.get(field) for field in fields] for doc in docs])
+
+		link_fields = [
+			"name",
+			"parent",
+			"parenttype",
+			"parentfield",
+			"idx",
+			"creation",
+			"modified",
+			"owner",
+			"modified_by",
+			"url",
+			"domain",
+			"channel_id",
+		]
+		frappe.db.bulk_insert(
+			"Raven Message Link",
+			link_fields,
+			[
+				[
+					frappe.generate_hash(length=10),
+					doc.name,
+					"Raven Message",
+					"links",
+					idx,
+					doc.creation,
+					doc.modified,
+					doc.owner,
+					doc.modified_by,
+					row.url,
+					row.domain,
+					row.channel_id,
+				]
+				for doc in docs
+				for idx, row in enumerate(doc.links, start=1)
+			],
+		)
+
+		# Every channel gets the timestamp of its own last message
+		last_message_timestamps = {doc.channel_id: doc.creation for doc in docs}
+		raven_channel = frappe.qb.DocType("Raven Channel")
+		timestamp = Case()
+		for channel_id, creation in last_message_timestamps.items():
+			timestamp = timestamp.when(raven_channel.name == channel_id, creation)
+		(
+			frappe.qb.update(raven_channel)
+			.set(
+				raven_channel.last_message_timestamp,
+				timestamp.else_(raven_channel.last_message_timestamp),
+			)
+			.where(raven_channel.name.isin(list(last_message_timestamps)))
+		).run()
+
+		for doc in docs:
+			update_message_in_cache(doc.channel_id, doc.name)
+
+		update_search_index(docs)
+		add_linked_doctypes([doc.link_doctype for doc in docs])
+
+		self.publish_bulk_message_events(docs)
+
+		if not (
+			frappe.flags.in_test
+			or frappe.flags.in_install
+			or frappe.flags.in_patch
+			or frappe.flags.in_import
+		):
+			frappe.db.after_commit.add(lambda: send_notifications_for_messages(docs))
+
+		return message_ids
+
+	def publish_bulk_message_events(self, docs: list) -> None:
+		"""
+		Publish the "message_created" and unread count events for messages sent via send_messages_bulk
+
+		The unread count event is published once per channel (for the last message in the channel)
+		"""
+		latest_message_in_channel = {doc.channel_id: doc for doc in docs}
+
+		channels = {
+			channel.name: channel
+			for channel in frappe.get_all(
+				"Raven Channel",
+				filters={"name": ("in", list(latest_message_in_channel))},
+				fields=["name", "is_direct_message", "is_self_message", "is_thread"],
+			)
+		}
+
+		dm_channel_ids = [
+			channel.name
+			for channel in channels.values()
+			if channel.is_direct_message and not channel.is_self_message
+		]
+
+		peers = {}
+		if dm_channel_ids:
+			peers = dict(
+				frappe.get_all(
+					"Raven Channel Member",
+					filters={"channel_id": ("in", dm_channel_ids), "user_id": ("!=", self.raven_user)},
+					fields=["channel_id", "user_id"],
+					as_list=True,
+				)
+			)
+
+		events = [
+			(
+				"message_created",
+				doc.get_message_created_event(),
+				[get_doc_room("Raven Channel", doc.channel_id)],
+			)
+			for doc in docs
+		]
+
+		for channel_id, doc in latest_message_in_channel.items():
+			channel = channels.get(channel_id)
+			if not channel:
+				continue
+
+			last_message_details = doc.get_last_message_details()
+
+			if channel.is_thread:
+				doc.publish_unread_count_event(last_message_details)
+				continue
+
+			event = {
+				"channel_id": channel_id,
+				"play_sound": False,
+				"sent_by": doc.owner,
+				"is_dm_channel": bool(channel.is_direct_message),
+				"last_message_timestamp": doc.creation,
+				"last_message_details": last_message_details,
+			}
+
+			if channel.is_direct_message:
+				if peers.get(channel_id):
+					events.append(
+						(
+							"raven:unread_channel_count_updated",
+							{**event, "play_sound": True},
+							[get_user_room(peers[channel_id])],
+						)
+					)
+
+				# The sender needs to update the last message timestamp as well
+				events.append(("raven:unread_channel_count_updated", event, [get_user_room(doc.owner)]))
+			else:
+				events.append(
+					(
+						"raven:unread_channel_count_updated",
+						{**event, "is_thread": 0},
+						[get_raven_room()],
+					)
+				)
+
+		publish_realtime_to_rooms(events, after_commit=True)
+
 	def get_last_message(self, channel_id: str = None, message_type: str = None) -> Document | None:
 		"""
 		Gets the last message sent by the bot
@@ -1,9 +1,55 @@
 # Copyright (c) 2024, The Commit Company and Contributors
 # See license.txt
 
-# import frappe
+import frappe
 from frappe.tests.utils import FrappeTestCase
 
+test_dependencies = ["User", "Raven User"]
+
 
 class TestRavenBot(FrappeTestCase):
-	pass
+	def setUp(self):
+		self.bot = frappe.get_doc({"doctype": "Raven Bot", "bot_name": "Test Bulk Bot"}).insert()
+
+	def tearDown(self):
+		frappe.db.rollback()
+
+	def test_send_messages_bulk(self):
+		"""
+		Messages to the same user should reuse one DM channel and keep their order
+		"""
+		message_ids = self.bot.send_messages_bulk(
+			[
+				{"user_id": "test1@example.com", "text": "**Hello**"},
+				{"user_id": "test2@example.com", "text": "**Hello**"},
+				{"user_id": "test1@example.com", "text": "Second message"},
+			],
+			markdown=True,
+		)
+
+		self.assertEqual(len(message_ids), 3)
+
+		first, second, third = (frappe.get_doc("Raven Message", name) for name in message_ids)
+
+		self.assertEqual(first.channel_id, third.channel_id)
+		self.assertNotEqual(first.channel_id, second.channel_id)
+		self.assertEqual(first.content, "Hello")
+		self.assertTrue(first.is_bot_message)
+		self.assertLess(first.creation, third.creation)
+
+		self.assertEqual(
+			self.bot.create_direct_message_channel("test1@example.com"), first.channel_id
+		)
+		self.assertEqual(
+			frappe.db.count("Raven Channel Member", {"channel_id": first.channel_id}),
+			2,
+		)
+		self.assertEqual(
+			frappe.db.get_value("Raven Channel", first.channel_id, "last_message_timestamp"),
+			third.creation,
+		)
+		# Not the last message of the batch, which was sent to another channel
+		self.assertEqual(
+			frappe.db.get_value("Raven Channel", second.channel_id, "last_message_timestamp"),
+			second.creation,
+		)
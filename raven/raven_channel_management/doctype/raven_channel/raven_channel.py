@@ -5,6 +5,8 @@ import frappe
 from frappe import _
 from frappe.model.document import Document
 
+from raven.message_cache import clear_recent_messages_cache, update_message_in_cache
+from raven.sidebar import invalidate_all_sidebars
 from raven.utils import delete_channel_members_cache, get_raven_room
 
 
@@ -20,6 +22,7 @@ class RavenChannel(Document):
 
 		channel_description: DF.SmallText | None
 		channel_name: DF.Data
+		dm_pair_key: DF.Data | None
 		is_ai_thread: DF.Check
 		is_archived: DF.Check
 		is_direct_message: DF.Check
@@ -28,8 +31,10 @@ class RavenChannel(Document):
 		is_self_message: DF.Check
 		is_synced: DF.Check
 		is_thread: DF.Check
+		last_countable_seq: DF.Int
 		last_message_details: DF.JSON | None
 		last_message_timestamp: DF.Datetime | None
+		last_seq: DF.Int
 		linked_doctype: DF.Link | None
 		linked_document: DF.DynamicLink | None
 		openai_thread_id: DF.Data | None
@@ -50,10 +55,18 @@ class RavenChannel(Document):
 		# delete all reactions when channel is deleted
 		frappe.db.delete("Raven Message Reaction", {"channel_id": self.name})
 
+		# delete the attachment and link indexes of the channel
+		frappe.db.delete("Raven Channel Attachment", {"channel_id": self.name})
+		frappe.db.delete("Raven Message Link", {"channel_id": self.name})
+
+		# delete the tombstones of deleted messages
+		frappe.db.delete("Raven Message Tombstone", {"channel_id": self.name})
+
 		# Delete the pinned channels
 		frappe.db.delete("Raven Pinned Channels", {"channel_id": self.name})
 
 		delete_channel_members_cache(self.name)
+		clear_recent_messages_cache(self.name)
 
 		if not self.is_thread:
 			# Update the channel list for all users
@@ -70,6 +83,7 @@ class RavenChannel(Document):
 		if self.is_thread and frappe.db.exists("Raven Message", {"name": self.name}):
 			message_channel_id = frappe.get_cached_value("Raven Message", self.name, "channel_id")
 			frappe.db.set_value("Raven Message", self.name, "is_thread", 0)
+			update_message_in_cache(message_channel_id, self.name)
 			# Update the message which used to be a thread
 			frappe.publish_realtime(
 				"message_edited",
@@ -86,6 +100,14 @@ class RavenChannel(Document):
 			)
 
 	def on_update(self):
+		# Channels which are not DMs are listed for the members of their workspace
+		if (
+			not self.is_thread
+			and not self.is_direct_message
+			and (self.has_value_changed("type") or self.has_value_changed("workspace"))
+		):
+			invalidate_all_sidebars()
+
 		if not self.is_thread:
 			# Update the channel list for all users
 			frappe.publish_realtime(
@@ -199,6 +221,10 @@ class RavenChannel(Document):
 
 		if self.is_direct_message == 1:
 			self.type = "Private"
+			# DM channels are named "<raven user> _ <raven user>"
+			raven_users = self.channel_name.split(" _ ")
+			if not self.dm_pair_key and len(raven_users) == 2:
+				self.dm_pair_key = get_dm_pair_key(*raven_users)
 		if self.is_direct_message == 0:
 			self.channel_name = self.channel_name.strip()
 
@@ -238,3 +264,51 @@ class RavenChannel(Document):
 			self.name = self.workspace + "-" + self.channel_name.strip().lower().replace(" ", "-")
 		elif self.is_thread:
 			self.name = self.channel_name
+
+
+def get_dm_pair_key(raven_user: str, other_raven_user: str) -> str:
+	"""
+	Key of the direct message channel between two Raven Users - the same in either order
+	"""
+	return " _ ".join(sorted((raven_user, other_raven_user)))
+
+
+def get_dm_channel_id(raven_user: str, other_raven_user: str, for_update: bool = False) -> str | None:
+	"""
+	Get the channel_id of the direct message channel between two Raven Users (or a user and themself)
+
+	for_update reads the latest committed channel - after a concurrent request created it
+	"""
+	return frappe.db.get_value(
+		"Raven Channel",
+		{"dm_pair_key": get_dm_pair_key(raven_user, other_raven_user)},
+		"name",
+		for_update=for_update,
+	)
+
+
+def allocate_message_seq(
+	channel_id: str, count: int = 1, countable: int | None = None
+) -> tuple[int, int]:
+	"""
+	Reserve the next `count` sequence numbers for messages of a channel and return the last one,
+	along with the last countable sequence number.
+
+	`countable` of the messages (all of them by default) count as unread - system messages do not,
+	so they take a sequence number but leave the countable sequence as it is.
+
+	The channel row stays locked until the transaction ends, so the numbers of a channel are dense,
+	follow the commit order and are released again on rollback.
+	"""
+	if countable is None:
+		countable = count
+
+	channel = frappe.qb.DocType("Raven Channel")
+	(
+		frappe.qb.update(channel)
+		.set(channel.last_seq, channel.last_seq + count)
+		.set(channel.last_countable_seq, channel.last_countable_seq + countable)
+		.where(channel.name == channel_id)
+	).run()
+
+	return frappe.db.get_value("Raven Channel", channel_id, ["last_seq", "last_countable_seq"])
@@ -1,9 +1,43 @@
 # Copyright (c) 2023, The Commit Company and contributors
 # See license.txt
 
-# import frappe
+import frappe
 from frappe.tests.utils import FrappeTestCase
 
+from raven.api.raven_channel import create_direct_message_channel
+from raven.raven_channel_management.doctype.raven_channel.raven_channel import get_dm_pair_key
+
+EXTRA_TEST_RECORD_DEPENDENCIES = ["User", "Raven User"]
+
 
 class TestRavenChannel(FrappeTestCase):
-	pass
+	def tearDown(self):
+		frappe.db.rollback()
+		frappe.set_user("Administrator")
+
+	def test_direct_message_channel(self):
+		frappe.set_user("test@example.com")
+		channel_id = create_direct_message_channel("test1@example.com")
+
+		self.assertEqual(
+			frappe.db.get_value("Raven Channel", channel_id, "dm_pair_key"),
+			get_dm_pair_key("test1@example.com", "test@example.com"),
+		)
+
+		# The same channel is found from either side
+		self.assertEqual(create_direct_message_channel("test1@example.com"), channel_id)
+		frappe.set_user("test1@example.com")
+		self.assertEqual(create_direct_message_channel("test@example.com"), channel_id)
+
+	def test_pair_key_is_unique(self):
+		frappe.set_user("test@example.com")
+		create_direct_message_channel("test1@example.com")
+
+		channel = frappe.get_doc(
+			{
+				"doctype": "Raven Channel",
+				"channel_name": "test1@example.com _ test@example.com",
+				"is_direct_message": 1,
+			}
+		)
+		self.assertRaises(frappe.UniqueValidationError, channel.insert)
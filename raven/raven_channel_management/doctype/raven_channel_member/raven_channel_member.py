@@ -6,6 +6,7 @@ from frappe import _
 from frappe.model.document import Document
 
 from raven.notification import subscribe_user_to_topic, unsubscribe_user_to_topic
+from raven.sidebar import invalidate_sidebar
 from raven.utils import delete_channel_members_cache
 
 
@@ -22,6 +23,8 @@ class RavenChannelMember(Document):
 		channel_id: DF.Link
 		is_admin: DF.Check
 		is_synced: DF.Check
+		last_read_countable_seq: DF.Int
+		last_read_seq: DF.Int
 		last_visit: DF.Datetime
 		linked_doctype: DF.Link | None
 		linked_document: DF.DynamicLink | None
@@ -46,6 +49,9 @@ class RavenChannelMember(Document):
 
 	def before_insert(self):
 		self.last_visit = frappe.utils.now()
+		self.last_read_seq, self.last_read_countable_seq = frappe.db.get_value(
+			"Raven Channel", self.channel_id, ["last_seq", "last_countable_seq"]
+		) or (0, 0)
 		# 1. A user cannot be a member of a channel more than once
 		if frappe.db.exists(
 			"Raven Channel Member", {"channel_id": self.channel_id, "user_id": self.user_id}
@@ -134,6 +140,7 @@ class RavenChannelMember(Document):
 	def on_trash(self):
 		unsubscribe_user_to_topic(self.channel_id, self.user_id)
 		self.invalidate_channel_members_cache()
+		self.invalidate_sidebar_of_user()
 
 	def check_if_user_is_member(self):
 		is_member = True
@@ -209,6 +216,7 @@ class RavenChannelMember(Document):
 					).insert(ignore_permissions=True)
 
 		self.invalidate_channel_members_cache()
+		self.invalidate_sidebar_of_user()
 
 	def on_update(self):
 		"""
@@ -241,6 +249,7 @@ class RavenChannelMember(Document):
 			).insert(ignore_permissions=True)
 
 		self.invalidate_channel_members_cache()
+		self.invalidate_sidebar_of_user()
 
 	def get_admin_count(self):
 		return frappe.db.count("Raven Channel Member", {"channel_id": self.channel_id, "is_admin": 1})
@@ -252,6 +261,13 @@ class RavenChannelMember(Document):
 		if not self.flags.ignore_cache_invalidation:
 			delete_channel_members_cache(self.channel_id)
 
+	def invalidate_sidebar_of_user(self):
+		"""
+		The membership and done state of the user are part of their sidebar snapshot (threads are not listed)
+		"""
+		if not self.is_thread():
+			invalidate_sidebar([self.user_id])
+
 
 def on_doctype_update():
 	"""
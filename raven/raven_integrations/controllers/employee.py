@@ -1,5 +1,7 @@
 import frappe
 
+from raven.sidebar import invalidate_sidebar
+
 
 def after_insert(doc, method):
 	"""
@@ -55,6 +57,7 @@ def on_update(doc, method):
 
 			if old_channel:
 				frappe.db.delete("Raven Channel Member", {"channel_id": old_channel, "user_id": raven_user_id})
+				invalidate_sidebar([raven_user_id])
 
 		# Create a new Raven Channel Member for employee
 		new_channel = get_channel_for_department(doc.department)
@@ -67,6 +70,8 @@ def on_trash(doc, method):
 	frappe.db.delete(
 		"Raven Channel Member", {"linked_doctype": "Employee", "linked_document": doc.name}
 	)
+	if doc.user_id:
+		invalidate_sidebar([get_raven_user_for_user(doc.user_id)])
 
 
 def create_channel_member(channel_id, raven_user_id, employee_id):
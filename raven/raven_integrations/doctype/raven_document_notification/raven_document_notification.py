@@ -109,25 +109,18 @@ class RavenDocumentNotification(Document):
 
 		message = frappe.render_template(self.message, context)
 
-		for channel in channels:
-			bot.send_message(
-				channel_id=channel,
-				text=message,
-				link_doctype=link_doctype if not self.do_not_attach_doc else None,
-				link_document=link_document if not self.do_not_attach_doc else None,
-				markdown=True,
-				notification_name=self.name,
-			)
-
-		for user in users:
-			bot.send_direct_message(
-				user_id=user,
-				text=message,
-				link_doctype=link_doctype if not self.do_not_attach_doc else None,
-				link_document=link_document if not self.do_not_attach_doc else None,
-				markdown=True,
-				notification_name=self.name,
-			)
+		link_doctype = link_doctype if not self.do_not_attach_doc else None
+		link_document = link_document if not self.do_not_attach_doc else None
+
+		messages = [
+			{"channel_id": channel, "text": message, "link_doctype": link_doctype, "link_document": link_document}
+			for channel in channels
+		] + [
+			{"user_id": user, "text": message, "link_doctype": link_doctype, "link_document": link_document}
+			for user in users
+		]
+
+		bot.send_messages_bulk(messages, markdown=True, notification_name=self.name)
 
 	def get_recipients(self, context):
 		"""
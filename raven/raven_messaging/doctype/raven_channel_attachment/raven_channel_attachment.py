@@ -0,0 +1,127 @@
+# Copyright (c) 2025, The Commit Company and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+FILE_CATEGORIES = {
+	"pdf": ["pdf"],
+	"doc": ["doc", "docx", "odt", "ott", "rtf", "txt", "dot", "dotx", "docm", "dotm", "pages"],
+	"ppt": [
+		"ppt",
+		"pptx",
+		"odp",
+		"otp",
+		"pps",
+		"ppsx",
+		"pot",
+		"potx",
+		"pptm",
+		"ppsm",
+		"potm",
+		"ppam",
+		"ppa",
+		"key",
+	],
+	"xls": [
+		"xls",
+		"xlsx",
+		"csv",
+		"ods",
+		"ots",
+		"xlsb",
+		"xlsm",
+		"xlt",
+		"xltx",
+		"xltm",
+		"xlam",
+		"xla",
+		"numbers",
+	],
+}
+
+FILE_FIELDS = ["name", "file_name", "file_url", "file_type", "file_size"]
+
+
+class RavenChannelAttachment(Document):
+	# begin: auto-generated types
+	# This code is auto-generated. Do not modify anything in this block.
+
+	from typing import TYPE_CHECKING
+
+	if TYPE_CHECKING:
+		from frappe.types import DF
+
+		category: DF.Literal["image", "pdf", "doc", "ppt", "xls", "other"]
+		channel_id: DF.Link
+		file: DF.Link | None
+		file_name: DF.Data | None
+		file_size: DF.Int
+		file_type: DF.Data | None
+		file_url: DF.Data | None
+		message: DF.Data
+		name: DF.Int | None
+	# end: auto-generated types
+
+	pass
+
+
+def get_file_category(message_type: str, file_name: str | None) -> str:
+	"""
+	Images are the image messages, other files are categorized by their extension
+	"""
+	if message_type == "Image":
+		return "image"
+
+	extension = (file_name or "").rsplit(".", 1)[-1].lower()
+	for category, extensions in FILE_CATEGORIES.items():
+		if extension in extensions:
+			return category
+
+	return "other"
+
+
+def update_channel_attachment(message):
+	"""
+	Index the file of a file/image message. Forwarded messages share the file of the original message,
+	so the file is looked up by its URL when none is attached to the message.
+	"""
+	frappe.db.delete("Raven Channel Attachment", {"message": message.name})
+
+	if message.message_type not in ("File", "Image") or not message.file:
+		return
+
+	file = frappe.db.get_value(
+		"File",
+		{"attached_to_doctype": "Raven Message", "attached_to_name": message.name},
+		FILE_FIELDS,
+		as_dict=True,
+	) or frappe.db.get_value("File", {"file_url": message.file.split("?")[0]}, FILE_FIELDS, as_dict=True)
+
+	if not file:
+		return
+
+	frappe.get_doc(
+		{
+			"doctype": "Raven Channel Attachment",
+			"channel_id": message.channel_id,
+			"message": message.name,
+			"category": get_file_category(message.message_type, file.file_name or file.file_url),
+			"file": file.name,
+			"file_name": file.file_name,
+			"file_url": file.file_url,
+			"file_type": file.file_type,
+			"file_size": file.file_size,
+			# The files of a channel are listed in the order of their messages
+			"owner": message.owner,
+			"creation": message.creation,
+			"modified": message.creation,
+		}
+	).db_insert()
+
+
+def on_doctype_update():
+	# The files of a channel are filtered by category and name, newest first
+	frappe.db.add_index("Raven Channel Attachment", ["channel_id", "category", "creation"])
+	frappe.db.add_index("Raven Channel Attachment", ["channel_id", "creation"])
+	frappe.db.add_index("Raven Channel Attachment", ["message"])
@@ -0,0 +1,19 @@
+# Copyright (c) 2025, The Commit Company (Algocode Technologies Pvt. Ltd.) and Contributors
+# See license.txt
+
+from frappe.tests import UnitTestCase
+
+from raven.raven_messaging.doctype.raven_channel_attachment.raven_channel_attachment import (
+	get_file_category,
+)
+
+
+class UnitTestRavenChannelAttachment(UnitTestCase):
+	def test_file_category(self):
+		self.assertEqual(get_file_category("Image", "photo.png"), "image")
+		self.assertEqual(get_file_category("File", "Report.PDF"), "pdf")
+		self.assertEqual(get_file_category("File", "notes.docx"), "doc")
+		self.assertEqual(get_file_category("File", "slides.key"), "ppt")
+		self.assertEqual(get_file_category("File", "data.csv"), "xls")
+		self.assertEqual(get_file_category("File", "archive.zip"), "other")
+		self.assertEqual(get_file_category("File", None), "other")
@@ -1,7 +1,7 @@
 # Copyright (c) 2024, The Commit Company and contributors
 # For license information, please see license.txt
 
-# import frappe
+import frappe
 from frappe.model.document import Document
 
 
@@ -23,3 +23,12 @@ class RavenMention(Document):
 	# end: auto-generated types
 
 	pass
+
+
+def on_doctype_update():
+	"""
+	Add indexes to Raven Mention table
+	"""
+	# Mentions are looked up by user, and @all mentions by (message, user) to find the state of the current user
+	frappe.db.add_index("Raven Mention", ["user"])
+	frappe.db.add_index("Raven Mention", ["parent", "user"])
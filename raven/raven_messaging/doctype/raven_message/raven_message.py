@@ -4,7 +4,6 @@ import datetime
 import json
 
 import frappe
-from bs4 import BeautifulSoup
 from frappe import _
 from frappe.model.document import Document
 from frappe.utils import get_datetime, get_system_timezone
@@ -12,12 +11,32 @@ from pytz import timezone, utc
 
 from raven.ai.ai import handle_ai_thread_message, handle_bot_dm
 from raven.api.raven_channel import get_peer_user
+from raven.message_cache import remove_message_from_cache, update_message_in_cache
+from raven.message_parser import parse_message_html
 from raven.notification import (
 	send_notification_for_message,
 	send_notification_to_topic,
 	send_notification_to_user,
 )
-from raven.utils import get_raven_room, refresh_thread_reply_count, track_channel_visit
+from raven.raven_channel_management.doctype.raven_channel.raven_channel import allocate_message_seq
+from raven.raven_messaging.doctype.raven_channel_attachment.raven_channel_attachment import (
+	update_channel_attachment,
+)
+from raven.raven_messaging.doctype.raven_message_link.raven_message_link import get_domain
+from raven.raven_messaging.doctype.raven_message_outbox.raven_message_outbox import add_to_outbox
+from raven.raven_messaging.doctype.raven_message_tombstone.raven_message_tombstone import (
+	add_tombstone,
+)
+from raven.search import remove_from_search_index, update_search_index
+from raven.search.mariadb import create_fulltext_index
+from raven.search.utils import fold_text
+from raven.utils import (
+	add_linked_doctypes,
+	get_channel_members,
+	get_raven_room,
+	publish_realtime_to_users,
+	refresh_thread_reply_count,
+)
 
 
 class RavenMessage(Document):
@@ -29,11 +48,13 @@ class RavenMessage(Document):
 	if TYPE_CHECKING:
 		from frappe.types import DF
 		from raven.raven_messaging.doctype.raven_mention.raven_mention import RavenMention
+		from raven.raven_messaging.doctype.raven_message_link.raven_message_link import RavenMessageLink
 
 		blurhash: DF.SmallText | None
 		bot: DF.Link | None
 		channel_id: DF.Link
 		content: DF.LongText | None
+		countable_seq: DF.Int
 		file: DF.Attach | None
 		file_thumbnail: DF.Attach | None
 		hide_link_preview: DF.Check
@@ -49,12 +70,15 @@ class RavenMessage(Document):
 		link_doctype: DF.Link | None
 		link_document: DF.DynamicLink | None
 		linked_message: DF.Link | None
+		links: DF.Table[RavenMessageLink]
 		mentions: DF.Table[RavenMention]
 		message_reactions: DF.JSON | None
 		message_type: DF.Literal["Text", "Image", "File", "Poll", "System"]
 		notification: DF.Data | None
 		poll_id: DF.Link | None
 		replied_message_details: DF.JSON | None
+		search_content: DF.LongText | None
+		seq: DF.Int
 		text: DF.LongText | None
 		thumbnail_height: DF.Data | None
 		thumbnail_width: DF.Data | None
@@ -62,37 +86,72 @@ class RavenMessage(Document):
 
 	def before_validate(self):
 
-		if not self.is_new() and not self.flags.is_ai_streaming:
-			# this is not a new message, so it's a previous message being edited
+		if not self.is_new():
 			old_doc = self.get_doc_before_save()
-			if old_doc.text != self.text:
+
+			if old_doc and old_doc.text == self.text:
+				# Metadata only save (reactions, link previews, etc.) - the HTML does not need to be parsed again
+				return
+
+			if not self.flags.is_ai_streaming:
+				# this is not a new message, so it's a previous message being edited
 				self.is_edited = True
 
 		self.parse_html_content()
 
+	def before_save(self):
+		self.search_content = None if self.is_retracted else fold_text(self.content)
+		links_changed = self.flags.pop("links_changed", False)
+
+		if self.is_new():
+			# Allocated as late as possible since the channel row stays locked until the end of the transaction
+			self.seq, self.countable_seq = allocate_message_seq(
+				self.channel_id, countable=int(self.message_type != "System")
+			)
+		else:
+			# Only the mention rows which changed are written (in sync_mentions) -
+			# detach the rest so that the save does not rewrite the whole child table
+			ignore_children_type = {*(self.flags.ignore_children_type or []), "Raven Mention"}
+			self.flags.mention_rows = self.mentions
+			self.mentions = []
+
+			# The link rows are only written when the links changed (see extract_links) -
+			# otherwise they are detached too and put back in on_update.
+			# The flag stays on the document, so it is set again for every save
+			if links_changed:
+				ignore_children_type.discard("Raven Message Link")
+			else:
+				ignore_children_type.add("Raven Message Link")
+				self.flags.link_rows = self.links
+				self.links = []
+
+			self.flags.ignore_children_type = list(ignore_children_type)
+
 	def parse_html_content(self):
 		"""
 		Parse the HTML content to do the following:
 		1. Extract all user mentions
 		2. Remove empty trailing paragraphs
 		3. Extract the text content
-		4. TODO: Extract all links
+		4. Extract all links
 		"""
 		if not self.text:
 			return
 		if self.message_type == "System":
 			return
 
-		soup = BeautifulSoup(self.text, "html.parser")
-		self.remove_empty_trailing_paragraphs(soup)
-		self.extract_mentions(soup)
+		parsed = parse_message_html(self.text)
+		self.text = parsed.text
 
-		text_content = soup.get_text(" ", strip=True)
+		self.extract_mentions(parsed.mentions)
+		self.extract_links(parsed.links)
+
+		text_content = parsed.content
 
 		if not text_content:
 			# Check if the content has a GIF
-			for img in soup.find_all("img"):
-				if "media.tenor.com" in img.get("src"):
+			for src in parsed.images:
+				if src and "media.tenor.com" in src:
 					text_content = "Sent a GIF"
 					break
 
@@ -101,68 +160,95 @@ class RavenMessage(Document):
 		if not self.content and self.link_doctype and self.link_document:
 			self.content = f"{self.link_doctype} - {self.link_document}"
 
-	def extract_mentions(self, soup):
+	def extract_links(self, urls: list):
+		"""
+		Set the links of the message - the rows are only replaced when the links change
+		"""
+		if [(row.url, row.channel_id) for row in self.links] == [(url, self.channel_id) for url in urls]:
+			return
+
+		self.flags.links_changed = True
+		self.links = []
+		for url in urls:
+			self.append("links", {"url": url, "domain": get_domain(url), "channel_id": self.channel_id})
+
+	def extract_mentions(self, mention_ids: list):
 		"""
-		Extract all user mentions from the HTML content
+		Set the mentions of the message from the IDs of the mention spans in the HTML content
+
+		When a message is edited, only the mentions which were added or removed are changed
+		and only the newly mentioned users are notified
 		"""
-		self.mentions = []
-		unique_mentions = set()
+		new_mentions = list(dict.fromkeys(mention_id for mention_id in mention_ids if mention_id))
+
+		if self.is_new():
+			self.mentions = []
+			for user in new_mentions:
+				self.append("mentions", {"user": user})
+
+			self.publish_mention_events(new_mentions)
+			return
 
-		for d in soup.find_all("span", attrs={"data-type": "userMention"}):
-			mention_id = d.get("data-id")
+		existing_mentions = {row.user for row in self.mentions}
 
-			if not mention_id:
-				continue
+		# If @all is still mentioned, every member is mentioned - the rows of the members which store
+		# their read/hidden state for the @all mention are kept
+		removed_rows = (
+			[]
+			if "all" in new_mentions
+			else [row for row in self.mentions if row.user not in new_mentions]
+		)
+		for row in removed_rows:
+			self.remove(row)
+
+		added_rows = [
+			self.append("mentions", {"user": user})
+			for user in new_mentions
+			if user not in existing_mentions
+		]
+
+		self.flags.mention_changes = (added_rows, removed_rows)
+
+		if "all" not in existing_mentions:
+			self.publish_mention_events([row.user for row in added_rows])
 
-			# Handle @All Members
+	def publish_mention_events(self, mentions: list):
+		events = []
+		for mention_id in mentions:
 			if mention_id == "all":
-				members = frappe.get_all(
-					"Raven Channel Member",
-					filters={"channel_id": self.channel_id},
-					pluck="user_id",
-				)
+				# @all is stored as a single mention for the whole channel.
+				# The members it applies to are resolved when the mentions are read
+				users = [
+					user_id
+					for user_id, member in get_channel_members(self.channel_id).items()
+					if member.type == "User" and user_id != self.owner
+				]
+			else:
+				users = [mention_id]
 
-				for user_id in members:
-					if user_id not in unique_mentions:
-						self.append("mentions", {"user": user_id})
-
-						frappe.publish_realtime(
-							"raven_mention",
-							{
-								"channel_id": self.channel_id,
-								"user_id": user_id,
-							},
-							user=user_id,
-							after_commit=True,
-						)
-						unique_mentions.add(user_id)
-			# Handle normal user mentions
-			elif mention_id not in unique_mentions:
-					self.append("mentions", {"user": mention_id})
+			events.append(
+				("raven_mention", {"channel_id": self.channel_id, "user_id": mention_id}, users)
+			)
 
-					frappe.publish_realtime(
-						"raven_mention",
-						{
-							"channel_id": self.channel_id,
-							"user_id": mention_id,
-						},
-						user=mention_id,
-						after_commit=True,
-					)
-					unique_mentions.add(mention_id)
+		if events:
+			publish_realtime_to_users(events, after_commit=True)
 
-	def remove_empty_trailing_paragraphs(self, soup):
+	def sync_mentions(self):
 		"""
-		Remove p, br tags that are at the end with no content
+		Write the mention rows which were added or removed in this edit (see extract_mentions)
 		"""
-		all_tags = soup.find_all(True)
-		all_tags.reverse()
-		for tag in all_tags:
-			if tag.name in ["br", "p"] and not tag.contents:
-				tag.extract()
-			else:
-				break
-		self.text = str(soup)
+		if self.flags.mention_rows is None:
+			return
+
+		self.mentions = self.flags.pop("mention_rows")
+
+		added_rows, removed_rows = self.flags.pop("mention_changes", None) or ([], [])
+
+		if removed_rows:
+			frappe.db.delete("Raven Mention", {"name": ("in", [row.name for row in removed_rows])})
+
+		for row in added_rows:
+			row.db_insert()
 
 	def validate(self):
 		"""
@@ -212,14 +298,15 @@ class RavenMessage(Document):
 			}
 
 	def after_insert(self):
+		"""
+		The side effects of a new message (last message timestamp, unread count event, AI handling and push notifications)
+		are written to the outbox in the same transaction and run by a background worker
+		"""
 		if self.message_type != "System":
-			last_message_details = self.set_last_message_timestamp()
-			self.publish_unread_count_event(last_message_details)
+			add_to_outbox(self, "Message Created")
 
-		if self.message_type == "Text":
-			self.handle_ai_message()
-
-		self.send_push_notification()
+		if self.link_doctype:
+			add_linked_doctypes([self.link_doctype])
 
 	def handle_ai_message(self):
 
@@ -288,27 +375,35 @@ class RavenMessage(Document):
 	def set_last_message_timestamp(self):
 
 		# Update directly via SQL since we do not want to invalidate the document cache
-		message_details = json.dumps(
-			{
-				"message_id": self.name,
-				"content": self.content,
-				"message_type": self.message_type,
-				"owner": self.owner,
-				"is_bot_message": self.is_bot_message,
-				"bot": self.bot,
-			}
-		)
+		message_details = self.get_last_message_details()
 
 		raven_channel = frappe.qb.DocType("Raven Channel")
 		query = (
 			frappe.qb.update(raven_channel)
 			.where(raven_channel.name == self.channel_id)
+			# A replayed outbox entry must not move the timestamp back to an older message
+			.where(
+				raven_channel.last_message_timestamp.isnull()
+				| (raven_channel.last_message_timestamp <= self.creation)
+			)
 			.set(raven_channel.last_message_timestamp, self.creation)
 		)
 		query.run()
 
 		return message_details
 
+	def get_last_message_details(self):
+		return json.dumps(
+			{
+				"message_id": self.name,
+				"content": self.content,
+				"message_type": self.message_type,
+				"owner": self.owner,
+				"is_bot_message": self.is_bot_message,
+				"bot": self.bot,
+			}
+		)
+
 	def publish_unread_count_event(self, last_message_details=None):
 
 		channel_doc = frappe.get_cached_doc("Raven Channel", self.channel_id)
@@ -504,6 +599,10 @@ class RavenMessage(Document):
 		)
 
 	def after_delete(self):
+		add_tombstone(self)
+		remove_message_from_cache(self.channel_id, self.name)
+		remove_from_search_index([self.name])
+
 		frappe.publish_realtime(
 			"message_deleted",
 			{
@@ -542,6 +641,21 @@ class RavenMessage(Document):
 
 	def on_update(self):
 
+		self.sync_mentions()
+
+		if self.flags.link_rows is not None:
+			self.links = self.flags.pop("link_rows")
+
+		update_message_in_cache(self.channel_id, self.name)
+
+		if self.has_value_changed("search_content"):
+			update_search_index([self])
+
+		if self.message_type in ("File", "Image") and (
+			self.has_value_changed("file") or self.has_value_changed("message_type")
+		):
+			update_channel_attachment(self)
+
 		# TEMP: this is a temp fix for the Desk interface
 		self.publish_deprecated_event_for_desk()
 
@@ -593,61 +707,71 @@ class RavenMessage(Document):
 
 			frappe.publish_realtime(
 				"message_created",
-				{
-					"channel_id": self.channel_id,
-					"sender": frappe.session.user,
-					"message_id": self.name,
-					"message_details": {
-						"text": self.text,
-						"channel_id": self.channel_id,
-						"content": self.content,
-						"file": self.file,
-						"message_type": self.message_type,
-						"is_edited": 1 if self.is_edited else 0,
-						"is_thread": self.is_thread,
-						"is_forwarded": self.is_forwarded,
-						"is_reply": self.is_reply,
-						"poll_id": self.poll_id,
-						"creation": self.creation,
-						"owner": self.owner,
-						"modified_by": self.modified_by,
-						"modified": self.modified,
-						"linked_message": self.linked_message,
-						"replied_message_details": self.replied_message_details,
-						"link_doctype": self.link_doctype,
-						"link_document": self.link_document,
-						"message_reactions": self.message_reactions,
-						"thumbnail_width": self.thumbnail_width,
-						"thumbnail_height": self.thumbnail_height,
-						"file_thumbnail": self.file_thumbnail,
-						"image_width": self.image_width,
-						"image_height": self.image_height,
-						"name": self.name,
-						"is_bot_message": self.is_bot_message,
-						"bot": self.bot,
-						"hide_link_preview": self.hide_link_preview,
-						"blurhash": self.blurhash,
-					},
-				},
+				self.get_message_created_event(),
 				doctype="Raven Channel",
 				# Adding this to automatically add the room for the event via Frappe
 				docname=self.channel_id,
 				after_commit=after_commit,
 			)
 
-			if self.message_type != "System" and not self.is_bot_message:
-				# track the visit of the user to the channel if a new message is created
-				track_channel_visit(channel_id=self.channel_id, user=self.owner)
-				# frappe.enqueue(method=track_channel_visit, channel_id=self.channel_id, user=self.owner)
+			# Track the visit of the user to the channel if a new message is created
+			# and handle the AI message once a file is uploaded - both run via the outbox.
+			# While the message is inserted, they run with its "Message Created" entry
+			if (
+				self.message_type != "System"
+				and not self.flags.in_insert
+				and (
+					not self.is_bot_message or (self.message_type in ("File", "Image") and self.file)
+				)
+			):
+				add_to_outbox(self, "Message Updated")
 
-			# If this is a new messagge (only applicable for files in on_update), then handle the AI message
-			if self.message_type == "File" or self.message_type == "Image":
-				if self.file:
-					self.handle_ai_message()
+	def get_message_created_event(self):
+		"""
+		Payload of the "message_created" realtime event
+		"""
+		return {
+			"channel_id": self.channel_id,
+			"sender": frappe.session.user,
+			"message_id": self.name,
+			"message_details": {
+				"text": self.text,
+				"channel_id": self.channel_id,
+				"content": self.content,
+				"file": self.file,
+				"message_type": self.message_type,
+				"is_edited": 1 if self.is_edited else 0,
+				"is_thread": self.is_thread,
+				"is_forwarded": self.is_forwarded,
+				"is_reply": self.is_reply,
+				"poll_id": self.poll_id,
+				"creation": self.creation,
+				"owner": self.owner,
+				"modified_by": self.modified_by,
+				"modified": self.modified,
+				"linked_message": self.linked_message,
+				"replied_message_details": self.replied_message_details,
+				"link_doctype": self.link_doctype,
+				"link_document": self.link_document,
+				"message_reactions": self.message_reactions,
+				"thumbnail_width": self.thumbnail_width,
+				"thumbnail_height": self.thumbnail_height,
+				"file_thumbnail": self.file_thumbnail,
+				"image_width": self.image_width,
+				"image_height": self.image_height,
+				"name": self.name,
+				"is_bot_message": self.is_bot_message,
+				"bot": self.bot,
+				"hide_link_preview": self.hide_link_preview,
+				"blurhash": self.blurhash,
+			},
+		}
 
 	def on_trash(self):
 		# delete all the reactions for the message
 		frappe.db.delete("Raven Message Reaction", {"message": self.name})
+		frappe.db.delete("Raven Saved Message", {"message": self.name})
+		frappe.db.delete("Raven Channel Attachment", {"message": self.name})
 		# if the message is a thread, delete all messages in the thread and the thread channel
 		if self.is_thread:
 			# Delete the thread channel - this will automatically delete all the messages and their reactions in the thread
@@ -677,6 +801,14 @@ def on_doctype_update():
 	# Index the selector (channel or message type) first for faster queries (less rows to sort in the next step)
 	frappe.db.add_index("Raven Message", ["channel_id", "creation"])
 	frappe.db.add_index("Raven Message", ["message_type", "creation"])
+	# For syncing the changes to a channel since a cursor
+	frappe.db.add_index("Raven Message", ["channel_id", "modified"])
+	# For paginating a channel by the sequence numbers of its messages
+	frappe.db.add_index("Raven Message", ["channel_id", "seq"])
+	# For the messages linked to a document (timeline of Desk forms)
+	frappe.db.add_index("Raven Message", ["link_doctype", "link_document"])
+	# For searching the content of messages (see raven.search)
+	create_fulltext_index()
 
 
 def get_milliseconds_since_epoch(timestamp: str) -> str:
@@ -1,9 +1,159 @@
 # Copyright (c) 2023, The Commit Company and contributors
 # See license.txt
 
-# import frappe
+from unittest.mock import patch
+
+import frappe
 from frappe.tests.utils import FrappeTestCase
 
+from raven.api.mentions import get_mention_for_user
+from raven.raven_messaging.doctype.raven_message.raven_message import RavenMessage
+from raven.utils import delete_channel_members_cache
+
+EXTRA_TEST_RECORD_DEPENDENCIES = ["Raven Workspace", "Raven User"]
+
+MENTION = '<span class="mention" data-type="userMention" data-id="{0}" data-label="{0}">@{0}</span>'
+
+PUBLISH_REALTIME_TO_USERS = (
+	"raven.raven_messaging.doctype.raven_message.raven_message.publish_realtime_to_users"
+)
+
+
+def get_text(text: str, *mentions: str):
+	return f"<p>{text} {' '.join(MENTION.format(mention) for mention in mentions)}</p>"
+
 
 class TestRavenMessage(FrappeTestCase):
-	pass
+	def setUp(self):
+		frappe.set_user("Administrator")
+		self.channel = frappe.get_doc(
+			{
+				"doctype": "Raven Channel",
+				"channel_name": "Test Mentions Channel",
+				"type": "Public",
+				"workspace": "Public Workspace",
+			}
+		).insert()
+		for user in ["test1@example.com", "test2@example.com"]:
+			frappe.get_doc(
+				{"doctype": "Raven Channel Member", "channel_id": self.channel.name, "user_id": user}
+			).insert()
+
+	def tearDown(self):
+		frappe.set_user("Administrator")
+		frappe.db.rollback()
+		delete_channel_members_cache(self.channel.name)
+
+	def send_message(self, text: str):
+		return frappe.get_doc(
+			{
+				"doctype": "Raven Message",
+				"channel_id": self.channel.name,
+				"text": text,
+				"message_type": "Text",
+			}
+		).insert()
+
+	def edit_message(self, message, text: str):
+		message.reload()
+		message.text = text
+		message.save()
+
+	def get_mention_rows(self, message):
+		return frappe.get_all(
+			"Raven Mention",
+			filters={"parent": message.name, "parenttype": "Raven Message"},
+			fields=["name", "user"],
+			order_by="idx asc",
+		)
+
+	def get_notified(self, publish_realtime_to_users):
+		"""
+		{mention ID: users} of the mention events which were published
+		"""
+		return {
+			message["user_id"]: set(users)
+			for call in publish_realtime_to_users.call_args_list
+			for event, message, users in call.args[0]
+			if event == "raven_mention"
+		}
+
+	def test_edit_adds_and_removes_mentions(self):
+		with patch(PUBLISH_REALTIME_TO_USERS) as publish:
+			message = self.send_message(get_text("Hello", "test1@example.com"))
+		self.assertEqual(self.get_notified(publish), {"test1@example.com": {"test1@example.com"}})
+		[first_row] = self.get_mention_rows(message)
+
+		# Only the newly mentioned user gets a row and a notification
+		with patch(PUBLISH_REALTIME_TO_USERS) as publish:
+			self.edit_message(message, get_text("Hello", "test1@example.com", "test2@example.com"))
+		self.assertEqual(self.get_notified(publish), {"test2@example.com": {"test2@example.com"}})
+
+		rows = self.get_mention_rows(message)
+		self.assertEqual([row.user for row in rows], ["test1@example.com", "test2@example.com"])
+		self.assertEqual(rows[0].name, first_row.name)
+
+		# A removed mention deletes its row, the other row is kept
+		with patch(PUBLISH_REALTIME_TO_USERS) as publish:
+			self.edit_message(message, get_text("Hello", "test2@example.com"))
+		self.assertEqual(self.get_notified(publish), {})
+		self.assertEqual(self.get_mention_rows(message), [rows[1]])
+
+	def test_unchanged_mention(self):
+		message = self.send_message(get_text("Hello", "test1@example.com"))
+		rows = self.get_mention_rows(message)
+
+		with patch(PUBLISH_REALTIME_TO_USERS) as publish:
+			self.edit_message(message, get_text("Hello again", "test1@example.com"))
+
+		self.assertEqual(self.get_notified(publish), {})
+		self.assertEqual(self.get_mention_rows(message), rows)
+
+	def test_all_mention(self):
+		with patch(PUBLISH_REALTIME_TO_USERS) as publish:
+			message = self.send_message(get_text("Hello", "all"))
+
+		# One row for the channel, and every member other than the sender is notified
+		self.assertEqual(
+			self.get_notified(publish), {"all": {"test1@example.com", "test2@example.com"}}
+		)
+		[all_row] = self.get_mention_rows(message)
+		self.assertEqual(all_row.user, "all")
+
+		# The read state of a member is stored in their own row
+		frappe.set_user("test1@example.com")
+		own_row = get_mention_for_user(all_row.name)
+		frappe.set_user("Administrator")
+
+		# While @all is mentioned, the rows of the members are kept and nobody is notified again
+		with patch(PUBLISH_REALTIME_TO_USERS) as publish:
+			self.edit_message(message, get_text("Hello", "all", "test2@example.com"))
+		self.assertEqual(self.get_notified(publish), {})
+		self.assertEqual(
+			[row.user for row in self.get_mention_rows(message)],
+			["all", "test1@example.com", "test2@example.com"],
+		)
+		self.assertEqual(self.get_mention_rows(message)[1].name, own_row.name)
+
+		# Without @all, the rows of the members go with it
+		self.edit_message(message, get_text("Hello", "test2@example.com"))
+		self.assertEqual(
+			[row.user for row in self.get_mention_rows(message)], ["test2@example.com"]
+		)
+
+	def test_metadata_only_save(self):
+		message = self.send_message(get_text("Hello", "test1@example.com"))
+		rows = self.get_mention_rows(message)
+
+		message.reload()
+		message.message_reactions = '{"👍": {"count": 1}}'
+		with (
+			patch.object(RavenMessage, "parse_html_content") as parse_html_content,
+			patch(PUBLISH_REALTIME_TO_USERS) as publish,
+		):
+			message.save()
+
+		parse_html_content.assert_not_called()
+		self.assertEqual(self.get_notified(publish), {})
+		self.assertEqual(self.get_mention_rows(message), rows)
+		self.assertFalse(message.is_edited)
@@ -0,0 +1,48 @@
+# Copyright (c) 2025, The Commit Company and contributors
+# For license information, please see license.txt
+
+from urllib.parse import urlsplit
+
+import frappe
+from frappe.model.document import Document
+
+
+class RavenMessageLink(Document):
+	# begin: auto-generated types
+	# This code is auto-generated. Do not modify anything in this block.
+
+	from typing import TYPE_CHECKING
+
+	if TYPE_CHECKING:
+		from frappe.types import DF
+
+		channel_id: DF.Link | None
+		domain: DF.Data | None
+		parent: DF.Data
+		parentfield: DF.Data
+		parenttype: DF.Data
+		url: DF.SmallText
+	# end: auto-generated types
+
+	pass
+
+
+def get_domain(url: str) -> str:
+	"""
+	Normalized domain of a URL - lowercase, without the port and the "www." prefix
+	"""
+	try:
+		domain = urlsplit(url).hostname or ""
+	except ValueError:
+		return ""
+
+	return domain.removeprefix("www.")
+
+
+def on_doctype_update():
+	"""
+	Add indexes to Raven Message Link table
+	"""
+	# Links are listed per channel (newest first) and looked up by domain
+	frappe.db.add_index("Raven Message Link", ["channel_id", "creation"])
+	frappe.db.add_index("Raven Message Link", ["domain", "creation"])
@@ -0,0 +1,344 @@
+# Copyright (c) 2025, The Commit Company and contributors
+# For license information, please see license.txt
+
+from contextlib import contextmanager
+
+import frappe
+from frappe.model.document import Document
+
+from raven.utils import track_channel_visit
+
+# Number of times an entry is retried before it is marked as Failed
+MAX_ATTEMPTS = 3
+
+OUTBOX_JOB_ID = "raven_message_outbox"
+
+# Side effects which are recorded on the entry once they succeeded
+EFFECT_AI = "AI"
+EFFECT_PUSH_NOTIFICATION = "Push Notification"
+EFFECT_LAST_MESSAGE = "Last Message"
+EFFECT_CHANNEL_VISIT = "Channel Visit"
+
+
+class RavenMessageOutbox(Document):
+	# begin: auto-generated types
+	# This code is auto-generated. Do not modify anything in this block.
+
+	from typing import TYPE_CHECKING
+
+	if TYPE_CHECKING:
+		from frappe.types import DF
+
+		attempts: DF.Int
+		channel_id: DF.Link | None
+		completed_effects: DF.SmallText | None
+		error: DF.LongText | None
+		event: DF.Literal["Message Created", "Message Updated"]
+		message: DF.Link
+		name: DF.Int | None
+		send_silently: DF.Check
+		status: DF.Literal["Pending", "Failed"]
+	# end: auto-generated types
+
+	pass
+
+
+def add_to_outbox(message, event: str):
+	"""
+	Record the side effects of a message in the outbox.
+
+	The row is written in the same transaction as the message, so the side effects are
+	never lost (rollback drops both) and never run for a message that was not committed.
+	A background job drains the outbox once the transaction is committed.
+	"""
+	entry = frappe._dict(
+		name=None,
+		message=message.name,
+		channel_id=message.channel_id,
+		event=event,
+		send_silently=1 if message.flags.send_silently else 0,
+		attempts=0,
+	)
+
+	if (
+		frappe.flags.in_test
+		or frappe.flags.in_install
+		or frappe.flags.in_patch
+		or frappe.flags.in_import
+	):
+		# There is no worker to drain the outbox in these contexts - run the side effects right away
+		run_side_effects([(entry, message)], raise_exception=True)
+		return
+
+	frappe.get_doc(
+		{
+			"doctype": "Raven Message Outbox",
+			"message": entry.message,
+			"channel_id": entry.channel_id,
+			"event": entry.event,
+			"send_silently": entry.send_silently,
+		}
+	).db_insert()
+
+	# Only one drain job is queued at a time - messages sent while it is queued or running are picked up
+	# by the same job, which drains the outbox until it is empty
+	frappe.enqueue(
+		process_outbox,
+		queue="short",
+		job_id=OUTBOX_JOB_ID,
+		deduplicate=True,
+		enqueue_after_commit=True,
+	)
+
+
+def process_outbox(batch_size: int = 500, max_batches: int = 20):
+	"""
+	Drain the outbox in batches, until it is empty.
+
+	Runs after every committed message and every minute via the scheduler, so entries left behind by
+	a crashed worker (the transaction is rolled back and the rows stay "Pending") are replayed.
+
+	Entries which fail are retried by the next run, which only runs the side effects that failed.
+	"""
+	failed_entries = []
+
+	for _ in range(max_batches):
+		entries = get_pending_entries(batch_size, exclude=failed_entries)
+
+		if not entries:
+			break
+
+		messages = get_messages({entry.message for entry in entries})
+
+		failed = run_side_effects([(entry, messages.get(entry.message)) for entry in entries])
+
+		processed = [entry.name for entry in entries if entry.name not in failed]
+		if processed:
+			frappe.db.delete("Raven Message Outbox", {"name": ("in", processed)})
+
+		for entry in entries:
+			if entry.name in failed:
+				failed_entries.append(entry.name)
+				attempts = entry.attempts + 1
+				frappe.db.set_value(
+					"Raven Message Outbox",
+					entry.name,
+					{
+						"attempts": attempts,
+						"status": "Failed" if attempts >= MAX_ATTEMPTS else "Pending",
+						"error": failed[entry.name],
+						"completed_effects": "\n".join(sorted(entry.completed_effects)),
+					},
+					update_modified=False,
+				)
+
+		if not frappe.flags.in_test:
+			frappe.db.commit()  # nosemgrep
+
+
+def get_pending_entries(batch_size: int, exclude: list | None = None):
+	"""
+	Lock the oldest pending entries. Rows locked by another worker are skipped
+	"""
+	outbox = frappe.qb.DocType("Raven Message Outbox")
+
+	query = (
+		frappe.qb.from_(outbox)
+		.select(
+			outbox.name,
+			outbox.message,
+			outbox.channel_id,
+			outbox.event,
+			outbox.send_silently,
+			outbox.attempts,
+			outbox.completed_effects,
+		)
+		.where(outbox.status == "Pending")
+		.orderby(outbox.name)
+		.limit(batch_size)
+		.for_update(skip_locked=True)
+	)
+
+	# Entries which failed in this run are retried by the next one
+	if exclude:
+		query = query.where(outbox.name.notin(exclude))
+
+	return query.run(as_dict=True)
+
+
+def get_messages(names: set) -> dict:
+	"""
+	Load the messages of a batch - one query for the messages and one for each child table.
+	Messages which were deleted before the outbox was drained are left out
+	"""
+	if not names:
+		return {}
+
+	names = list(names)
+	rows = frappe.get_all("Raven Message", filters={"name": ("in", names)}, fields=["*"])
+
+	children = {}
+	for df in frappe.get_meta("Raven Message").get_table_fields():
+		for child in frappe.get_all(
+			df.options,
+			filters={
+				"parent": ("in", names),
+				"parenttype": "Raven Message",
+				"parentfield": df.fieldname,
+			},
+			fields=["*"],
+			order_by="idx asc",
+		):
+			children.setdefault(child.parent, {}).setdefault(df.fieldname, []).append(child)
+
+	return {
+		row.name: frappe.get_doc({**row, **children.get(row.name, {}), "doctype": "Raven Message"})
+		for row in rows
+	}
+
+
+def run_side_effects(entries: list, raise_exception: bool = False) -> dict:
+	"""
+	Run the side effects for a list of (outbox entry, message doc) pairs.
+
+	Effects which only depend on the latest state of a channel are coalesced:
+	1. The last message timestamp and unread count event run once per channel (for the newest message)
+	2. The channel visit of the sender is tracked once per (channel, sender)
+
+	A "Message Created" entry also runs the effects of a "Message Updated" one, since no such
+	entry is added while the message is inserted.
+
+	Push notifications and AI handling run for every message. The link previews of the new messages
+	are fetched in one background job.
+
+	Every effect which succeeded is added to `completed_effects` of its entries (a coalesced effect to
+	all the entries it covers), so a replayed entry does not run it again - e.g. a push notification
+	is not sent twice because the AI handling of the message failed.
+
+	Returns a map of outbox entry name -> error for the entries with an effect which failed
+	"""
+	failed = {}
+	latest_message_in_channel = {}
+	channel_visits = {}
+	messages_with_links = []
+
+	def run_effect(effect: str, group: list, message, function):
+		try:
+			with run_as_message_owner(message):
+				function()
+		except Exception:
+			if raise_exception:
+				raise
+			for entry in group:
+				failed[entry.name] = frappe.get_traceback()
+			frappe.log_error(title=f"Raven Message Outbox: {effect} failed for {message.name}")
+		else:
+			for entry in group:
+				entry.completed_effects.add(effect)
+
+	for entry, message in entries:
+		entry.completed_effects = set((entry.get("completed_effects") or "").splitlines())
+
+		# The message was deleted before the outbox was drained
+		if not message:
+			continue
+
+		if entry.event == "Message Created":
+			if EFFECT_LAST_MESSAGE not in entry.completed_effects:
+				latest, group = latest_message_in_channel.get(message.channel_id, (None, []))
+				if not latest or (message.creation, message.name) > (latest.creation, latest.name):
+					latest = message
+				latest_message_in_channel[message.channel_id] = (latest, [*group, entry])
+
+			if message.message_type == "Text" and EFFECT_AI not in entry.completed_effects:
+				run_effect(EFFECT_AI, [entry], message, message.handle_ai_message)
+
+			if EFFECT_PUSH_NOTIFICATION not in entry.completed_effects:
+				message.flags.send_silently = entry.send_silently
+				run_effect(
+					EFFECT_PUSH_NOTIFICATION, [entry], message, message.send_push_notification
+				)
+
+			if message.links and not message.hide_link_preview:
+				messages_with_links.append(message.name)
+
+		if not message.is_bot_message and EFFECT_CHANNEL_VISIT not in entry.completed_effects:
+			key = (message.channel_id, message.owner)
+			channel_visits[key] = (message, [*channel_visits.get(key, (None, []))[1], entry])
+
+		# If this is a new file message, then handle the AI message once the file is uploaded
+		if (
+			message.message_type in ("File", "Image")
+			and message.file
+			and EFFECT_AI not in entry.completed_effects
+		):
+			run_effect(EFFECT_AI, [entry], message, message.handle_ai_message)
+
+	def update_last_message(message):
+		last_message_details = message.set_last_message_timestamp()
+		message.publish_unread_count_event(last_message_details)
+
+	for message, group in latest_message_in_channel.values():
+		run_effect(EFFECT_LAST_MESSAGE, group, message, lambda m=message: update_last_message(m))
+
+	for (channel_id, user), (message, group) in channel_visits.items():
+		run_effect(
+			EFFECT_CHANNEL_VISIT,
+			group,
+			message,
+			lambda c=channel_id, u=user: track_channel_visit(channel_id=c, user=u),
+		)
+
+	if messages_with_links and not frappe.flags.in_test:
+		frappe.enqueue(
+			"raven.api.preview_links.prefetch_link_previews",
+			queue="long",
+			message_ids=messages_with_links,
+			enqueue_after_commit=True,
+		)
+
+	return failed
+
+
+@contextmanager
+def run_as_message_owner(message):
+	"""
+	Run side effects as the sender of the message.
+	Some of them (peer lookups for DMs, auto-joining open channels) depend on the session user.
+	"""
+	previous_user = frappe.session.user
+	if message.owner != previous_user:
+		frappe.set_user(message.owner)
+	try:
+		yield
+	finally:
+		if frappe.session.user != previous_user:
+			frappe.set_user(previous_user)
+
+
+@frappe.whitelist(methods=["POST"])
+def replay_failed_entries():
+	"""
+	Move all failed entries back to the queue and drain the outbox
+	"""
+	frappe.only_for("System Manager")
+
+	outbox = frappe.qb.DocType("Raven Message Outbox")
+	(
+		frappe.qb.update(outbox)
+		.set(outbox.status, "Pending")
+		.set(outbox.attempts, 0)
+		.where(outbox.status == "Failed")
+	).run()
+
+	frappe.enqueue(
+		process_outbox,
+		queue="short",
+		job_id=OUTBOX_JOB_ID,
+		deduplicate=True,
+		enqueue_after_commit=True,
+	)
+
+
+def on_doctype_update():
+	frappe.db.add_index("Raven Message Outbox", ["status", "name"])
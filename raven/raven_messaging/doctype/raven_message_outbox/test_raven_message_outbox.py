@@ -0,0 +1,168 @@
+# Copyright (c) 2025, The Commit Company and contributors
+# See license.txt
+
+from unittest.mock import patch
+
+import frappe
+from frappe.tests import IntegrationTestCase
+
+from raven.raven_messaging.doctype.raven_message.raven_message import RavenMessage
+from raven.raven_messaging.doctype.raven_message_outbox.raven_message_outbox import (
+	EFFECT_AI,
+	EFFECT_CHANNEL_VISIT,
+	EFFECT_LAST_MESSAGE,
+	EFFECT_PUSH_NOTIFICATION,
+	MAX_ATTEMPTS,
+	get_messages,
+	process_outbox,
+	replay_failed_entries,
+)
+
+CHANNEL_ID = "Public Workspace-test-outbox-channel"
+
+EXTRA_TEST_RECORD_DEPENDENCIES = ["Raven Workspace"]
+
+
+class TestRavenMessageOutbox(IntegrationTestCase):
+	def setUp(self):
+		frappe.set_user("Administrator")
+		frappe.get_doc(
+			{
+				"doctype": "Raven Channel",
+				"channel_name": "Test Outbox Channel",
+				"type": "Public",
+				"workspace": "Public Workspace",
+			}
+		).insert()
+
+		# The side effects of these run right away in tests - the entries are added afterwards
+		self.messages = [
+			frappe.get_doc(
+				{
+					"doctype": "Raven Message",
+					"channel_id": CHANNEL_ID,
+					"message_type": "Text",
+					"text": f"Test Message {i}",
+				}
+			).insert()
+			for i in range(3)
+		]
+		frappe.db.set_value("Raven Channel", CHANNEL_ID, "last_message_timestamp", None)
+
+		self.entries = []
+		for message in self.messages:
+			entry = frappe.get_doc(
+				{
+					"doctype": "Raven Message Outbox",
+					"message": message.name,
+					"channel_id": CHANNEL_ID,
+					"event": "Message Created",
+				}
+			)
+			entry.db_insert()
+			self.entries.append(entry.name)
+
+	def tearDown(self):
+		frappe.db.rollback()
+
+	def get_entries(self):
+		return frappe.get_all(
+			"Raven Message Outbox",
+			filters={"name": ("in", self.entries)},
+			fields=["name", "status", "attempts", "completed_effects"],
+			order_by="name asc",
+		)
+
+	def test_process_outbox(self):
+		with patch.object(RavenMessage, "send_push_notification") as send_push_notification:
+			process_outbox(batch_size=2)
+
+		# Every batch is drained, not only the first one
+		self.assertEqual(self.get_entries(), [])
+		self.assertEqual(send_push_notification.call_count, 3)
+		self.assertEqual(
+			frappe.db.get_value("Raven Channel", CHANNEL_ID, "last_message_timestamp"),
+			self.messages[-1].creation,
+		)
+
+	def test_get_messages(self):
+		message = frappe.get_doc(
+			{
+				"doctype": "Raven Message",
+				"channel_id": CHANNEL_ID,
+				"message_type": "Text",
+				"text": "https://example.com",
+			}
+		).insert()
+		frappe.db.delete("Raven Message", self.messages[0].name)
+
+		messages = get_messages({message.name, self.messages[0].name, self.messages[1].name})
+
+		# Deleted messages are left out and the child tables are loaded with the messages
+		self.assertEqual(set(messages), {message.name, self.messages[1].name})
+		self.assertEqual([row.url for row in messages[message.name].links], ["https://example.com"])
+		self.assertEqual(messages[self.messages[1].name].text, self.messages[1].text)
+
+	def test_failed_effect_is_retried_alone(self):
+		with (
+			patch.object(RavenMessage, "send_push_notification") as send_push_notification,
+			patch.object(RavenMessage, "handle_ai_message", side_effect=Exception("AI failed")),
+		):
+			process_outbox()
+
+			entries = self.get_entries()
+			self.assertEqual(len(entries), 3)
+			for entry in entries:
+				self.assertEqual(entry.status, "Pending")
+				self.assertEqual(entry.attempts, 1)
+				self.assertEqual(
+					set(entry.completed_effects.splitlines()),
+					{EFFECT_PUSH_NOTIFICATION, EFFECT_LAST_MESSAGE, EFFECT_CHANNEL_VISIT},
+				)
+
+			for _ in range(MAX_ATTEMPTS - 1):
+				process_outbox()
+
+			self.assertEqual({entry.status for entry in self.get_entries()}, {"Failed"})
+
+			# The failed entries are not picked up again until they are replayed
+			process_outbox()
+			self.assertEqual({entry.attempts for entry in self.get_entries()}, {MAX_ATTEMPTS})
+
+		with (
+			patch.object(RavenMessage, "send_push_notification") as send_push_notification_on_replay,
+			patch.object(RavenMessage, "handle_ai_message") as handle_ai_message,
+		):
+			replay_failed_entries()
+			process_outbox()
+
+		self.assertEqual(self.get_entries(), [])
+		self.assertEqual(handle_ai_message.call_count, 3)
+
+		# The push notifications were sent once - they are not sent again with the replayed entries
+		self.assertEqual(send_push_notification.call_count, 3)
+		send_push_notification_on_replay.assert_not_called()
+
+	def test_coalesced_effect_failure(self):
+		with (
+			patch.object(RavenMessage, "send_push_notification"),
+			patch.object(RavenMessage, "set_last_message_timestamp", side_effect=Exception("Failed")),
+		):
+			process_outbox()
+
+		# The timestamp is set once per channel, so every entry of the channel is kept for it
+		entries = self.get_entries()
+		self.assertEqual(len(entries), 3)
+		for entry in entries:
+			self.assertNotIn(EFFECT_LAST_MESSAGE, entry.completed_effects.splitlines())
+			self.assertIn(EFFECT_AI, entry.completed_effects.splitlines())
+
+		with patch.object(RavenMessage, "send_push_notification") as send_push_notification:
+			process_outbox()
+
+		self.assertEqual(self.get_entries(), [])
+		send_push_notification.assert_not_called()
+		self.assertEqual(
+			frappe.db.get_value("Raven Channel", CHANNEL_ID, "last_message_timestamp"),
+			self.messages[-1].creation,
+		)
@@ -0,0 +1,55 @@
+# Copyright (c) 2025, The Commit Company and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+from frappe.utils import add_days, now_datetime
+
+# Tombstones older than this are purged. Clients with an older cursor have to reload the channel.
+TOMBSTONE_RETENTION_DAYS = 30
+
+
+class RavenMessageTombstone(Document):
+	# begin: auto-generated types
+	# This code is auto-generated. Do not modify anything in this block.
+
+	from typing import TYPE_CHECKING
+
+	if TYPE_CHECKING:
+		from frappe.types import DF
+
+		channel_id: DF.Link
+		message: DF.Data
+		name: DF.Int | None
+	# end: auto-generated types
+
+	pass
+
+
+def add_tombstone(message):
+	"""
+	Record the deletion of a message, so that clients syncing the channel can remove it.
+	The creation of the tombstone is the time of the deletion.
+	"""
+	frappe.get_doc(
+		{
+			"doctype": "Raven Message Tombstone",
+			"message": message.name,
+			"channel_id": message.channel_id,
+		}
+	).db_insert()
+
+
+def get_tombstone_cutoff():
+	return add_days(now_datetime(), -TOMBSTONE_RETENTION_DAYS)
+
+
+def purge_tombstones():
+	"""
+	Delete tombstones older than the retention period. Runs daily via the scheduler.
+	"""
+	frappe.db.delete("Raven Message Tombstone", {"creation": ("<", get_tombstone_cutoff())})
+
+
+def on_doctype_update():
+	frappe.db.add_index("Raven Message Tombstone", ["channel_id", "creation"])
@@ -0,0 +1,58 @@
+# Copyright (c) 2025, The Commit Company and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class RavenSavedMessage(Document):
+	# begin: auto-generated types
+	# This code is auto-generated. Do not modify anything in this block.
+
+	from typing import TYPE_CHECKING
+
+	if TYPE_CHECKING:
+		from frappe.types import DF
+
+		message: DF.Data
+		name: DF.Int | None
+		saved_from_thread: DF.Data | None
+		user: DF.Link
+	# end: auto-generated types
+
+	pass
+
+
+def add_saved_message(message_id: str, user: str, saved_from_thread: str | None = None):
+	"""
+	Save a message for a user. Saving it again keeps the thread it was first saved from.
+	"""
+	if frappe.db.exists("Raven Saved Message", {"user": user, "message": message_id}):
+		return
+
+	try:
+		frappe.get_doc(
+			{
+				"doctype": "Raven Saved Message",
+				"user": user,
+				"message": message_id,
+				"saved_from_thread": saved_from_thread,
+			}
+		).db_insert()
+	except (frappe.DuplicateEntryError, frappe.UniqueValidationError):
+		# Saved by a concurrent request (e.g. a double click) - (user, message) is unique
+		frappe.clear_last_message()
+
+
+def remove_saved_message(message_id: str, user: str):
+	frappe.db.delete("Raven Saved Message", {"user": user, "message": message_id})
+
+
+def on_doctype_update():
+	# Listing the saved messages of a user is a range scan on the user
+	frappe.db.add_unique(
+		"Raven Saved Message",
+		fields=["user", "message"],
+		constraint_name="unique_saved_message",
+	)
+	frappe.db.add_index("Raven Saved Message", ["message"])
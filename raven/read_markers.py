@@ -0,0 +1,239 @@
+"""
+Write-behind buffer for the read markers (last_visit, the last read sequences and seen_at)
+of channel members.
+
+Opening or scrolling a channel used to update the Raven Channel Member row and commit the transaction
+on every request. The markers are now written to Redis and flushed to the database in batches by
+`flush_read_markers`, which runs every minute via the scheduler.
+
+Keys:
+1. raven:read_markers:<user> - hash of "<channel_id>|<field>" to "<member>|<value>"
+2. raven:read_markers:flushing:<user> - markers of the user which are being written to the database
+3. raven:read_marker_users - users with buffered markers
+4. raven:read_marker_flushing_users - users whose markers are being written to the database
+
+Queries and APIs reading the markers merge the buffered values - see `get_read_marker_term`
+and `get_buffered_read_markers`.
+"""
+
+import frappe
+from frappe.utils import cint, get_datetime
+from pypika import Case
+from redis.exceptions import LockError
+
+KEY_PREFIX = "raven:read_markers:"
+USERS_KEY = "raven:read_marker_users"
+FLUSHING_USERS_KEY = "raven:read_marker_flushing_users"
+
+FIELDS = ("last_visit", "last_read_seq", "last_read_countable_seq", "seen_at")
+SEQ_FIELDS = ("last_read_seq", "last_read_countable_seq")
+
+FLUSH_LOCK_KEY = "raven:read_markers_flush_lock"
+FLUSH_LOCK_TIMEOUT = 15 * 60
+
+# KEYS: users, flushing users
+# ARGV: key prefix, number of users
+# Moves the markers of up to ARGV[2] users to their flushing hashes (newer values win)
+# and returns all the users whose markers are to be flushed
+TAKE_SCRIPT = """
+local users = redis.call('SPOP', KEYS[1], ARGV[2])
+for _, user in ipairs(users) do
+	local source = ARGV[1] .. user
+	local values = redis.call('HGETALL', source)
+	for i = 1, #values, 2 do
+		redis.call('HSET', ARGV[1] .. 'flushing:' .. user, values[i], values[i + 1])
+	end
+	redis.call('DEL', source)
+	redis.call('SADD', KEYS[2], user)
+end
+return redis.call('SMEMBERS', KEYS[2])
+"""
+
+
+def buffer_read_marker(member: str, channel_id: str, user: str, field: str, value):
+	"""
+	Record a read marker of a channel member. It is written to the database by `flush_read_markers`.
+	"""
+	buffer_read_markers(member, channel_id, user, {field: value})
+
+
+def buffer_read_markers(member: str, channel_id: str, user: str, markers: dict):
+	"""
+	Record many read markers ({field: value}) of a channel member in one round trip
+	"""
+	pipeline = frappe.cache().pipeline(transaction=False)
+	pipeline.hset(
+		get_user_key(user),
+		mapping={f"{channel_id}|{field}": f"{member}|{value}" for field, value in markers.items()},
+	)
+	pipeline.sadd(frappe.cache().make_key(USERS_KEY), user)
+	pipeline.execute()
+
+
+def get_buffered_read_markers(user: str | None = None) -> dict:
+	"""
+	Get the read markers of a user which are not written to the database yet.
+
+	Returns {field: {channel_id: value}}
+	"""
+	if not user:
+		user = frappe.session.user
+
+	pipeline = frappe.cache().pipeline(transaction=False)
+	pipeline.hgetall(get_user_key(user, flushing=True))
+	pipeline.hgetall(get_user_key(user))
+	flushing, buffered = pipeline.execute()
+
+	markers = {field: {} for field in FIELDS}
+	# The values in the buffer are newer than the ones being flushed
+	for key, value in (flushing | buffered).items():
+		channel_id, field = key.decode().rsplit("|", 1)
+		markers[field][channel_id] = parse_marker(field, value.decode().rsplit("|", 1)[1])
+
+	return markers
+
+
+def get_buffered_read_marker(channel_id: str, user: str, field: str):
+	"""
+	Get the buffered read marker of a user for a channel, or None if there is none
+	"""
+	return get_buffered_channel_read_markers(channel_id, [user], field).get(user)
+
+
+def get_buffered_channel_read_markers(channel_id: str, users: list, field: str) -> dict:
+	"""
+	Get the buffered read markers of many users for a channel in one round trip
+
+	Returns {user: value} for the users who have a buffered marker
+	"""
+	pipeline = frappe.cache().pipeline(transaction=False)
+	for user in users:
+		pipeline.hget(get_user_key(user), f"{channel_id}|{field}")
+		pipeline.hget(get_user_key(user, flushing=True), f"{channel_id}|{field}")
+	values = pipeline.execute()
+
+	markers = {}
+	for i, user in enumerate(users):
+		# The values in the buffer are newer than the ones being flushed
+		value = values[2 * i] or values[2 * i + 1]
+		if value:
+			markers[user] = parse_marker(field, value.decode().rsplit("|", 1)[1])
+
+	return markers
+
+
+def get_read_marker_term(channel_member, field: str, user: str | None = None):
+	"""
+	Use instead of `channel_member[field]` in queries on the channel members of a user -
+	the buffered markers of the user take precedence over the ones in the database.
+	"""
+	markers = get_buffered_read_markers(user)[field]
+	if not markers:
+		return channel_member[field]
+
+	term = Case()
+	for channel_id, value in markers.items():
+		term = term.when(channel_member.channel_id == channel_id, value)
+
+	return term.else_(channel_member[field])
+
+
+def get_last_visit_term(channel_member, user: str | None = None):
+	return get_read_marker_term(channel_member, "last_visit", user)
+
+
+def flush_read_markers(batch_size: int = 500, max_batches: int = 20):
+	"""
+	Write the buffered read markers to the database. Runs every minute via the scheduler.
+
+	Only one flush runs at a time - a second one would take markers into the flushing hashes
+	which the first one then deletes. A flush which finds another one running leaves the markers
+	in the buffer for the next run.
+	"""
+	cache = frappe.cache()
+
+	lock = cache.lock(cache.make_key(FLUSH_LOCK_KEY), timeout=FLUSH_LOCK_TIMEOUT)
+	if not lock.acquire(blocking=False):
+		return
+
+	try:
+		_flush_read_markers(batch_size, max_batches)
+	finally:
+		try:
+			lock.release()
+		except LockError:
+			# The lock expired - the flush took longer than the timeout
+			pass
+
+
+def _flush_read_markers(batch_size: int, max_batches: int):
+	cache = frappe.cache()
+
+	for _ in range(max_batches):
+		users = cache.eval(
+			TAKE_SCRIPT,
+			2,
+			cache.make_key(USERS_KEY),
+			cache.make_key(FLUSHING_USERS_KEY),
+			cache.make_key(KEY_PREFIX),
+			batch_size,
+		)
+		if not users:
+			break
+
+		users = [user.decode() for user in users]
+
+		pipeline = cache.pipeline(transaction=False)
+		for user in users:
+			pipeline.hgetall(get_user_key(user, flushing=True))
+
+		updates = {field: {} for field in FIELDS}
+		for markers in pipeline.execute():
+			for key, value in markers.items():
+				field = key.decode().rsplit("|", 1)[1]
+				member, value = value.decode().rsplit("|", 1)
+				updates[field][member] = parse_marker(field, value)
+
+		for field, values in updates.items():
+			write_read_markers(field, values)
+
+		frappe.db.commit()  # nosemgrep
+
+		pipeline = cache.pipeline(transaction=False)
+		pipeline.srem(cache.make_key(FLUSHING_USERS_KEY), *users)
+		pipeline.delete(*(get_user_key(user, flushing=True) for user in users))
+		pipeline.execute()
+
+		if len(users) < batch_size:
+			break
+
+
+def write_read_markers(field: str, values: dict, chunk_size: int = 500):
+	"""
+	Set `field` on many channel members with one UPDATE per chunk
+
+	`values` is a map of the channel member ID to the value
+	"""
+	channel_member = frappe.qb.DocType("Raven Channel Member")
+	members = list(values)
+
+	for i in range(0, len(members), chunk_size):
+		chunk = members[i : i + chunk_size]
+
+		term = Case()
+		for member in chunk:
+			term = term.when(channel_member.name == member, values[member])
+
+		(
+			frappe.qb.update(channel_member)
+			.set(channel_member[field], term.else_(channel_member[field]))
+			.where(channel_member.name.isin(chunk))
+		).run()
+
+
+def parse_marker(field: str, value: str):
+	return cint(value) if field in SEQ_FIELDS else get_datetime(value)
+
+
+def get_user_key(user: str, flushing: bool = False):
+	return frappe.cache().make_key(f"{KEY_PREFIX}{'flushing:' if flushing else ''}{user}")
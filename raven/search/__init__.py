@@ -0,0 +1,60 @@
+"""
+Full text search on the content of messages.
+
+The content of every message is folded (lowercase, without diacritics - see `fold_text`) into
+`Raven Message.search_content` when it is saved. The backend selected in Raven Settings indexes it:
+1. MariaDB - a FULLTEXT index on the column, kept up to date by the database
+2. SQLite - an FTS5 index in a file in the site folder, updated after every commit
+
+Both rank the matches by relevance and match every word of the query as a prefix.
+"""
+
+import frappe
+
+from raven.search.base import SearchBackend
+from raven.search.mariadb import MariaDBSearchBackend
+from raven.search.sqlite import SQLiteSearchBackend
+
+BACKENDS = {
+	"MariaDB": MariaDBSearchBackend,
+	"SQLite": SQLiteSearchBackend,
+}
+
+
+def get_search_backend(backend: str | None = None) -> SearchBackend:
+	if not backend:
+		backend = frappe.get_cached_doc("Raven Settings").search_backend or "MariaDB"
+
+	return BACKENDS[backend]()
+
+
+def update_search_index(messages: list):
+	"""
+	Index the search content of messages (docs or dicts) once the transaction is committed
+	"""
+	backend = get_search_backend()
+	if not backend.index_on_commit:
+		return
+
+	rows = [(message.name, message.search_content) for message in messages]
+	frappe.db.after_commit.add(lambda: backend.index_messages(rows))
+
+
+def remove_from_search_index(message_ids: list):
+	backend = get_search_backend()
+	if backend.index_on_commit:
+		frappe.db.after_commit.add(lambda: backend.remove_messages(message_ids))
+
+
+def rebuild_search_index(backend: str | None = None):
+	get_search_backend(backend).rebuild()
+
+
+def enqueue_rebuild_search_index():
+	frappe.enqueue(
+		rebuild_search_index,
+		queue="long",
+		timeout=3600,
+		job_id="raven_rebuild_search_index",
+		deduplicate=True,
+	)
@@ -0,0 +1,36 @@
+class SearchBackend:
+	"""
+	Index of the folded content (`search_content`) of messages.
+
+	`search` gets the message query with all the other filters applied and returns the page of
+	matching rows, most relevant first. `get_match_condition` gives the condition alone, to
+	count the matches along with other conditions (see `raven.api.search.get_search_facets`).
+	"""
+
+	# Whether messages need to be sent to the index after they are committed
+	index_on_commit = True
+
+	def index_messages(self, messages: list):
+		"""
+		Add or update messages in the index. `messages` is a list of (message ID, search content).
+		Messages without search content are removed from the index.
+		"""
+		raise NotImplementedError
+
+	def remove_messages(self, message_ids: list):
+		raise NotImplementedError
+
+	def rebuild(self):
+		"""
+		Index all the messages again
+		"""
+		raise NotImplementedError
+
+	def search(self, query, message, search_text: str, limit: int, offset: int) -> list:
+		raise NotImplementedError
+
+	def get_match_condition(self, message, search_text: str):
+		"""
+		Condition on the message table for the messages matching the text, None if nothing can match
+		"""
+		raise NotImplementedError
@@ -0,0 +1,80 @@
+import frappe
+from frappe.query_builder import Order
+from pypika.terms import Criterion, LiteralValue
+
+from raven.search.base import SearchBackend
+from raven.search.utils import MIN_TOKEN_SIZE, get_search_tokens
+
+INDEX_NAME = "search_content_fulltext"
+
+
+class MariaDBSearchBackend(SearchBackend):
+	"""
+	FULLTEXT index on `Raven Message.search_content`. The database keeps the index up to date,
+	so there is nothing to do when messages change.
+	"""
+
+	index_on_commit = False
+
+	def index_messages(self, messages: list):
+		pass
+
+	def remove_messages(self, message_ids: list):
+		pass
+
+	def rebuild(self):
+		create_fulltext_index()
+
+	def search(self, query, message, search_text: str, limit: int, offset: int) -> list:
+		condition = self.get_match_condition(message, search_text)
+		if condition is None:
+			return []
+
+		query = query.where(condition)
+
+		relevance = get_relevance(get_search_tokens(search_text))
+		if relevance:
+			query = query.select(relevance.as_("relevance")).orderby(relevance, order=Order.desc)
+
+		return (
+			query.orderby(message.creation, order=Order.desc).limit(limit).offset(offset).run(as_dict=True)
+		)
+
+	def get_match_condition(self, message, search_text: str):
+		tokens = get_search_tokens(search_text)
+		if not tokens:
+			return None
+
+		# Short words are not indexed - they are matched anywhere in the content instead
+		conditions = [
+			message.search_content.like(f"%{token}%") for token in tokens if len(token) < MIN_TOKEN_SIZE
+		]
+		relevance = get_relevance(tokens)
+		if relevance:
+			conditions.append(relevance)
+
+		return Criterion.all(conditions)
+
+
+def get_relevance(tokens: list):
+	"""
+	MATCH ... AGAINST on the indexed words - every word is required and matches as a prefix
+	"""
+	indexed = [token for token in tokens if len(token) >= MIN_TOKEN_SIZE]
+	if not indexed:
+		return None
+
+	against = " ".join(f"+{token}*" for token in indexed)
+	return LiteralValue(
+		f"MATCH(`tabRaven Message`.`search_content`) AGAINST ({frappe.db.escape(against)} IN BOOLEAN MODE)"
+	)
+
+
+def create_fulltext_index():
+	if frappe.db.db_type != "mariadb":
+		return
+
+	if not frappe.db.has_index("tabRaven Message", INDEX_NAME):
+		frappe.db.sql_ddl(
+			f"ALTER TABLE `tabRaven Message` ADD FULLTEXT INDEX `{INDEX_NAME}` (`search_content`)"
+		)
@@ -0,0 +1,133 @@
+import sqlite3
+from contextlib import closing
+
+import frappe
+
+from raven.search.base import SearchBackend
+from raven.search.utils import get_search_tokens
+
+# The matches are ranked in SQLite and then filtered in the database - only the best ones are considered
+MAX_CANDIDATES = 1000
+
+BATCH_SIZE = 5000
+
+
+class SQLiteSearchBackend(SearchBackend):
+	"""
+	FTS5 index in an SQLite file in the site folder, next to the database.
+
+	Messages are stored with an integer row ID (FTS5 tables are keyed on the row ID),
+	mapped to the message ID in the `message` table.
+	"""
+
+	def get_connection(self):
+		connection = sqlite3.connect(frappe.get_site_path("raven_search.sqlite3"), timeout=30)
+		connection.execute("PRAGMA journal_mode=WAL")
+		connection.executescript(
+			"""
+			CREATE TABLE IF NOT EXISTS message (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+			CREATE VIRTUAL TABLE IF NOT EXISTS message_search
+				USING fts5(content, tokenize = 'unicode61 remove_diacritics 2');
+			"""
+		)
+		return connection
+
+	def index_messages(self, messages: list):
+		with closing(self.get_connection()) as connection, connection:
+			self._remove(connection, [name for name, _ in messages])
+			for name, content in messages:
+				if not content:
+					continue
+				row_id = connection.execute(
+					"INSERT INTO message (name) VALUES (?)", (name,)
+				).lastrowid
+				connection.execute(
+					"INSERT INTO message_search (rowid, content) VALUES (?, ?)", (row_id, content)
+				)
+
+	def remove_messages(self, message_ids: list):
+		with closing(self.get_connection()) as connection, connection:
+			self._remove(connection, message_ids)
+
+	def _remove(self, connection, message_ids: list):
+		for name in message_ids:
+			row = connection.execute("SELECT id FROM message WHERE name = ?", (name,)).fetchone()
+			if row:
+				connection.execute("DELETE FROM message_search WHERE rowid = ?", row)
+				connection.execute("DELETE FROM message WHERE id = ?", row)
+
+	def rebuild(self):
+		with closing(self.get_connection()) as connection, connection:
+			connection.execute("DELETE FROM message_search")
+			connection.execute("DELETE FROM message")
+
+		message = frappe.qb.DocType("Raven Message")
+		last_name = ""
+		while True:
+			rows = (
+				frappe.qb.from_(message)
+				.select(message.name, message.search_content)
+				.where(message.name > last_name)
+				.where(message.search_content.isnotnull())
+				.where(message.search_content != "")
+				.orderby(message.name)
+				.limit(BATCH_SIZE)
+			).run()
+			if not rows:
+				break
+
+			self.index_messages(rows)
+			last_name = rows[-1][0]
+
+	def search(self, query, message, search_text: str, limit: int, offset: int) -> list:
+		candidates = self.get_candidates(search_text)
+		if not candidates:
+			return []
+
+		rank = {name: i for i, name in enumerate(candidates)}
+		rows = query.where(message.name.isin(candidates)).run(as_dict=True)
+		rows.sort(key=lambda row: rank[row.name])
+
+		return rows[offset : offset + limit]
+
+	def get_match_condition(self, message, search_text: str):
+		# Only the best candidates are considered, so counts are capped at MAX_CANDIDATES
+		candidates = self.get_candidates(search_text)
+		return message.name.isin(candidates) if candidates else None
+
+	def get_candidates(self, search_text: str) -> list:
+		"""
+		IDs of the best matches for the text, most relevant first
+		"""
+		tokens = get_search_tokens(search_text)
+		if not tokens:
+			return []
+
+		# Every word is required and matches as a prefix, ordered by the bm25 rank
+		match = " ".join(f'"{token}"*' for token in tokens)
+		with closing(self.get_connection()) as connection:
+			return [
+				name
+				for (name,) in connection.execute(
+					"""
+					SELECT message.name FROM message_search
+					JOIN message ON message.id = message_search.rowid
+					WHERE message_search MATCH ?
+					ORDER BY rank
+					LIMIT ?
+					""",
+					(match, MAX_CANDIDATES),
+				)
+			]
+
+
+def is_fts5_available() -> bool:
+	"""
+	FTS5 is an optional module of SQLite - it is in the builds of most distributions, but not all
+	"""
+	try:
+		with closing(sqlite3.connect(":memory:")) as connection:
+			connection.execute("CREATE VIRTUAL TABLE test USING fts5(content)")
+		return True
+	except sqlite3.OperationalError:
+		return False
@@ -0,0 +1,25 @@
+import re
+import unicodedata
+
+# Words shorter than this are not in the MariaDB FULLTEXT index (innodb_ft_min_token_size)
+MIN_TOKEN_SIZE = 3
+
+
+def fold_text(text: str | None) -> str:
+	"""
+	Lowercase the text and remove the diacritics, so that "Tiếng Việt" and "tieng viet" match
+	"""
+	if not text:
+		return ""
+
+	# "đ" is a separate letter, not "d" with a combining mark
+	text = text.replace("đ", "d").replace("Đ", "D")
+	text = unicodedata.normalize("NFKD", text)
+	return "".join(char for char in text if not unicodedata.combining(char)).lower()
+
+
+def get_search_tokens(search_text: str | None) -> list:
+	"""
+	Folded words of a search query
+	"""
+	return re.findall(r"\w+", fold_text(search_text))
@@ -0,0 +1,172 @@
+"""
+Per-user snapshot of the channel list in the sidebar (`get_all_channels`).
+
+The snapshot holds what is specific to the user: the channels they can see, their member ID,
+done state and labels, and the peer of every DM. Building it needs a three table join, the label
+queries and the members of every DM, so it is kept in Redis until it is invalidated by:
+1. raven:sidebar_version:<user> - bumped when the memberships, done states or labels of the user change
+2. raven:sidebar_epoch - bumped when a channel which is not a DM or a thread is created or deleted,
+   or changes who can see it (type, workspace)
+
+The versions are bumped after the transaction is committed, so that a snapshot built in the meantime
+(from the old state) is not kept with the new version.
+
+The columns of the channels (last message, name, archived...) change with every message, so they are
+not part of the snapshot - they are read for the channels of the snapshot with one primary key lookup
+per request.
+"""
+
+import hashlib
+
+import frappe
+from frappe.utils import cint
+
+SNAPSHOT_KEY_PREFIX = "raven:sidebar:"
+VERSION_KEY_PREFIX = "raven:sidebar_version:"
+EPOCH_KEY = "raven:sidebar_epoch"
+
+SNAPSHOT_TTL = 24 * 60 * 60
+
+# Fields of a channel in the snapshot - everything else is read from the channel
+SNAPSHOT_FIELDS = ("name", "member_id", "is_done", "user_labels", "peer_user_id")
+
+CHANNEL_FIELDS = (
+	"name",
+	"channel_name",
+	"type",
+	"channel_description",
+	"is_archived",
+	"is_direct_message",
+	"is_self_message",
+	"creation",
+	"owner",
+	"last_message_timestamp",
+	"last_message_details",
+	"pinned_messages_string",
+	"workspace",
+)
+
+
+def get_sidebar_channels(
+	user: str, hide_archived: bool = False, version: list | None = None
+) -> list:
+	"""
+	Channels of the user with their current columns, most recent message first
+	"""
+	snapshot = get_sidebar_snapshot(user, version)
+	if not snapshot:
+		return []
+
+	channel = frappe.qb.DocType("Raven Channel")
+	rows = (
+		frappe.qb.from_(channel)
+		.select(*(channel[field] for field in CHANNEL_FIELDS))
+		.where(channel.name.isin([row["name"] for row in snapshot]))
+	).run(as_dict=True)
+	columns = {row.name: row for row in rows}
+
+	channels = []
+	for row in snapshot:
+		# The channel was deleted after the snapshot was built
+		if row["name"] not in columns:
+			continue
+		if hide_archived and columns[row["name"]].is_archived:
+			continue
+		channels.append({**columns[row["name"]], **row})
+
+	channels.sort(
+		key=lambda row: (row["last_message_timestamp"] is not None, row["last_message_timestamp"] or 0),
+		reverse=True,
+	)
+	return channels
+
+
+def get_sidebar_snapshot(user: str, version: list | None = None) -> list:
+	"""
+	The snapshot is only kept if it is built from a database snapshot which is at least as new as
+	its version. Callers which already ran a query in the transaction pass the `version` they read
+	(see get_sidebar_version) before their first query - a version read afterwards could include
+	commits which the database snapshot does not see.
+	"""
+	from raven.api.raven_channel import get_channel_list, get_peer_user_ids
+
+	if version is None:
+		version = get_sidebar_version(user)
+
+	cache = frappe.cache()
+	snapshot = cache.get_value(get_snapshot_key(user))
+	if snapshot and snapshot["version"] == version:
+		return snapshot["channels"]
+
+	rows = get_channel_list(hide_archived=False)
+	peer_user_ids = get_peer_user_ids(rows)
+	channels = [
+		{
+			**{field: row.get(field) for field in SNAPSHOT_FIELDS},
+			"peer_user_id": peer_user_ids[row.name],
+		}
+		for row in rows
+	]
+
+	# Invalidated while it was built - it may not include the change
+	if get_sidebar_version(user) != version:
+		return channels
+
+	cache.set_value(
+		get_snapshot_key(user),
+		{"version": version, "channels": channels},
+		expires_in_sec=SNAPSHOT_TTL,
+	)
+	return channels
+
+
+def get_sidebar_version(user: str) -> list:
+	cache = frappe.cache()
+	return [cint(value) for value in cache.mget([cache.make_key(EPOCH_KEY), get_version_key(user)])]
+
+
+def get_response_version(response) -> str:
+	"""
+	Version of a response sent to a client - a client which has it does not need the response again
+	"""
+	return hashlib.sha1(frappe.as_json(response, indent=None).encode()).hexdigest()[:16]
+
+
+def invalidate_sidebar(users: list):
+	"""
+	Invalidate the snapshots of users once the transaction is committed
+	"""
+	users = {user for user in users if user}
+	if not users:
+		return
+
+	def bump():
+		pipeline = frappe.cache().pipeline(transaction=False)
+		for user in users:
+			pipeline.incr(get_version_key(user))
+		pipeline.execute()
+
+	frappe.db.after_commit.add(bump)
+
+
+def invalidate_all_sidebars():
+	"""
+	Invalidate the snapshots of all users once the transaction is committed
+	"""
+	frappe.db.after_commit.add(lambda: frappe.cache().incr(frappe.cache().make_key(EPOCH_KEY)))
+
+
+def get_snapshot_key(user: str) -> str:
+	return f"{SNAPSHOT_KEY_PREFIX}{user}"
+
+
+def get_version_key(user: str) -> str:
+	return frappe.cache().make_key(f"{VERSION_KEY_PREFIX}{user}")
+
+
+def on_user_channel_label_change(doc, method=None):
+	invalidate_sidebar([doc.user])
+
+
+def on_user_label_change(doc, method=None):
+	invalidate_sidebar([doc.owner])
@@ -0,0 +1,119 @@
+"""
+Benchmark for the "columnar" format of the chat stream APIs
+
+Compares the size and the serialization time of a page of messages in the default "dict" format
+and in the "columnar" format (including the conversion).
+
+Usage:
+	bench --site <site> execute raven.tests.benchmarks.message_format.run
+	bench --site <site> execute raven.tests.benchmarks.message_format.run --kwargs "{'channel_id': 'general', 'page_sizes': [20, 50]}"
+
+Without a channel, the pages are made of generated messages shaped like the rows of `get_messages`.
+"""
+import datetime
+import gzip
+import time
+
+import frappe
+
+from raven.api.chat_stream import to_columnar
+from raven.message_cache import fetch_recent_messages
+
+
+def generate_messages(count: int):
+	"""
+	Generate text messages with the same fields as the rows of `get_messages`.
+	Every fifth message has reactions, every tenth one is a reply.
+	"""
+	now = datetime.datetime.now()
+	messages = []
+	for i in range(count):
+		creation = now - datetime.timedelta(minutes=count - i)
+		messages.append(
+			frappe._dict(
+				name=frappe.generate_hash(length=10),
+				owner=f"user{i % 5}@example.com",
+				creation=creation,
+				modified=creation,
+				text=f"<p>Message number {i} about the release</p>",
+				file=None,
+				message_type="Text",
+				message_reactions='{"👍": {"count": 2, "users": ["a@example.com", "b@example.com"]}}'
+				if i % 5 == 0
+				else None,
+				is_reply=1 if i % 10 == 0 else 0,
+				linked_message=frappe.generate_hash(length=10) if i % 10 == 0 else None,
+				_liked_by=None,
+				channel_id="general",
+				thumbnail_width=None,
+				thumbnail_height=None,
+				file_thumbnail=None,
+				link_doctype=None,
+				link_document=None,
+				replied_message_details=None,
+				content=f"Message number {i} about the release",
+				is_edited=0,
+				is_forwarded=0,
+				poll_id=None,
+				is_bot_message=0,
+				bot=None,
+				hide_link_preview=0,
+				is_thread=0,
+				blurhash=None,
+				is_retracted=0,
+			)
+		)
+	return messages
+
+
+def measure(function, iterations: int) -> float:
+	start = time.perf_counter()
+	for _ in range(iterations):
+		function()
+	return (time.perf_counter() - start) * 1_000_000 / iterations
+
+
+def run(channel_id: str | None = None, page_sizes: list | None = None, iterations: int = 500):
+	"""
+	Print the size (raw and gzipped) and the mean serialization time of a page in both formats
+	"""
+	results = []
+
+	for page_size in page_sizes or [10, 20, 50]:
+		if channel_id:
+			messages, _ = fetch_recent_messages(channel_id, page_size)
+		else:
+			messages = generate_messages(page_size)
+
+		dict_json = frappe.as_json(messages, indent=None)
+		columnar_json = frappe.as_json(to_columnar(messages), indent=None)
+
+		results.append(
+			{
+				"page_size": len(messages),
+				"dict_bytes": len(dict_json.encode()),
+				"columnar_bytes": len(columnar_json.encode()),
+				"dict_gzip_bytes": len(gzip.compress(dict_json.encode())),
+				"columnar_gzip_bytes": len(gzip.compress(columnar_json.encode())),
+				"dict_us": round(
+					measure(lambda m=messages: frappe.as_json(m, indent=None), iterations), 1
+				),
+				"columnar_us": round(
+					measure(lambda m=messages: frappe.as_json(to_columnar(m), indent=None), iterations),
+					1,
+				),
+			}
+		)
+
+	print(
+		f"{'page':>6} {'dict (B)':>10} {'columnar (B)':>13} {'dict gz (B)':>12} {'columnar gz (B)':>16}"
+		f" {'dict (us)':>10} {'columnar (us)':>14}"
+	)
+	for result in results:
+		print(
+			f"{result['page_size']:>6} {result['dict_bytes']:>10} {result['columnar_bytes']:>13}"
+			f" {result['dict_gzip_bytes']:>12} {result['columnar_gzip_bytes']:>16}"
+			f" {result['dict_us']:>10} {result['columnar_us']:>14}"
+		)
+
+	return results
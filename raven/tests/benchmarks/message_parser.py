@@ -0,0 +1,81 @@
+"""
+Micro-benchmark for `raven.message_parser.parse_message_html`
+
+Compares the single pass parser with the BeautifulSoup based parsing that RavenMessage used before,
+on HTML shaped like what the editor sends.
+
+Usage:
+	bench --site <site> execute raven.tests.benchmarks.message_parser.run
+	bench --site <site> execute raven.tests.benchmarks.message_parser.run --kwargs "{'iterations': 5000}"
+"""
+import time
+
+from bs4 import BeautifulSoup
+
+from raven.message_parser import parse_message_html
+
+MENTION = '<span class="mention" data-type="userMention" data-id="{0}" data-label="{0}">@{0}</span>'
+
+SAMPLES = {
+	"short": "<p>Sounds good, thanks!</p>",
+	"mentions": "<p>Hey "
+	+ MENTION.format("jane@example.com")
+	+ " and "
+	+ MENTION.format("bob@example.com")
+	+ ", can you take a look at the <strong>release notes</strong> before 5pm?</p><p></p>",
+	"formatted": "<p>Steps to reproduce:</p><ol><li><p>Open the <em>channel</em> settings</p></li>"
+	"<li><p>Click <code>Archive</code></p></li></ol><blockquote><p>It fails with a 500</p></blockquote>"
+	'<p>See <a href="https://example.com/issue?id=1&amp;tab=logs" rel="noopener noreferrer">the logs</a></p>'
+	"<p><br></p>",
+	"code_block": '<pre><code class="language-python">'
+	+ "def handler(doc, method):\n    if doc.qty &lt; 0:\n        frappe.throw('Invalid')\n" * 20
+	+ "</code></pre>",
+	"long": "<p>" + "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 40 + "</p>" * 10,
+}
+
+
+def parse_with_beautifulsoup(html: str):
+	soup = BeautifulSoup(html, "html.parser")
+	all_tags = soup.find_all(True)
+	all_tags.reverse()
+	for tag in all_tags:
+		if tag.name in ["br", "p"] and not tag.contents:
+			tag.extract()
+		else:
+			break
+	mentions = [d.get("data-id") for d in soup.find_all("span", attrs={"data-type": "userMention"})]
+	return str(soup), soup.get_text(" ", strip=True), mentions
+
+
+def measure(function, html: str, iterations: int) -> float:
+	start = time.perf_counter()
+	for _ in range(iterations):
+		function(html)
+	return (time.perf_counter() - start) * 1_000_000 / iterations
+
+
+def run(iterations: int = 2000):
+	"""
+	Print the mean time per message in microseconds for both parsers
+	"""
+	results = []
+
+	for name, html in SAMPLES.items():
+		before = measure(parse_with_beautifulsoup, html, iterations)
+		after = measure(parse_message_html, html, iterations)
+		results.append(
+			{
+				"sample": name,
+				"beautifulsoup_us": round(before, 1),
+				"parser_us": round(after, 1),
+				"speedup": round(before / after, 2),
+			}
+		)
+
+	print(f"{'sample':>12} {'bs4 (us)':>12} {'parser (us)':>12} {'speedup':>10}")
+	for result in results:
+		print(
+			f"{result['sample']:>12} {result['beautifulsoup_us']:>12} {result['parser_us']:>12} {result['speedup']:>10}"
+		)
+
+	return results
@@ -0,0 +1,144 @@
+"""
+Benchmark for `raven.api.search.get_search_result`
+
+Compares the latency of page 1 and a deep page of a message search, paged with OFFSET and with the
+(creation, name) cursor.
+
+Usage:
+	bench --site <site> execute raven.tests.benchmarks.search.run
+	bench --site <site> execute raven.tests.benchmarks.search.run --kwargs "{'message_count': 100000, 'pages': [1, 10, 50]}"
+	bench --site <site> execute raven.tests.benchmarks.search.cleanup
+
+The dataset is large, so it is committed and kept between runs (it is only created if the benchmark
+channel does not exist). Delete it with `cleanup`.
+"""
+import time
+
+import frappe
+from frappe.utils import add_to_date, now_datetime
+
+from raven.api.search import get_search_result
+
+BENCHMARK_CHANNEL = "raven-search-benchmark"
+
+BATCH_SIZE = 10000
+
+
+def create_dataset(message_count: int):
+	"""
+	Create a channel with `message_count` text messages, one second apart.
+	The rows are inserted in batches with `bulk_insert` to keep the setup fast.
+	"""
+	now = now_datetime()
+	user = frappe.session.user
+
+	frappe.get_doc(
+		{
+			"doctype": "Raven Channel",
+			"name": BENCHMARK_CHANNEL,
+			"channel_name": BENCHMARK_CHANNEL,
+			"type": "Open",
+			"last_seq": message_count,
+			"creation": now,
+			"modified": now,
+		}
+	).db_insert()
+	frappe.get_doc(
+		{
+			"doctype": "Raven Channel Member",
+			"channel_id": BENCHMARK_CHANNEL,
+			"user_id": user,
+			"creation": now,
+			"modified": now,
+		}
+	).db_insert()
+
+	fields = ["name", "channel_id", "seq", "message_type", "text", "content", "search_content"]
+	fields += ["owner", "modified_by", "creation", "modified"]
+
+	start = add_to_date(now, seconds=-message_count)
+	for batch_start in range(0, message_count, BATCH_SIZE):
+		values = []
+		for i in range(batch_start, min(batch_start + BATCH_SIZE, message_count)):
+			content = f"benchmark message {i}"
+			timestamp = add_to_date(start, seconds=i)
+			values.append(
+				(
+					f"{BENCHMARK_CHANNEL}-{i}",
+					BENCHMARK_CHANNEL,
+					i + 1,
+					"Text",
+					f"<p>{content}</p>",
+					content,
+					content,
+					user,
+					user,
+					timestamp,
+					timestamp,
+				)
+			)
+
+		frappe.db.bulk_insert("Raven Message", fields, values)
+		frappe.db.commit()  # nosemgrep
+
+
+def cleanup():
+	frappe.db.delete("Raven Message", {"channel_id": BENCHMARK_CHANNEL})
+	frappe.db.delete("Raven Channel Member", {"channel_id": BENCHMARK_CHANNEL})
+	frappe.db.delete("Raven Channel", BENCHMARK_CHANNEL)
+	frappe.db.commit()  # nosemgrep
+
+
+def time_page(page: int, page_size: int, iterations: int, use_cursor: bool):
+	"""
+	Mean latency of fetching `page` in milliseconds. With the cursor, the pages before are walked
+	(untimed) to get the cursor of the page.
+	"""
+	frappe.form_dict.limit = page_size
+
+	cursor = ""
+	if use_cursor:
+		for _ in range(page - 1):
+			cursor = get_search_result("Message", in_channel=BENCHMARK_CHANNEL, cursor=cursor)["cursor"]
+	else:
+		frappe.form_dict.offset = (page - 1) * page_size
+
+	timings = []
+	for _ in range(iterations):
+		start = time.perf_counter()
+		get_search_result("Message", in_channel=BENCHMARK_CHANNEL, cursor=cursor if use_cursor else None)
+		timings.append((time.perf_counter() - start) * 1000)
+
+	frappe.form_dict.offset = 0
+	return round(sum(timings) / len(timings), 2)
+
+
+def run(
+	message_count: int = 5_000_000,
+	pages: list | None = None,
+	page_size: int = 20,
+	iterations: int = 10,
+):
+	"""
+	Print the mean latency (in milliseconds) of each page with OFFSET and with the cursor
+	"""
+	pages = pages or [1, 50]
+
+	if not frappe.db.exists("Raven Channel", BENCHMARK_CHANNEL):
+		create_dataset(message_count)
+
+	results = []
+	for page in pages:
+		results.append(
+			{
+				"page": page,
+				"offset_ms": time_page(page, page_size, iterations, use_cursor=False),
+				"cursor_ms": time_page(page, page_size, iterations, use_cursor=True),
+			}
+		)
+
+	print(f"{'page':>6} {'offset (ms)':>12} {'cursor (ms)':>12}")
+	for result in results:
+		print(f"{result['page']:>6} {result['offset_ms']:>12} {result['cursor_ms']:>12}")
+
+	return results
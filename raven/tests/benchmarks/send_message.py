@@ -0,0 +1,114 @@
+"""
+Benchmark for `raven.api.raven_message.send_message`
+
+Shows how the latency of a single send grows with the number of members in the channel.
+
+Usage:
+	bench --site <site> execute raven.tests.benchmarks.send_message.run
+	bench --site <site> execute raven.tests.benchmarks.send_message.run --kwargs "{'member_counts': [10, 800], 'iterations': 50}"
+
+All the data created by the benchmark is rolled back at the end. Realtime events queued for after commit
+are flushed inside the timed block, so the Redis publishes are part of the measurement.
+"""
+import time
+
+import frappe
+
+from raven.api.raven_message import send_message
+from raven.utils import delete_channel_members_cache
+
+BENCHMARK_CHANNEL = "raven-send-message-benchmark"
+
+
+def create_channel_with_members(member_count: int):
+	"""
+	Create a channel with `member_count` members. Half of the members have marked the channel as done
+	so that every send also has to reset the done state.
+
+	Rows are inserted directly to keep the setup fast - we only want to measure the send path.
+	"""
+	now = frappe.utils.now_datetime()
+
+	channel = frappe.get_doc(
+		{
+			"doctype": "Raven Channel",
+			"name": BENCHMARK_CHANNEL,
+			"channel_name": BENCHMARK_CHANNEL,
+			"type": "Open",
+			"creation": now,
+			"modified": now,
+		}
+	)
+	channel.db_insert()
+
+	users = [frappe.session.user] + [
+		f"raven-benchmark-{i}@example.com" for i in range(member_count - 1)
+	]
+
+	for i, user in enumerate(users):
+		if not frappe.db.exists("Raven User", user):
+			frappe.get_doc(
+				{
+					"doctype": "Raven User",
+					"name": user,
+					"user": user,
+					"full_name": user,
+					"type": "User",
+					"creation": now,
+					"modified": now,
+				}
+			).db_insert()
+
+		frappe.get_doc(
+			{
+				"doctype": "Raven Channel Member",
+				"channel_id": BENCHMARK_CHANNEL,
+				"user_id": user,
+				"last_visit": now,
+				"is_done": i % 2,
+				"creation": now,
+				"modified": now,
+			}
+		).db_insert()
+
+	delete_channel_members_cache(BENCHMARK_CHANNEL)
+
+
+def run(member_counts: list | None = None, iterations: int = 20):
+	"""
+	Run the benchmark for each member count and print the mean/p95 latency of a send in milliseconds
+	"""
+	member_counts = member_counts or [10, 100, 400, 800]
+
+	results = []
+
+	for member_count in member_counts:
+		frappe.db.savepoint("raven_send_message_benchmark")
+		try:
+			create_channel_with_members(member_count)
+
+			timings = []
+			for i in range(iterations):
+				start = time.perf_counter()
+				send_message(BENCHMARK_CHANNEL, f"<p>Benchmark message {i}</p>")
+				# Realtime events are published after commit - flush them here so that they are measured
+				frappe.db.after_commit.run()
+				timings.append((time.perf_counter() - start) * 1000)
+
+			timings.sort()
+			results.append(
+				{
+					"members": member_count,
+					"mean_ms": round(sum(timings) / len(timings), 2),
+					"p95_ms": round(timings[int(len(timings) * 0.95) - 1], 2),
+				}
+			)
+		finally:
+			frappe.db.rollback(save_point="raven_send_message_benchmark")
+			delete_channel_members_cache(BENCHMARK_CHANNEL)
+
+	print(f"{'members':>10} {'mean (ms)':>12} {'p95 (ms)':>12}")
+	for result in results:
+		print(f"{result['members']:>10} {result['mean_ms']:>12} {result['p95_ms']:>12}")
+
+	return results
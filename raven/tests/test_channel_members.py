@@ -0,0 +1,46 @@
+import frappe
+from frappe.tests import IntegrationTestCase
+
+from raven.utils import delete_channel_members_cache, get_channel_members, get_channel_members_many
+
+EXTRA_TEST_RECORD_DEPENDENCIES = ["Raven Workspace"]
+
+
+class TestChannelMembers(IntegrationTestCase):
+	def setUp(self):
+		frappe.set_user("Administrator")
+		self.channel_ids = []
+		for i in range(3):
+			channel = frappe.get_doc(
+				{
+					"doctype": "Raven Channel",
+					"channel_name": f"Test Members Channel {i}",
+					"type": "Public",
+					"workspace": "Public Workspace",
+				}
+			).insert()
+			self.channel_ids.append(channel.name)
+
+	def tearDown(self):
+		frappe.db.rollback()
+		for channel_id in self.channel_ids:
+			delete_channel_members_cache(channel_id)
+
+	def test_same_as_get_channel_members(self):
+		# One channel is cached, the others are fetched from the database
+		get_channel_members(self.channel_ids[0])
+
+		members = get_channel_members_many([*self.channel_ids, self.channel_ids[0], None])
+		self.assertEqual(list(members), self.channel_ids)
+		for channel_id in self.channel_ids:
+			self.assertIn("Administrator", members[channel_id])
+			self.assertEqual(members[channel_id], get_channel_members(channel_id))
+
+		# The fetched channels are now cached
+		self.assertEqual(get_channel_members_many(self.channel_ids), members)
+
+	def test_channel_without_members(self):
+		channel_id = "Public Workspace-missing-channel"
+		self.assertEqual(get_channel_members_many([channel_id]), {channel_id: {}})
+		delete_channel_members_cache(channel_id)
+		self.assertEqual(get_channel_members_many([]), {})
@@ -0,0 +1,121 @@
+import datetime
+
+import frappe
+from frappe.tests import IntegrationTestCase
+
+from raven.api.raven_message import retract_message, save_message
+from raven.api.reactions import calculate_message_reaction
+from raven.message_cache import (
+	BUFFER_SIZE,
+	clear_recent_messages_cache,
+	fetch_recent_messages,
+	get_recent_messages,
+	get_recent_messages_cache_stats,
+)
+
+CHANNEL_ID = "Public Workspace-test-cache-channel"
+
+EXTRA_TEST_RECORD_DEPENDENCIES = ["Raven Workspace"]
+
+
+class TestMessageCache(IntegrationTestCase):
+	def setUp(self):
+		channel = frappe.get_doc(
+			{
+				"doctype": "Raven Channel",
+				"channel_name": "Test Cache Channel",
+				"type": "Public",
+				"workspace": "Public Workspace",
+			}
+		)
+		channel.flags.do_not_add_member = True
+		channel.insert()
+		clear_recent_messages_cache(CHANNEL_ID)
+
+		# More messages than the buffer holds, so that older messages are only in the database
+		for i in range(BUFFER_SIZE + 5):
+			creation = datetime.datetime.now() - datetime.timedelta(minutes=100 - i)
+			frappe.get_doc(
+				{
+					"doctype": "Raven Message",
+					"name": f"{CHANNEL_ID}-{i}",
+					"seq": i + 1,
+					"text": f"Test Message {i}",
+					"content": f"Test Message {i}",
+					"channel_id": CHANNEL_ID,
+					"message_type": "Text",
+					"creation": creation,
+					"modified": creation,
+				}
+			).db_insert()
+
+		frappe.db.set_value("Raven Channel", CHANNEL_ID, "last_seq", BUFFER_SIZE + 5)
+
+	def tearDown(self):
+		frappe.db.rollback()
+		clear_recent_messages_cache(CHANNEL_ID)
+
+	def assertCacheConsistent(self):
+		"""
+		Every page which fits in the buffer should be the same as the one read from the database
+		"""
+		# The buffer is updated once the transaction is committed
+		frappe.db.after_commit.run()
+
+		for limit in (1, 10, BUFFER_SIZE - 1):
+			hits = get_recent_messages_cache_stats()["hits"]
+			messages, has_old_messages = get_recent_messages(CHANNEL_ID, limit)
+			expected_messages, expected_has_old_messages = fetch_recent_messages(CHANNEL_ID, limit)
+
+			if limit <= 10:
+				# The largest page might not fit anymore after messages were deleted
+				self.assertEqual(get_recent_messages_cache_stats()["hits"], hits + 1)
+			self.assertEqual(frappe.as_json(messages), frappe.as_json(expected_messages))
+			self.assertEqual(has_old_messages, expected_has_old_messages)
+
+	def test_consistency_with_database(self):
+		# Fill the buffer
+		get_recent_messages(CHANNEL_ID)
+		self.assertCacheConsistent()
+
+		message = frappe.get_doc(
+			{
+				"doctype": "Raven Message",
+				"text": "New message",
+				"channel_id": CHANNEL_ID,
+				"message_type": "Text",
+			}
+		).insert()
+		self.assertCacheConsistent()
+
+		message.text = "Edited message"
+		message.save()
+		self.assertCacheConsistent()
+
+		frappe.db.set_value("Raven Message", message.name, "message_reactions", None)
+		calculate_message_reaction(message.name, CHANNEL_ID, do_not_publish=True)
+		self.assertCacheConsistent()
+
+		save_message(message.name, add="Yes")
+		self.assertCacheConsistent()
+
+		save_message(message.name, add="No")
+		self.assertCacheConsistent()
+
+		retract_message(message.name)
+		self.assertCacheConsistent()
+
+		frappe.delete_doc("Raven Message", message.name)
+		frappe.delete_doc("Raven Message", f"{CHANNEL_ID}-{BUFFER_SIZE}")
+		self.assertCacheConsistent()
+
+		# Editing a message older than the buffer does not add it to the buffer
+		old_message = frappe.get_doc("Raven Message", f"{CHANNEL_ID}-0")
+		old_message.text = "Edited old message"
+		old_message.save()
+		self.assertCacheConsistent()
+
+	def test_page_larger_than_buffer(self):
+		messages, has_old_messages = get_recent_messages(CHANNEL_ID, BUFFER_SIZE + 5)
+		self.assertEqual(len(messages), BUFFER_SIZE + 5)
+		self.assertFalse(has_old_messages)
@@ -0,0 +1,137 @@
+from unittest.mock import patch
+
+import frappe
+from frappe.tests import IntegrationTestCase
+
+from raven.api.raven_message import get_channel_links
+from raven.api.search import get_search_result
+from raven.patches.v2_5 import create_message_links
+
+EXTRA_TEST_RECORD_DEPENDENCIES = ["Raven Workspace"]
+
+
+class TestMessageLinks(IntegrationTestCase):
+	def setUp(self):
+		frappe.set_user("Administrator")
+		self.channel = frappe.get_doc(
+			{
+				"doctype": "Raven Channel",
+				"channel_name": "Test Message Links Channel",
+				"type": "Public",
+				"workspace": "Public Workspace",
+			}
+		).insert()
+
+	def tearDown(self):
+		frappe.db.rollback()
+
+	def send_message(self, text: str):
+		return frappe.get_doc(
+			{
+				"doctype": "Raven Message",
+				"channel_id": self.channel.name,
+				"text": text,
+				"message_type": "Text",
+			}
+		).insert()
+
+	def get_link_rows(self, message_id: str):
+		return frappe.get_all(
+			"Raven Message Link",
+			filters={"parent": message_id, "parenttype": "Raven Message"},
+			fields=["name", "url", "domain", "channel_id", "modified"],
+			order_by="idx asc",
+		)
+
+	def test_extract_links(self):
+		message = self.send_message(
+			'<p>See <a href="https://www.Example.com/a">this</a> and https://docs.frappe.io/framework.</p>'
+		)
+
+		rows = self.get_link_rows(message.name)
+		self.assertEqual(
+			[(row.url, row.domain, row.channel_id) for row in rows],
+			[
+				("https://www.Example.com/a", "example.com", self.channel.name),
+				("https://docs.frappe.io/framework", "docs.frappe.io", self.channel.name),
+			],
+		)
+
+		# An edit which keeps the links does not write the link rows
+		frappe.db.set_value(
+			"Raven Message Link",
+			{"parent": message.name},
+			"modified",
+			"2025-01-01 00:00:00",
+			update_modified=False,
+		)
+		message.reload()
+		message.text = (
+			'<p>Read <a href="https://www.Example.com/a">this</a> and https://docs.frappe.io/framework</p>'
+		)
+		message.save()
+		self.assertEqual(
+			[(row.name, str(row.modified)) for row in self.get_link_rows(message.name)],
+			[(row.name, "2025-01-01 00:00:00") for row in rows],
+		)
+
+		message.reload()
+		message.text = "<p>Only https://frappe.io now</p>"
+		message.save()
+		self.assertEqual(
+			[row.url for row in self.get_link_rows(message.name)], ["https://frappe.io"]
+		)
+
+		message.reload()
+		message.text = "<p>No links</p>"
+		message.save()
+		self.assertEqual(self.get_link_rows(message.name), [])
+
+	def test_get_channel_links(self):
+		first = self.send_message("<p>https://www.example.com/a</p>")
+		second = self.send_message("<p>https://frappe.io and https://example.com/b</p>")
+
+		links = get_channel_links(self.channel.name)
+		self.assertEqual(
+			{(link.url, link.message_id) for link in links},
+			{
+				("https://www.example.com/a", first.name),
+				("https://frappe.io", second.name),
+				("https://example.com/b", second.name),
+			},
+		)
+
+		links = get_channel_links(self.channel.name, domain="WWW.Example.com")
+		self.assertEqual(
+			{link.url for link in links}, {"https://www.example.com/a", "https://example.com/b"}
+		)
+
+	def test_search_link_filter(self):
+		message = self.send_message("<p>See https://example.com</p>")
+		self.send_message("<p>No links here</p>")
+
+		frappe.form_dict.limit = 20
+		results = get_search_result("Link", in_channel=self.channel.name)
+		self.assertEqual([row.name for row in results], [message.name])
+
+	def test_create_message_links_patch(self):
+		message = frappe.get_doc(
+			{
+				"doctype": "Raven Message",
+				"name": f"{self.channel.name}-links-patch",
+				"channel_id": self.channel.name,
+				"text": '<p><a href="https://example.com/a">a</a> https://frappe.io</p>',
+				"message_type": "Text",
+			}
+		)
+		message.db_insert()
+		self.assertEqual(self.get_link_rows(message.name), [])
+
+		# The patch commits after every batch - kept in the test transaction
+		with patch.object(frappe.db, "commit"):
+			create_message_links.execute()
+
+		self.assertEqual(
+			[(row.url, row.domain) for row in self.get_link_rows(message.name)],
+			[("https://example.com/a", "example.com"), ("https://frappe.io", "frappe.io")],
+		)
@@ -0,0 +1,84 @@
+import json
+import os
+
+from frappe.tests import UnitTestCase
+
+from raven.message_parser import parse_message_html
+
+GOLDEN_FILE = os.path.join(os.path.dirname(__file__), "data", "message_parser_golden.json")
+
+
+class TestMessageParser(UnitTestCase):
+	"""
+	The expected values in the golden file were generated with BeautifulSoup 4.12 ("html.parser"),
+	which is what RavenMessage.parse_html_content used before
+	"""
+
+	@classmethod
+	def setUpClass(cls):
+		super().setUpClass()
+		with open(GOLDEN_FILE) as f:
+			cls.golden = json.load(f)
+
+	def test_golden_files(self):
+		for name, case in self.golden.items():
+			with self.subTest(name):
+				parsed = parse_message_html(case["html"])
+				self.assertEqual(parsed.text, case["text"])
+				self.assertEqual(parsed.content, case["content"])
+				self.assertEqual(parsed.mentions, case["mentions"])
+				self.assertEqual(parsed.images, case["images"])
+
+	def test_matches_beautifulsoup(self):
+		"""
+		Compare against BeautifulSoup directly for the golden inputs and a few malformed ones
+		"""
+		from bs4 import BeautifulSoup
+
+		inputs = [case["html"] for case in self.golden.values()] + [
+			"a<br>b<br/>c",
+			"<p/><br/><p>",
+			"<p>a<p>b</p></p>",
+			"<!---->&#0;&#129;",
+			"<template><p>t</p></template><ruby>x<rt>y</rt></ruby>",
+		]
+
+		for html in inputs:
+			with self.subTest(html):
+				soup = BeautifulSoup(html, "html.parser")
+				all_tags = soup.find_all(True)
+				all_tags.reverse()
+				for tag in all_tags:
+					if tag.name in ["br", "p"] and not tag.contents:
+						tag.extract()
+					else:
+						break
+
+				parsed = parse_message_html(html)
+				self.assertEqual(parsed.text, str(soup))
+				self.assertEqual(parsed.content, soup.get_text(" ", strip=True))
+				self.assertEqual(
+					parsed.mentions,
+					[
+						d.get("data-id")
+						for d in soup.find_all("span", attrs={"data-type": "userMention"})
+					],
+				)
+
+	def test_links(self):
+		parsed = parse_message_html(
+			'<p>See <a href="https://example.com/docs?page=1">the docs</a>, https://example.com/docs?page=1 and '
+			'(http://www.example.org/a).</p><p><a href="mailto:test@example.com">Mail</a></p>'
+		)
+		self.assertEqual(
+			parsed.links, ["https://example.com/docs?page=1", "http://www.example.org/a"]
+		)
+
+		# A closing parenthesis which is part of the link is kept
+		parsed = parse_message_html(
+			"<p>https://en.wikipedia.org/wiki/Foo_(bar) and (https://en.wikipedia.org/wiki/Baz_(qux)).</p>"
+		)
+		self.assertEqual(
+			parsed.links,
+			["https://en.wikipedia.org/wiki/Foo_(bar)", "https://en.wikipedia.org/wiki/Baz_(qux)"],
+		)
@@ -0,0 +1,96 @@
+import frappe
+from frappe.tests import IntegrationTestCase
+from frappe.utils import get_datetime
+
+from raven.api.raven_channel_member import mark_channel_as_unread
+from raven.read_markers import FLUSH_LOCK_KEY, flush_read_markers, get_buffered_read_marker
+from raven.utils import track_channel_seen, track_channel_visit
+
+EXTRA_TEST_RECORD_DEPENDENCIES = ["Raven Workspace"]
+
+
+class TestReadMarkers(IntegrationTestCase):
+	def setUp(self):
+		self.channel = frappe.get_doc(
+			{
+				"doctype": "Raven Channel",
+				"channel_name": "Test Read Markers Channel",
+				"type": "Public",
+				"workspace": "Public Workspace",
+			}
+		).insert()
+		self.member = frappe.db.get_value(
+			"Raven Channel Member",
+			{"channel_id": self.channel.name, "user_id": frappe.session.user},
+			["name", "last_visit", "seen_at"],
+			as_dict=True,
+		)
+		# Markers left over from other tests are written to the database
+		flush_read_markers()
+
+	def tearDown(self):
+		flush_read_markers()
+		frappe.delete_doc("Raven Channel", self.channel.name)
+		frappe.db.commit()  # nosemgrep
+
+	def test_markers_are_buffered_and_flushed(self):
+		track_channel_visit(self.channel.name)
+		track_channel_seen(self.channel.name)
+
+		# Not written to the database yet, but visible to the readers
+		self.assertEqual(
+			frappe.db.get_value("Raven Channel Member", self.member.name, "last_visit"),
+			self.member.last_visit,
+		)
+		last_visit = get_buffered_read_marker(self.channel.name, frappe.session.user, "last_visit")
+		seen_at = get_buffered_read_marker(self.channel.name, frappe.session.user, "seen_at")
+		self.assertGreater(last_visit, self.member.last_visit)
+		self.assertIsNotNone(seen_at)
+
+		flush_read_markers()
+
+		self.assertEqual(
+			frappe.db.get_value("Raven Channel Member", self.member.name, ["last_visit", "seen_at"]),
+			(last_visit, seen_at),
+		)
+		self.assertIsNone(
+			get_buffered_read_marker(self.channel.name, frappe.session.user, "last_visit")
+		)
+
+	def test_flushes_do_not_overlap(self):
+		track_channel_visit(self.channel.name)
+
+		cache = frappe.cache()
+		lock = cache.lock(cache.make_key(FLUSH_LOCK_KEY), timeout=60)
+		lock.acquire()
+		try:
+			# Another flush is running - the markers stay in the buffer
+			flush_read_markers()
+			self.assertEqual(
+				frappe.db.get_value("Raven Channel Member", self.member.name, "last_visit"),
+				self.member.last_visit,
+			)
+		finally:
+			lock.release()
+
+		flush_read_markers()
+		self.assertGreater(
+			frappe.db.get_value("Raven Channel Member", self.member.name, "last_visit"),
+			self.member.last_visit,
+		)
+
+	def test_mark_as_unread_after_visit(self):
+		track_channel_visit(self.channel.name)
+		mark_channel_as_unread(self.channel.name)
+
+		flush_read_markers()
+
+		# The visit which was buffered before does not overwrite the unread markers
+		self.assertEqual(
+			frappe.db.get_value(
+				"Raven Channel Member",
+				self.member.name,
+				["last_visit", "last_read_seq", "last_read_countable_seq"],
+			),
+			(get_datetime("2000-01-01 00:00:00"), 0, 0),
+		)
@@ -0,0 +1,143 @@
+from unittest import skipUnless
+from unittest.mock import patch
+
+import frappe
+from frappe.tests import IntegrationTestCase, UnitTestCase
+
+from raven.api.raven_message import retract_message
+from raven.search.mariadb import MariaDBSearchBackend
+from raven.search.sqlite import SQLiteSearchBackend, is_fts5_available
+from raven.search.utils import fold_text, get_search_tokens
+
+EXTRA_TEST_RECORD_DEPENDENCIES = ["Raven Workspace"]
+
+
+class TestSearchUtils(UnitTestCase):
+	def test_fold_text(self):
+		self.assertEqual(fold_text("Tiếng Việt"), "tieng viet")
+		self.assertEqual(fold_text("Đường ĐI"), "duong di")
+		self.assertEqual(fold_text("Crème Brûlée"), "creme brulee")
+		self.assertEqual(fold_text(None), "")
+
+	def test_search_tokens(self):
+		self.assertEqual(get_search_tokens("  Hà Nội, 2025!"), ["ha", "noi", "2025"])
+		self.assertEqual(get_search_tokens(""), [])
+
+
+class SearchTestCase(IntegrationTestCase):
+	"""
+	The search indexes only see committed messages (the FULLTEXT index is updated on commit and the
+	SQLite index after it), so the messages are committed and deleted again in tearDown.
+	"""
+
+	def setUp(self):
+		self.channel = frappe.get_doc(
+			{
+				"doctype": "Raven Channel",
+				"channel_name": "Test Search Channel",
+				"type": "Public",
+				"workspace": "Public Workspace",
+			}
+		).insert()
+
+	def tearDown(self):
+		for name in frappe.get_all(
+			"Raven Message", filters={"channel_id": self.channel.name}, pluck="name"
+		):
+			frappe.delete_doc("Raven Message", name, force=True)
+		frappe.delete_doc("Raven Channel", self.channel.name, force=True)
+		frappe.db.commit()  # nosemgrep
+
+	def send_message(self, text: str):
+		return frappe.get_doc(
+			{
+				"doctype": "Raven Message",
+				"channel_id": self.channel.name,
+				"text": text,
+				"message_type": "Text",
+			}
+		).insert()
+
+	def search(self, backend, search_text: str) -> list:
+		message = frappe.qb.DocType("Raven Message")
+		query = (
+			frappe.qb.from_(message)
+			.select(message.name)
+			.where(message.channel_id == self.channel.name)
+		)
+		return [row.name for row in backend.search(query, message, search_text, 20, 0)]
+
+	def assert_index_is_current(self, backend):
+		message = self.send_message("Quarterly revenue in Hà Nội")
+		frappe.db.commit()  # nosemgrep
+		self.assertEqual(message.search_content, "quarterly revenue in ha noi")
+		self.assertEqual(self.search(backend, "revenue"), [message.name])
+
+		message.reload()
+		message.text = "Quarterly forecast"
+		message.save()
+		frappe.db.commit()  # nosemgrep
+		self.assertEqual(self.search(backend, "revenue"), [])
+		self.assertEqual(self.search(backend, "forecast"), [message.name])
+
+		retract_message(message.name)
+		frappe.db.commit()  # nosemgrep
+		self.assertIsNone(frappe.db.get_value("Raven Message", message.name, "search_content"))
+		self.assertEqual(self.search(backend, "forecast"), [])
+
+		other_message = self.send_message("Forecast for the next quarter")
+		frappe.db.commit()  # nosemgrep
+		self.assertEqual(self.search(backend, "forecast"), [other_message.name])
+
+		frappe.delete_doc("Raven Message", other_message.name, force=True)
+		frappe.db.commit()  # nosemgrep
+		self.assertEqual(self.search(backend, "forecast"), [])
+
+
+class TestMariaDBSearch(SearchTestCase):
+	def setUp(self):
+		if frappe.db.db_type != "mariadb":
+			self.skipTest("FULLTEXT search needs MariaDB")
+
+		super().setUp()
+		self.backend = MariaDBSearchBackend()
+		self.backend.rebuild()
+
+	def test_prefix_match(self):
+		message = self.send_message("Báo cáo doanh thu tháng")
+		self.send_message("Team lunch on Friday")
+		frappe.db.commit()  # nosemgrep
+
+		# Without diacritics, and every word as a prefix
+		self.assertEqual(self.search(self.backend, "doanh"), [message.name])
+		self.assertEqual(self.search(self.backend, "doan thang"), [message.name])
+		self.assertEqual(self.search(self.backend, "doanh friday"), [])
+
+	def test_ranking(self):
+		once = self.send_message("Revenue report")
+		three_times = self.send_message("Revenue, revenue and more revenue")
+		self.send_message("Team lunch on Friday")
+		frappe.db.commit()  # nosemgrep
+
+		self.assertEqual(self.search(self.backend, "revenue"), [three_times.name, once.name])
+
+	def test_short_words(self):
+		message = self.send_message("Meeting in Hà Nội")
+		self.send_message("Team lunch on Friday")
+		frappe.db.commit()  # nosemgrep
+
+		# "ha" is shorter than the indexed words - it is matched in the content instead
+		self.assertEqual(self.search(self.backend, "ha noi"), [message.name])
+		self.assertEqual(self.search(self.backend, "ha"), [message.name])
+		self.assertEqual(self.search(self.backend, "ha lunch"), [])
+
+	def test_index_is_current(self):
+		self.assert_index_is_current(self.backend)
+
+
+@skipUnless(is_fts5_available(), "SQLite is built without FTS5")
+class TestSQLiteSearch(SearchTestCase):
+	def test_index_is_current(self):
+		backend = SQLiteSearchBackend()
+		with patch("raven.search.get_search_backend", return_value=backend):
+			self.assert_index_is_current(backend)
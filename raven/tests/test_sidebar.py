@@ -0,0 +1,80 @@
+import frappe
+from frappe.tests import IntegrationTestCase
+
+from raven.api.raven_channel import get_all_channels
+from raven.api.user_channel_label import remove_channel_from_label
+from raven.sidebar import get_version_key
+
+CHANNEL_ID = "Public Workspace-test-sidebar-channel"
+
+EXTRA_TEST_RECORD_DEPENDENCIES = ["Raven Workspace"]
+
+
+class TestSidebar(IntegrationTestCase):
+	def setUp(self):
+		frappe.set_user("Administrator")
+		frappe.get_doc(
+			{
+				"doctype": "Raven Channel",
+				"channel_name": "Test Sidebar Channel",
+				"type": "Public",
+				"workspace": "Public Workspace",
+			}
+		).insert()
+		# The versions are bumped after commit, but the tests roll back
+		frappe.cache().incr(get_version_key("Administrator"))
+
+	def tearDown(self):
+		frappe.db.rollback()
+		frappe.cache().incr(get_version_key("Administrator"))
+
+	def get_channel(self, response):
+		return next(c for c in response["channels"] if c["name"] == CHANNEL_ID)
+
+	def test_not_modified(self):
+		response = get_all_channels()
+		self.assertTrue(self.get_channel(response))
+		self.assertEqual(
+			get_all_channels(version=response["version"]),
+			{"version": response["version"], "not_modified": True},
+		)
+
+	def test_channel_columns_are_current(self):
+		"""
+		The columns of the channels are not part of the snapshot - they change without invalidating it
+		"""
+		version = get_all_channels()["version"]
+
+		frappe.db.set_value("Raven Channel", CHANNEL_ID, "channel_description", "Updated")
+
+		response = get_all_channels(version=version)
+		self.assertNotEqual(response["version"], version)
+		self.assertEqual(self.get_channel(response)["channel_description"], "Updated")
+
+	def test_archived_channels(self):
+		get_all_channels()
+		frappe.db.set_value("Raven Channel", CHANNEL_ID, "is_archived", 1)
+
+		self.assertFalse([c for c in get_all_channels()["channels"] if c["name"] == CHANNEL_ID])
+		self.assertTrue(self.get_channel(get_all_channels(hide_archived=False)))
+
+	def test_label_removed(self):
+		label = frappe.get_doc({"doctype": "User Label", "label": "Test Sidebar Label"}).insert()
+		frappe.get_doc(
+			{
+				"doctype": "User Channel Label",
+				"user": "Administrator",
+				"label": label.name,
+				"channel_id": CHANNEL_ID,
+			}
+		).insert()
+		# The versions are bumped after commit
+		frappe.db.after_commit.run()
+		self.assertEqual(
+			[row["label_id"] for row in self.get_channel(get_all_channels())["user_labels"]],
+			[label.name],
+		)
+
+		remove_channel_from_label(label.name, CHANNEL_ID)
+		frappe.db.after_commit.run()
+		self.assertEqual(self.get_channel(get_all_channels())["user_labels"], [])
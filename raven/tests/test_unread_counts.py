@@ -0,0 +1,76 @@
+import frappe
+from frappe.tests import IntegrationTestCase
+
+from raven.read_markers import flush_read_markers
+from raven.unread_counts import get_unread_counts
+from raven.utils import track_channel_visit
+
+EXTRA_TEST_RECORD_DEPENDENCIES = ["Raven Workspace", "Raven User"]
+
+MEMBER = "test1@example.com"
+
+
+class TestUnreadCounts(IntegrationTestCase):
+	def setUp(self):
+		self.channel = frappe.get_doc(
+			{
+				"doctype": "Raven Channel",
+				"channel_name": "Test Unread Counts Channel",
+				"type": "Public",
+				"workspace": "Public Workspace",
+			}
+		).insert()
+		frappe.get_doc(
+			{"doctype": "Raven Channel Member", "channel_id": self.channel.name, "user_id": MEMBER}
+		).insert()
+
+	def tearDown(self):
+		flush_read_markers()
+		frappe.delete_doc("Raven Channel", self.channel.name)
+		frappe.db.commit()  # nosemgrep
+
+	def send_message(self, text: str, message_type: str = "Text"):
+		return frappe.get_doc(
+			{
+				"doctype": "Raven Message",
+				"channel_id": self.channel.name,
+				"text": text,
+				"message_type": message_type,
+			}
+		).insert()
+
+	def test_messages_are_numbered_in_order(self):
+		messages = [self.send_message(f"Message {i}") for i in range(3)]
+
+		self.assertEqual([message.seq for message in messages], [1, 2, 3])
+		self.assertEqual(frappe.db.get_value("Raven Channel", self.channel.name, "last_seq"), 3)
+
+	def test_system_messages_are_not_counted(self):
+		first = self.send_message("First")
+		system_message = self.send_message("test1 joined the channel", message_type="System")
+		second = self.send_message("Second")
+
+		self.assertEqual([first.seq, system_message.seq, second.seq], [1, 2, 3])
+		self.assertEqual(
+			[first.countable_seq, system_message.countable_seq, second.countable_seq], [1, 1, 2]
+		)
+		self.assertEqual(get_unread_counts([self.channel.name], MEMBER), {self.channel.name: 2})
+
+		track_channel_visit(self.channel.name, user=MEMBER)
+		self.send_message("test1 left the channel", message_type="System")
+		self.assertEqual(get_unread_counts([self.channel.name], MEMBER), {self.channel.name: 0})
+
+	def test_unread_count(self):
+		self.assertEqual(get_unread_counts([self.channel.name], MEMBER), {self.channel.name: 0})
+
+		self.send_message("First")
+		self.send_message("Second")
+		self.assertEqual(get_unread_counts([self.channel.name], MEMBER), {self.channel.name: 2})
+
+		# The visit is buffered - the count takes it into account before it is flushed
+		track_channel_visit(self.channel.name, user=MEMBER)
+		self.assertEqual(get_unread_counts([self.channel.name], MEMBER), {self.channel.name: 0})
+
+		self.send_message("Third")
+		flush_read_markers()
+		self.assertEqual(get_unread_counts([self.channel.name], MEMBER), {self.channel.name: 1})
@@ -0,0 +1,50 @@
+"""
+Unread message counts of channel members, from the message sequence numbers.
+
+System messages (joins, leaves, renames) are not counted as unread, so besides its sequence number
+every message other than a system message gets the next countable sequence number of its channel
+on insert (`Raven Channel.last_countable_seq`). A visit to the channel records the last countable
+sequence number the member has read (`last_read_countable_seq`). The unread count is the difference
+of the two, so no messages are scanned:
+
+	unread = channel.last_countable_seq - channel_member.last_read_countable_seq
+
+Deleted messages leave gaps in the sequence, so the count is an upper bound until the next visit.
+"""
+
+import frappe
+
+from raven.read_markers import get_read_marker_term
+
+
+def get_unread_count_term(channel, channel_member, user: str | None = None):
+	"""
+	Unread count of a user as a query term - the buffered read markers of the user are taken into account
+	"""
+	return channel.last_countable_seq - get_read_marker_term(
+		channel_member, "last_read_countable_seq", user
+	)
+
+
+def get_unread_counts(channel_ids: list, user: str | None = None) -> dict:
+	"""
+	Get the unread counts of a user for the given channels - returns {channel_id: count}
+	"""
+	if not user:
+		user = frappe.session.user
+
+	if not channel_ids:
+		return {}
+
+	channel = frappe.qb.DocType("Raven Channel")
+	channel_member = frappe.qb.DocType("Raven Channel Member")
+
+	rows = (
+		frappe.qb.from_(channel)
+		.join(channel_member)
+		.on((channel_member.channel_id == channel.name) & (channel_member.user_id == user))
+		.select(channel.name, get_unread_count_term(channel, channel_member, user).as_("unread_count"))
+		.where(channel.name.isin(channel_ids))
+	).run(as_dict=True)
+
+	return {row.name: max(row.unread_count, 0) for row in rows}
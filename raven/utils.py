@@ -1,5 +1,13 @@
 import json
+import pickle
+
 import frappe
+import redis
+from frappe.realtime import get_user_room
+from frappe.utils.background_jobs import get_redis_connection_without_auth
+
+from raven.read_markers import buffer_read_marker, buffer_read_markers
+from raven.sidebar import invalidate_sidebar
 
 
 def get_raven_room():
@@ -40,8 +48,20 @@ def track_channel_visit(channel_id, user=None, commit=False, publish_event_for_u
 	now = frappe.utils.now()
 
 	if channel_member:
-		# Update the last visit
-		frappe.db.set_value("Raven Channel Member", channel_member["name"], "last_visit", now)
+		# Buffered in Redis and written to the database in batches - see raven.read_markers
+		last_seq, last_countable_seq = frappe.db.get_value(
+			"Raven Channel", channel_id, ["last_seq", "last_countable_seq"]
+		) or (0, 0)
+		buffer_read_markers(
+			channel_member["name"],
+			channel_id,
+			user,
+			{
+				"last_visit": now,
+				"last_read_seq": last_seq,
+				"last_read_countable_seq": last_countable_seq,
+			},
+		)
 
 	# Else if the user is not a member of the channel and the channel is open, create a new member record
 	elif frappe.get_cached_value("Raven Channel", channel_id, "type") == "Open":
@@ -54,9 +74,9 @@ def track_channel_visit(channel_id, user=None, commit=False, publish_event_for_u
 			}
 		).insert()
 
-	# Need to commit the changes to the database if the request is a GET request
-	if commit:
-		frappe.db.commit()  # nosempgrep
+		# Need to commit the changes to the database if the request is a GET request
+		if commit:
+			frappe.db.commit()  # nosempgrep
 
 	if publish_event_for_user:
 		frappe.publish_realtime(
@@ -80,8 +100,8 @@ def track_channel_seen(channel_id, user=None, commit=False, publish_event_for_us
 	now = frappe.utils.now()
 
 	if channel_member:
-		# Update the last seen
-		frappe.db.set_value("Raven Channel Member", channel_member["name"], "seen_at", now)
+		# Buffered in Redis and written to the database in batches - see raven.read_markers
+		buffer_read_marker(channel_member["name"], channel_id, user, "seen_at", now)
 
 	# Else if the user is not a member of the channel and the channel is open, create a new member record
 	elif frappe.get_cached_value("Raven Channel", channel_id, "type") == "Open":
@@ -94,9 +114,9 @@ def track_channel_seen(channel_id, user=None, commit=False, publish_event_for_us
 			}
 		).insert()
 
-	# Need to commit the changes to the database if the request is a GET request
-	if commit:
-		frappe.db.commit()  # nosempgrep
+		# Need to commit the changes to the database if the request is a GET request
+		if commit:
+			frappe.db.commit()  # nosempgrep
 
 	if publish_event_for_user:
 		frappe.publish_realtime(
@@ -106,6 +126,127 @@ def track_channel_seen(channel_id, user=None, commit=False, publish_event_for_us
 		)
 
 
+def reset_channel_done_state(channel_id: str) -> list:
+	"""
+	Mark the channel as "not done" for every member who had marked it as done.
+
+	Runs a single UPDATE for the whole channel and returns the list of users whose state was reset
+	"""
+	done_users = frappe.get_all(
+		"Raven Channel Member",
+		filters={"channel_id": channel_id, "is_done": 1},
+		pluck="user_id",
+	)
+
+	if done_users:
+		raven_channel_member = frappe.qb.DocType("Raven Channel Member")
+		(
+			frappe.qb.update(raven_channel_member)
+			.set(raven_channel_member.is_done, 0)
+			.where(raven_channel_member.channel_id == channel_id)
+			.where(raven_channel_member.is_done == 1)
+		).run()
+		invalidate_sidebar(done_users)
+
+	return done_users
+
+
+def publish_realtime_to_users(events: list, after_commit: bool = False):
+	"""
+	Publish realtime events to many users in a single Redis round trip.
+
+	`events` is a list of (event, message, users) tuples. Each message is serialized once
+	and all the publishes are sent through one pipeline instead of one `publish_realtime` call per user.
+	"""
+	publish_realtime_to_rooms(
+		[(event, message, [get_user_room(user) for user in users]) for event, message, users in events],
+		after_commit=after_commit,
+	)
+
+
+def publish_realtime_to_rooms(events: list, after_commit: bool = False):
+	"""
+	Publish realtime events to many rooms in a single Redis round trip.
+
+	`events` is a list of (event, message, rooms) tuples. With `after_commit`, the events are
+	dropped if the transaction is rolled back (the after commit callbacks are reset on rollback).
+	"""
+	# Like `frappe.publish_realtime` - no events while the site is installed, migrated or patched
+	if frappe.flags.in_install or frappe.flags.in_migrate or frappe.flags.in_patch:
+		return
+
+	payloads = []
+	for event, message, rooms in events:
+		serialized_message = frappe.as_json(message)
+		for room in rooms:
+			payloads.append(
+				'{"event": %s, "message": %s, "room": %s, "namespace": %s}'
+				% (
+					json.dumps(event),
+					serialized_message,
+					json.dumps(room),
+					json.dumps(frappe.local.site),
+				)
+			)
+
+	if not payloads:
+		return
+
+	def _publish():
+		try:
+			pipeline = get_redis_connection_without_auth().pipeline(transaction=False)
+			for payload in payloads:
+				pipeline.publish("events", payload)
+			pipeline.execute()
+		except redis.exceptions.ConnectionError:
+			pass
+
+	if after_commit:
+		frappe.db.after_commit.add(_publish)
+	else:
+		_publish()
+
+
+# Doctypes with linked messages
+LINKED_DOCTYPES_CACHE_KEY = "raven:linked_doctypes"
+# A reader whose snapshot predates a new linked doctype can fill the cache again without it,
+# after it was cleared - it expires, so that the doctype is not missing for good
+LINKED_DOCTYPES_CACHE_EXPIRY = 5 * 60
+
+
+def get_linked_doctypes() -> set:
+	"""
+	Gets the doctypes which have at least one message linked to them (link_doctype) from the cache.
+	Forms of the other doctypes do not need to look for linked messages.
+	"""
+	data = frappe.cache().get_value(LINKED_DOCTYPES_CACHE_KEY)
+	if data is not None:
+		return data
+
+	message = frappe.qb.DocType("Raven Message")
+	data = set(
+		frappe.qb.from_(message)
+		.select(message.link_doctype)
+		.distinct()
+		.where(message.link_doctype.isnotnull())
+		.run(pluck=True)
+	)
+	frappe.cache().set_value(
+		LINKED_DOCTYPES_CACHE_KEY, data, expires_in_sec=LINKED_DOCTYPES_CACHE_EXPIRY
+	)
+	return data
+
+
+def add_linked_doctypes(doctypes: list):
+	"""
+	Clear the cache once messages linked to new doctypes are committed.
+	It is cleared after the commit so that it is not filled again without them in the meantime.
+	"""
+	doctypes = {doctype for doctype in doctypes if doctype}
+	if doctypes - get_linked_doctypes():
+		frappe.db.after_commit.add(lambda: frappe.cache().delete_value(LINKED_DOCTYPES_CACHE_KEY))
+
+
 # Workspace Members
 def get_workspace_members(workspace_id: str):
 	"""
@@ -159,12 +300,55 @@ def get_channel_members(channel_id: str):
 	"""
 	Gets all members of a channel from the cache as a map - also includes the type of the user
 	"""
-	cache_key = f"raven:channel_members:{channel_id}"
+	cache_key = get_channel_members_cache_key(channel_id)
 
 	data = frappe.cache().get_value(cache_key)
 	if data:
 		return data
 
+	data = fetch_channel_members([channel_id]).get(channel_id, {})
+	frappe.cache().set_value(cache_key, data)
+	return data
+
+
+def get_channel_members_many(channel_ids: list) -> dict:
+	"""
+	Gets the members of many channels as a map of channel ID to members (see get_channel_members).
+
+	The cached channels are read with one round trip to Redis, the others with one query,
+	and are then cached with one more round trip.
+	"""
+	channel_ids = list(dict.fromkeys(channel_id for channel_id in channel_ids if channel_id))
+	if not channel_ids:
+		return {}
+
+	cache = frappe.cache()
+	keys = [cache.make_key(get_channel_members_cache_key(channel_id)) for channel_id in channel_ids]
+
+	members = {}
+	for channel_id, value in zip(channel_ids, cache.mget(keys)):
+		if value is not None:
+			members[channel_id] = pickle.loads(value)
+
+	missing = [channel_id for channel_id in channel_ids if channel_id not in members]
+	if missing:
+		fetched = fetch_channel_members(missing)
+
+		pipeline = cache.pipeline(transaction=False)
+		for channel_id in missing:
+			members[channel_id] = fetched.get(channel_id, {})
+			pipeline.set(
+				cache.make_key(get_channel_members_cache_key(channel_id)), pickle.dumps(members[channel_id])
+			)
+		pipeline.execute()
+
+	return members
+
+
+def fetch_channel_members(channel_ids: list) -> dict:
+	"""
+	Members of channels from the database as a map of channel ID to members
+	"""
 	raven_channel_member = frappe.qb.DocType("Raven Channel Member")
 	raven_user = frappe.qb.DocType("Raven User")
 
@@ -173,30 +357,34 @@ def get_channel_members(channel_id: str):
 		.join(raven_user)
 		.on(raven_channel_member.user_id == raven_user.name)
 		.select(
+			raven_channel_member.channel_id,
 			raven_channel_member.name,
 			raven_channel_member.user_id,
 			raven_channel_member.is_admin,
 			raven_channel_member.allow_notifications,
 			raven_user.type,
 		)
-		.where(raven_channel_member.channel_id == channel_id)
+		.where(raven_channel_member.channel_id.isin(channel_ids))
 	)
 
-	members = query.run(as_dict=True)
+	data = {}
+	for member in query.run(as_dict=True):
+		data.setdefault(member.pop("channel_id"), {})[member.user_id] = member
 
-	data = {member.user_id: member for member in members}
-	frappe.cache().set_value(cache_key, data)
 	return data
 
 
+def get_channel_members_cache_key(channel_id: str) -> str:
+	return f"raven:channel_members:{channel_id}"
+
+
 def delete_channel_members_cache(channel_id: str):
 	"""
 	Delete the channel members cache and clear the push tokens for the channel if the flag is set to True
 
 	By default, the push tokens are cleared when the channel members cache is deleted
 	"""
-	cache_key = f"raven:channel_members:{channel_id}"
-	frappe.cache().delete_value(cache_key)
+	frappe.cache().delete_value(get_channel_members_cache_key(channel_id))
 
 	frappe.publish_realtime(
 		"channel_members_updated",